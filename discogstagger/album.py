@@ -2,14 +2,71 @@ import logging
 
 logger = logging
 
-class BaseObject(object):
+# the unicode strings shared by the albums (the builtin intern handles str
+# only and unicode strings cannot be referenced weakly), the table is cleared
+# once it holds MAX_INTERNED strings, so that the strings of albums dropped
+# long ago are not kept forever
+MAX_INTERNED = 100000
+
+_interned = {}
+
+def intern_string(value):
+    """ returns the shared copy of the given string, repeated artists, labels
+        or genres are kept only once in memory (even for many albums)
+    """
+    if type(value) is str:
+        return intern(value)
+    elif type(value) is unicode:
+        shared = _interned.get(value)
+        if shared is None:
+            if len(_interned) >= MAX_INTERNED:
+                clear_interned()
+            shared = _interned[value] = value
+        return shared
+    return value
+
+def clear_interned():
+    """ forgets the shared unicode strings (the albums keep their copies) """
+    _interned.clear()
+
+def intern_strings(values):
+    """ returns a list of the shared copies of the given strings """
+    if values is None:
+        return None
+    return [intern_string(value) for value in values]
 
-    pass
+class BaseObject(object):
+    """ the tagger objects keep their attributes in slots (instead of a dict
+        per object) to hold many albums in memory. Only the attributes named in
+        __slots__ can be set, setting any other attribute raises an
+        AttributeError (reading an unset attribute of a track or an album
+        returns None).
+    """
+
+    __slots__ = ()
+
+    def __getstate__(self):
+        # slots are not pickled by the protocols 0 and 1, only the set slots are kept
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                try:
+                    state[name] = getattr(cls, name).__get__(self, cls)
+                except AttributeError:
+                    pass
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
 
 class Track(BaseObject):
     """ A disc contains several tracks, each track has a tracknumber,
         a title, an artist """
 
+    __slots__ = ("tracknumber", "title", "artists", "discsubtitle", "position",
+                 "discnumber", "sort_artist", "new_file", "orig_file")
+
     def __init__(self, tracknumber, title, artists):
         self.tracknumber = tracknumber
         self.title = title
@@ -21,6 +78,9 @@ class Track(BaseObject):
         return self.artists[0]
 
     def __getattr__(self, name):
+        # special methods (e.g. __getstate__ used by pickle) are not tags
+        if name.startswith("__"):
+            raise AttributeError(name)
         return None
 
 class Disc(BaseObject):
@@ -28,6 +88,8 @@ class Disc(BaseObject):
         could have also a disctitle, furthermore several tracks
         are on each disc """
 
+    __slots__ = ("discnumber", "tracks", "target_dir", "sourcedir", "copy_files")
+
     def __init__(self, discnumber):
         self.discnumber = discnumber
         self.tracks = []
@@ -40,6 +102,11 @@ class Album(BaseObject):
         (special case: Various), a source identifier (eg. discogs_id)
         and a catno """
 
+    __slots__ = ("id", "artists", "title", "discs", "fileformat", "genres", "styles",
+                 "sort_artist", "url", "catnumbers", "labels", "images", "year",
+                 "country", "notes", "disctotal", "is_compilation", "master_id",
+                 "sourcedir", "target_dir", "copy_files", "snapshot")
+
     def __init__(self, identifier, title, artists):
         self.id = identifier
         self.artists = artists
@@ -72,4 +139,7 @@ class Album(BaseObject):
             return None
 
     def __getattr__(self, name):
-        return None
\ No newline at end of file
+        # special methods (e.g. __getstate__ used by pickle) are not tags
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return None
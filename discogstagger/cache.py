@@ -0,0 +1,577 @@
+import os
+import errno
+import json
+import time
+import shutil
+import pickle
+import hashlib
+import sqlite3
+import threading
+import logging
+
+logger = logging
+
+def mkdir_p(path):
+    try:
+        os.makedirs(path)
+    except OSError as exc:
+        if exc.errno == errno.EEXIST and os.path.isdir(path):
+            pass
+        else: raise
+
+def cache_dir(tagger_config):
+    """ returns the directory used for all persistent caches (see config option
+        cache:dir), the directory is not created before a cache is really used
+    """
+    return os.path.expanduser(tagger_config.get("cache", "dir"))
+
+class SqliteCache(object):
+    """ base class for the caches stored in a sqlite database. The database
+        is opened lazily, so that just creating a cache does not touch the
+        filesystem, and may be shared between threads (all access is guarded
+        by a lock).
+    """
+
+    SCHEMA = ()
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+
+        self._lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            mkdir_p(os.path.dirname(self.cache_file))
+            self._connection = sqlite3.connect(self.cache_file, check_same_thread=False)
+            for statement in self.SCHEMA:
+                self._connection.execute(statement)
+            self._connection.commit()
+
+        return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+class ReleaseCache(SqliteCache):
+    """ persistent, size-bounded cache of the release metadata fetched from the
+        discogs api server. The json data of each release is stored in a sqlite
+        database keyed by the release id. Entries older than ttl seconds are
+        not returned anymore, if more than max_entries releases are stored,
+        the least recently used ones are evicted.
+    """
+
+    SCHEMA = ("""CREATE TABLE IF NOT EXISTS releases (
+                   release_id INTEGER PRIMARY KEY,
+                   data TEXT NOT NULL,
+                   fetched REAL NOT NULL,
+                   accessed REAL NOT NULL)""",
+              """CREATE INDEX IF NOT EXISTS releases_accessed ON releases (accessed)""")
+
+    def __init__(self, cache_file, max_entries=25000, ttl=2592000):
+        SqliteCache.__init__(self, cache_file)
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, tagger_config):
+        """ creates the release cache configured in the section cache, returns
+            None if the cache is disabled
+        """
+        if not tagger_config.getboolean("cache", "release_cache"):
+            return None
+
+        cache_file = os.path.join(cache_dir(tagger_config), "releases.db")
+
+        return cls(cache_file,
+                   tagger_config.getint("cache", "release_cache_size"),
+                   tagger_config.getint("cache", "release_cache_ttl"))
+
+    def _expired(self, fetched, now):
+        return self.ttl and fetched < now - self.ttl
+
+    def contains(self, release_id, expired=False):
+        """ checks if the given release is cached (expired entries only count,
+            if expired is True)
+        """
+        with self._lock:
+            row = self.connection.execute("SELECT fetched FROM releases WHERE release_id = ?",
+                                          (int(release_id),)).fetchone()
+
+        return row is not None and (expired or not self._expired(row[0], time.time()))
+
+    def get(self, release_id, expired=False):
+        """ returns the cached json data (as dict) of the given release or None,
+            if the release is not cached or the entry is expired. If expired is
+            True, expired entries are returned as well (e.g. when offline).
+        """
+        now = time.time()
+
+        with self._lock:
+            row = self.connection.execute("SELECT data, fetched FROM releases WHERE release_id = ?",
+                                          (int(release_id),)).fetchone()
+
+            if row is not None and not expired and self._expired(row[1], now):
+                logger.debug("cached release %s is expired" % release_id)
+                self.connection.execute("DELETE FROM releases WHERE release_id = ?", (int(release_id),))
+                self.connection.commit()
+                row = None
+
+            if row is None:
+                self.misses = self.misses + 1
+                return None
+
+            self.connection.execute("UPDATE releases SET accessed = ? WHERE release_id = ?",
+                                    (now, int(release_id)))
+            self.connection.commit()
+
+        self.hits = self.hits + 1
+
+        return json.loads(row[0])
+
+    def put(self, release_id, data):
+        """ stores the json data (dict) of the given release, evicts the least
+            recently used releases if the cache is full
+        """
+        now = time.time()
+
+        with self._lock:
+            self.connection.execute("INSERT OR REPLACE INTO releases VALUES (?, ?, ?, ?)",
+                                    (int(release_id), json.dumps(data), now, now))
+
+            count = self.connection.execute("SELECT COUNT(*) FROM releases").fetchone()[0]
+
+            if self.max_entries and count > self.max_entries:
+                overflow = count - self.max_entries
+                logger.debug("evicting %d releases from the release cache" % overflow)
+                self.connection.execute("""DELETE FROM releases WHERE release_id IN
+                                           (SELECT release_id FROM releases ORDER BY accessed LIMIT ?)""",
+                                        (overflow,))
+                self.evictions = self.evictions + overflow
+
+            self.connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM releases").fetchone()[0]
+
+    def ids(self):
+        """ returns all cached release ids (sorted, expired ones included) """
+        with self._lock:
+            return [row[0] for row in
+                    self.connection.execute("SELECT release_id FROM releases ORDER BY release_id")]
+
+    @property
+    def stats(self):
+        """ hit/miss counters of this run """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+class AlbumCache(SqliteCache):
+    """ persistent cache of the mapped albums (see DiscogsAlbum.map), to skip
+        the mapping of unchanged releases. The pickled albums are keyed by the
+        release id, the digest of the release data they were mapped from and
+        the version of the mapping code (see mapper_version), an album mapped
+        from other data or by other code is not returned. If more than
+        max_entries albums are stored, the least recently used are evicted.
+    """
+
+    SCHEMA = ("""CREATE TABLE IF NOT EXISTS albums (
+                   release_id INTEGER PRIMARY KEY,
+                   digest TEXT NOT NULL,
+                   mapper_version TEXT NOT NULL,
+                   album BLOB NOT NULL,
+                   accessed REAL NOT NULL)""",
+              """CREATE INDEX IF NOT EXISTS albums_accessed ON albums (accessed)""")
+
+    def __init__(self, cache_file, mapper_version, max_entries=25000):
+        SqliteCache.__init__(self, cache_file)
+
+        self.mapper_version = mapper_version
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, tagger_config, mapper_version):
+        """ creates the album cache configured in the section cache, returns
+            None if the cache is disabled
+        """
+        if not tagger_config.getboolean("cache", "album_cache"):
+            return None
+
+        cache_file = os.path.join(cache_dir(tagger_config), "albums.db")
+
+        return cls(cache_file, mapper_version, tagger_config.getint("cache", "album_cache_size"))
+
+    def get(self, release_id, digest):
+        """ returns the album mapped from the release data with the given digest
+            by the current mapping code or None
+        """
+        with self._lock:
+            row = self.connection.execute("SELECT digest, mapper_version, album FROM albums WHERE release_id = ?",
+                                          (int(release_id),)).fetchone()
+
+            if row is None:
+                self.misses = self.misses + 1
+                return None
+
+            if row[0] != digest or row[1] != self.mapper_version:
+                logger.debug("cached album %s is stale" % release_id)
+                self.stale = self.stale + 1
+                return None
+
+            self.connection.execute("UPDATE albums SET accessed = ? WHERE release_id = ?",
+                                    (time.time(), int(release_id)))
+            self.connection.commit()
+
+        self.hits = self.hits + 1
+
+        return pickle.loads(str(row[2]))
+
+    def put(self, release_id, digest, album):
+        """ stores the album mapped from the release data with the given digest,
+            evicts the least recently used albums if the cache is full
+        """
+        data = sqlite3.Binary(pickle.dumps(album, pickle.HIGHEST_PROTOCOL))
+
+        with self._lock:
+            self.connection.execute("INSERT OR REPLACE INTO albums VALUES (?, ?, ?, ?, ?)",
+                                    (int(release_id), digest, self.mapper_version, data, time.time()))
+
+            count = self.connection.execute("SELECT COUNT(*) FROM albums").fetchone()[0]
+
+            if self.max_entries and count > self.max_entries:
+                overflow = count - self.max_entries
+                logger.debug("evicting %d albums from the album cache" % overflow)
+                self.connection.execute("""DELETE FROM albums WHERE release_id IN
+                                           (SELECT release_id FROM albums ORDER BY accessed LIMIT ?)""",
+                                        (overflow,))
+                self.evictions = self.evictions + overflow
+
+            self.connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM albums").fetchone()[0]
+
+    @property
+    def stats(self):
+        """ hit/miss counters of this run (stale: mapped from other data or by other code) """
+        return {"hits": self.hits, "misses": self.misses, "stale": self.stale,
+                "evictions": self.evictions}
+
+class ImageStore(SqliteCache):
+    """ content addressed store for the images downloaded from discogs, shared
+        by all albums and runs. The images are stored by the sha1 of their
+        content (so the same artwork is stored only once), the index maps the
+        image urls to those hashes. Images are copied (or hard linked, if this
+        is not possible) into the album directories.
+        If the images stored take more than max_size bytes, the least recently
+        used ones are evicted.
+    """
+
+    SCHEMA = ("""CREATE TABLE IF NOT EXISTS images (
+                   url TEXT PRIMARY KEY,
+                   digest TEXT NOT NULL,
+                   size INTEGER NOT NULL,
+                   accessed REAL NOT NULL)""",
+              """CREATE INDEX IF NOT EXISTS images_digest ON images (digest)""",
+              """CREATE INDEX IF NOT EXISTS images_accessed ON images (accessed)""")
+
+    def __init__(self, store_dir, max_size=2147483648, use_links=False):
+        self.store_dir = store_dir
+        self.max_size = max_size
+        self.use_links = use_links
+
+        SqliteCache.__init__(self, os.path.join(store_dir, "images.db"))
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, tagger_config):
+        """ creates the image store configured in the section cache, returns
+            None if the store is disabled
+        """
+        if not tagger_config.getboolean("cache", "image_store"):
+            return None
+
+        return cls(os.path.join(cache_dir(tagger_config), "images"),
+                   tagger_config.getint("cache", "image_store_size") * 1024 * 1024,
+                   tagger_config.getboolean("cache", "image_store_links"))
+
+    def object_path(self, digest):
+        return os.path.join(self.store_dir, "objects", digest[:2], digest)
+
+    def incoming_path(self, image_url):
+        """ the file a new image should be downloaded to, before it is added """
+        incoming_dir = os.path.join(self.store_dir, "incoming")
+        mkdir_p(incoming_dir)
+
+        return os.path.join(incoming_dir, hashlib.sha1(image_url).hexdigest())
+
+    def lookup(self, image_url):
+        """ returns the stored file for the given url or None """
+        with self._lock:
+            row = self.connection.execute("SELECT digest, size FROM images WHERE url = ?",
+                                          (image_url,)).fetchone()
+
+            if row is None or not os.path.exists(self.object_path(row[0])):
+                self.misses = self.misses + 1
+                return None
+
+            self.connection.execute("UPDATE images SET accessed = ? WHERE url = ?",
+                                    (time.time(), image_url))
+            self.connection.commit()
+
+            self.hits = self.hits + 1
+            self.bytes_saved = self.bytes_saved + row[1]
+
+        return self.object_path(row[0])
+
+    def add(self, image_url, image_file):
+        """ moves the given (downloaded) file into the store and returns the
+            stored file
+        """
+        digest = hashlib.sha1()
+        with open(image_file, "rb") as fh:
+            for chunk in iter(lambda: fh.read(65536), b""):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+
+        object_path = self.object_path(digest)
+        size = os.path.getsize(image_file)
+
+        with self._lock:
+            if os.path.exists(object_path):
+                os.remove(image_file)
+            else:
+                mkdir_p(os.path.dirname(object_path))
+                os.rename(image_file, object_path)
+
+            self.connection.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)",
+                                    (image_url, digest, size, time.time()))
+            self.connection.commit()
+
+            self._evict(digest)
+
+        return object_path
+
+    def _evict(self, keep_digest):
+        """ removes the least recently used images (except the one just added),
+            until the store fits into max_size again (callers hold the lock)
+        """
+        if not self.max_size:
+            return
+
+        total = self.connection.execute("""SELECT COALESCE(SUM(size), 0) FROM
+                                           (SELECT DISTINCT digest, size FROM images)""").fetchone()[0]
+
+        while total > self.max_size:
+            row = self.connection.execute("""SELECT digest, size FROM images WHERE digest != ?
+                                             GROUP BY digest ORDER BY MAX(accessed) LIMIT 1""",
+                                          (keep_digest,)).fetchone()
+            if row is None:
+                break
+
+            digest, size = row
+            logger.debug("evicting image %s from the image store" % digest)
+
+            self.connection.execute("DELETE FROM images WHERE digest = ?", (digest,))
+            if os.path.exists(self.object_path(digest)):
+                os.remove(self.object_path(digest))
+
+            total = total - size
+            self.evictions = self.evictions + 1
+
+        self.connection.commit()
+
+    def link(self, stored_file, target_file):
+        """ makes the stored file available as target_file, a copy or (if
+            use_links) a hard link, which shares the data with the stored file
+            and all other albums linked to it
+        """
+        temp_file = "%s.%d.%d.tmp" % (target_file, os.getpid(), threading.current_thread().ident)
+
+        if self.use_links:
+            try:
+                os.link(stored_file, temp_file)
+            except OSError:
+                shutil.copyfile(stored_file, temp_file)
+        else:
+            shutil.copyfile(stored_file, temp_file)
+
+        os.rename(temp_file, target_file)
+
+    def fetch(self, image_url, target_file):
+        """ links the image with the given url to target_file, returns False if
+            the image is not in the store
+        """
+        stored_file = self.lookup(image_url)
+
+        if stored_file is None:
+            return False
+
+        logger.debug("using stored image for %s" % image_url)
+        self.link(stored_file, target_file)
+
+        return True
+
+    @property
+    def stats(self):
+        """ hits are image downloads (quota) saved """
+        return {"hits": self.hits, "misses": self.misses,
+                "bytes_saved": self.bytes_saved, "evictions": self.evictions}
+
+class ImageQuota(SqliteCache):
+    """ keeps track of the image downloads per day, since discogs allows only
+        a limited number of image downloads per day (see fetch_image).
+        The last cover_reserve downloads of a day are kept for album covers,
+        all images which cannot be downloaded today are put into a queue,
+        which can be processed on a later day (see
+        DiscogsConnector.fetch_deferred_images).
+    """
+
+    SCHEMA = ("""CREATE TABLE IF NOT EXISTS usage (
+                   day TEXT PRIMARY KEY,
+                   used INTEGER NOT NULL)""",
+              """CREATE TABLE IF NOT EXISTS deferred (
+                   image_file TEXT PRIMARY KEY,
+                   image_url TEXT NOT NULL,
+                   cover INTEGER NOT NULL,
+                   added REAL NOT NULL)""")
+
+    def __init__(self, cache_file, daily_quota=1000, cover_reserve=100):
+        SqliteCache.__init__(self, cache_file)
+
+        self.daily_quota = daily_quota
+        self.cover_reserve = cover_reserve
+
+        self.deferred_count = 0
+
+    @classmethod
+    def from_config(cls, tagger_config):
+        """ creates the quota accountant configured in the section images, returns
+            None if no daily quota is set
+        """
+        daily_quota = tagger_config.getint("images", "daily_quota")
+
+        if not daily_quota:
+            return None
+
+        return cls(os.path.join(cache_dir(tagger_config), "image-quota.db"), daily_quota,
+                   tagger_config.getint("images", "cover_reserve"))
+
+    def today(self):
+        # discogs resets the quota at midnight UTC
+        return time.strftime("%Y-%m-%d", time.gmtime())
+
+    def _used(self, day):
+        row = self.connection.execute("SELECT used FROM usage WHERE day = ?", (day,)).fetchone()
+        if row is None:
+            return 0
+        return row[0]
+
+    @property
+    def used(self):
+        """ number of images downloaded today """
+        with self._lock:
+            return self._used(self.today())
+
+    def allot(self, images, covers=()):
+        """ returns the images out of the given list of (image_file, image_url)
+            tuples, which can be downloaded today and counts them as used.
+            All other images are deferred, images in covers may use the
+            budget reserved for covers.
+        """
+        granted = []
+        deferred = []
+
+        with self._lock:
+            day = self.today()
+            used = self._used(day)
+
+            for image in images:
+                reserve = 0 if image in covers else self.cover_reserve
+
+                if used + 1 + reserve <= self.daily_quota:
+                    granted.append(image)
+                    used = used + 1
+                else:
+                    deferred.append(image)
+
+            self.connection.execute("INSERT OR REPLACE INTO usage VALUES (?, ?)", (day, used))
+            self._defer(deferred, covers)
+
+            self.connection.commit()
+
+        if deferred:
+            logger.warn("daily image quota exhausted, deferring %d images" % len(deferred))
+
+        return granted
+
+    def give_back(self, count):
+        """ returns the budget of count images allotted today, which were not
+            downloaded after all (e.g. because the download failed)
+        """
+        with self._lock:
+            day = self.today()
+            used = max(0, self._used(day) - count)
+
+            self.connection.execute("INSERT OR REPLACE INTO usage VALUES (?, ?)", (day, used))
+            self.connection.commit()
+
+    def _defer(self, images, covers):
+        now = time.time()
+        for image_file, image_url in images:
+            self.connection.execute("INSERT OR REPLACE INTO deferred VALUES (?, ?, ?, ?)",
+                                    (image_file, image_url, (image_file, image_url) in covers, now))
+
+        self.deferred_count = self.deferred_count + len(images)
+
+    def defer(self, images, covers=()):
+        """ queues the given images without downloading any of them (e.g. when
+            offline)
+        """
+        with self._lock:
+            self._defer(images, covers)
+            self.connection.commit()
+
+    def deferred(self, limit=None):
+        """ returns the queued images as (image_file, image_url, cover) tuples,
+            covers first
+        """
+        with self._lock:
+            return [(image_file, image_url, bool(cover)) for image_file, image_url, cover in
+                    self.connection.execute("""SELECT image_file, image_url, cover FROM deferred
+                                               ORDER BY cover DESC, added LIMIT ?""",
+                                            (limit or -1,))]
+
+    def remove(self, image_file):
+        """ removes the given image from the queue (e.g. after downloading it) """
+        with self._lock:
+            self.connection.execute("DELETE FROM deferred WHERE image_file = ?", (image_file,))
+            self.connection.commit()
+
+    @property
+    def stats(self):
+        with self._lock:
+            queued = self.connection.execute("SELECT COUNT(*) FROM deferred").fetchone()[0]
+            used = self._used(self.today())
+
+        return {"used": used, "quota": self.daily_quota,
+                "deferred": self.deferred_count, "queued": queued}
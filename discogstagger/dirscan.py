@@ -0,0 +1,115 @@
+import os
+import collections
+import logging
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # the backport of os.scandir (pip install scandir)
+        from scandir import scandir
+    except ImportError:
+        # the entries are listed and stat'ed one by one
+        scandir = None
+
+logger = logging
+
+# an entry of a directory, only the type is read (not the size or the mtime,
+# which would need a stat of each entry)
+Entry = collections.namedtuple("Entry", ["name", "is_dir"])
+
+def _scan(path):
+    """ yields the entries of the given directory (links are followed), with
+        scandir the type is taken from the directory listing (d_type), so
+        that the entries are not stat'ed
+    """
+    if scandir is not None:
+        for dir_entry in scandir(path):
+            yield Entry(dir_entry.name, dir_entry.is_dir())
+    else:
+        for name in os.listdir(path):
+            yield Entry(name, os.path.isdir(os.path.join(path, name)))
+
+class DirectorySnapshot(object):
+    """ the entries (names and types) of a directory and its subdirectories
+        (up to the given depth), read once (using scandir, if available) and
+        not changed afterwards, so that the later stages of the tagging do not
+        need to list and stat the same files again
+    """
+
+    def __init__(self, path, entries, subdirs):
+        self.path = path
+        self._entries = dict((entry.name, entry) for entry in entries)
+        self._names = tuple(sorted(self._entries))
+        self._subdirs = subdirs
+
+    @classmethod
+    def scan(cls, path, depth=1):
+        """ reads the given directory, raises OSError if it cannot be read """
+        entries = list(_scan(path))
+
+        subdirs = {}
+        if depth > 0:
+            for entry in entries:
+                if entry.is_dir:
+                    try:
+                        subdirs[entry.name] = cls.scan(os.path.join(path, entry.name), depth - 1)
+                    except OSError as e:
+                        logger.warn("cannot read directory %s: %s" % (os.path.join(path, entry.name), e))
+
+        return cls(path, entries, subdirs)
+
+    def names(self):
+        """ the sorted names of all entries """
+        return list(self._names)
+
+    def dirs(self):
+        """ the sorted names of the subdirectories """
+        return [name for name in self._names if self._entries[name].is_dir]
+
+    def files(self):
+        """ the sorted names of all other entries """
+        return [name for name in self._names if not self._entries[name].is_dir]
+
+    def entry(self, name):
+        """ the Entry of the given name, None if there is none """
+        return self._entries.get(name)
+
+    def subdir(self, name):
+        """ the snapshot of the given subdirectory, None if it was not read """
+        return self._subdirs.get(name)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+def missing_files(paths, snapshot=None):
+    """ the given paths that do not exist. The files are looked up in the given
+        snapshot (and its subdirectories), all other folders are read once
+        (instead of checking each file)
+    """
+    snapshots = {}
+
+    if snapshot is not None:
+        snapshots[snapshot.path] = snapshot
+        for name in snapshot.dirs():
+            if snapshot.subdir(name) is not None:
+                snapshots[os.path.join(snapshot.path, name)] = snapshot.subdir(name)
+
+    missing = []
+
+    for path in paths:
+        folder, name = os.path.split(path)
+
+        if not folder in snapshots:
+            try:
+                snapshots[folder] = DirectorySnapshot.scan(folder, depth=0)
+            except OSError:
+                snapshots[folder] = None
+
+        if snapshots[folder] is None or not name in snapshots[folder]:
+            missing.append(path)
+
+    return missing
@@ -1,30 +1,141 @@
 import logging
 import re
 import os
-import urllib
+import sys
+import hashlib
+import inspect
 
-import time
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 import discogs_client as discogs
 
 import json
 
-from album import Album, Disc, Track
+from album import Album, Disc, Track, intern_string, intern_strings
+from cache import ReleaseCache, AlbumCache, ImageStore, ImageQuota
+from releasestore import ReleaseStore
+from ratelimit import TokenBucket
+from position import position_parser
+from network import NetworkPolicy, DiscogsFetcher, ImageDownloader, create_session
 
 logger = logging
 
+# the patterns used during the mapping, compiled only once
+YEAR = re.compile("\d\d\d\d")
+DUPLICATE_HANDLING = re.compile("\s\(\d+\)")
+CLEAN_NAME_GROUPS = (
+    (re.compile("(.*),\sThe$"), "The \g<1>"),
+)
+
+class NameCache(object):
+    """ bounded memo of the names normalized by the given function (e.g. the
+        artist and label names, which are repeated on every track of an album
+        and on many albums), the normalized names are interned. If more than
+        max_entries names are cached, the oldest ones are evicted.
+    """
+
+    def __init__(self, normalize, max_entries=50000):
+        self.normalize = normalize
+        self.max_entries = max_entries
+
+        self._names = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __call__(self, name):
+        try:
+            result = self._names[name]
+            self.hits = self.hits + 1
+            return result
+        except KeyError:
+            pass
+
+        self.misses = self.misses + 1
+        result = intern_string(self.normalize(name))
+
+        if len(self._names) >= self.max_entries:
+            self._names.popitem(last=False)
+            self.evictions = self.evictions + 1
+
+        self._names[name] = result
+
+        return result
+
+    def __len__(self):
+        return len(self._names)
+
+    @property
+    def stats(self):
+        """ hit/miss counters (of the whole run) """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": float(self.hits) / lookups if lookups else 0.0}
+
+def _clean_duplicate_handling(name):
+    return DUPLICATE_HANDLING.sub("", name)
+
+def _clean_name(name):
+    name = _clean_duplicate_handling(name)
+
+    for regex, replacement in CLEAN_NAME_GROUPS:
+        name = regex.sub(replacement, name)
+
+    return name
+
+def _join_artists(credits):
+    """ the track artists of the given credits (strings or the names and joins of artists) """
+    artists = []
+    last_artist = None
+    join = None
+
+    for x in credits:
+        if isinstance(x, basestring):
+            if last_artist:
+                last_artist = last_artist + " " + x
+            else:
+                last_artist = x
+        else:
+            name, artist_join = x
+            if not last_artist == None:
+                concatString = " "
+                if not join == None:
+                    concatString = " " + join + " "
+
+                last_artist = last_artist + concatString + clean_name_cache(name)
+                artists.append(last_artist)
+                last_artist = None
+            else:
+                join = artist_join
+                last_artist = clean_name_cache(name)
+
+    artists.append(last_artist)
+
+    return tuple(intern_strings(artists))
+
+# the normalized names, shared by all albums mapped in this process
+duplicate_handling_cache = NameCache(_clean_duplicate_handling)
+clean_name_cache = NameCache(_clean_name)
+artist_credit_cache = NameCache(_join_artists)
+
+# the version of the mapping, increase it if the mapped albums change without
+# a change of the mapping code (see mapper_version)
+MAPPER_VERSION = 1
+
 class AlbumError(Exception):
     """ A central exception for all errors happening during the album handling
     """
     def __init__(self, value):
+        # the args are needed to pickle the error (see map_many)
+        Exception.__init__(self, value)
         self.value = value
 
     def __str__(self):
         return repr(self.value)
 
-class RateLimit(object):
-    pass
-
 class DiscogsConnector(object):
     """ central class to connect to the discogs api server.
         this should be a singleton, to allow the usage of authentication and rate-limiting
@@ -37,11 +148,42 @@ class DiscogsConnector(object):
         self.discogs_client = discogs.Client(self.user_agent)
 
         self.discogs_auth = False
-        self.rate_limit_pool = {}
+        self.rate_limit_pool = {
+            "metadata": TokenBucket.from_config(self.config, "metadata"),
+            "image": TokenBucket.from_config(self.config, "image"),
+        }
+        self.network_policy = NetworkPolicy.from_config(self.config)
+        self.session = create_session(self.user_agent,
+                                      max(self.config.getint("network", "connections"),
+                                          self.config.getint("images", "download_threads")))
+        self.discogs_client._fetcher = DiscogsFetcher(self.rate_limit_pool["metadata"],
+                                                      network_policy=self.network_policy,
+                                                      session=self.session)
+
+        self.image_downloader = ImageDownloader(self.rate_limit_pool["image"], self.user_agent,
+                                                self.config.getint("images", "download_threads"),
+                                                self.config.getint("images", "download_timeout"),
+                                                self.network_policy, self.session)
+
+        self.release_cache = ReleaseCache.from_config(self.config)
+        self.album_cache = AlbumCache.from_config(self.config, mapper_version())
+        self.release_store = ReleaseStore.from_config(self.config)
+        self.image_store = ImageStore.from_config(self.config)
+        self.image_quota = ImageQuota.from_config(self.config)
 
         skip_auth = self.config.get("discogs", "skip_auth")
-
-        if skip_auth != "True":
+        base_url = self.config.get("discogs", "base_url")
+        self.offline = self.config.getboolean("discogs", "offline")
+
+        if self.offline:
+            logger.info("offline mode, using only the locally available releases and images")
+        elif base_url:
+            # another api server (e.g. the stand-in server, see StandInServer),
+            # which does not need any authentication
+            logger.info("using the discogs api server at %s" % base_url)
+            self.discogs_client._base_url = base_url.rstrip("/")
+            self.discogs_auth = True
+        elif skip_auth != "True":
             self.initialize_auth()
             self.authenticate()
 
@@ -64,7 +206,9 @@ class DiscogsConnector(object):
         if consumer_key and consumer_secret:
             logger.debug('authenticating at discogs using consumer key {0}'.format(consumer_key))
 
-            self.discogs_client.set_consumer_key(consumer_key, consumer_secret)
+            self.discogs_client._fetcher = DiscogsFetcher(self.rate_limit_pool["metadata"],
+                                                          consumer_key, consumer_secret,
+                                                          self.network_policy, self.session)
             self.discogs_auth = True
         else:
             logger.warn('cannot authenticate on discogs (no image download possible) - set consumer_key and consumer_secret')
@@ -72,28 +216,56 @@ class DiscogsConnector(object):
     def fetch_release(self, release_id, source_dir):
         return self.fetch_release(release_id)
 
+    def is_available(self, release_id, source_dir=None):
+        """ checks if the metadata of the given release can be fetched, when
+            offline only the locally available releases (cache and store) are.
+            The source_dir is not used (see LocalDiscogsConnector.is_available).
+        """
+        if not self.offline:
+            return True
+
+        if self.release_cache is not None and self.release_cache.contains(release_id, expired=True):
+            return True
+
+        return self.release_store is not None and release_id in self.release_store
+
     def fetch_release(self, release_id):
         """ fetches the metadata for the given release_id from the discogs api server
-            (authentication necessary as well, specific rate-limit implemented on this one)
+            (authentication necessary as well, the rate-limit is handled by the
+            DiscogsFetcher used by the discogs_client). When offline, expired
+            releases in the cache are used as well.
         """
+        if self.release_cache is not None:
+            data = self.release_cache.get(release_id, expired=self.offline)
+
+            if data is not None:
+                logger.info("using cached release with id %s" % release_id)
+                return discogs.Release(self.discogs_client, data)
+
+        if self.release_store is not None:
+            data = self.release_store.get(release_id)
+
+            if data is not None:
+                logger.info("using stored release with id %s" % release_id)
+                return discogs.Release(self.discogs_client, data)
+
+        if self.offline:
+            raise AlbumError("release %s is not available offline" % release_id)
+
         logger.info("fetching release with id %s" % release_id)
 
         if not self.discogs_auth:
             logger.error('You are not authenticated, cannot download image metadata')
 
-        rate_limit_type = 'metadata'
-
-        if rate_limit_type in self.rate_limit_pool:
-            if self.rate_limit_pool[rate_limit_type].lastcall >= time.time() - 1:
-                logger.warn('Waiting one second to allow rate limiting...')
-                time.sleep(1)
-
-        rl = RateLimit()
-        rl.lastcall = time.time()
+        release = self.discogs_client.release(int(release_id))
 
-        self.rate_limit_pool[rate_limit_type] = rl
+        if self.release_cache is not None:
+            # the discogs_client fetches the data lazily, force the download
+            # to be able to cache the complete release
+            release.refresh()
+            self.release_cache.put(release_id, release.data)
 
-        return self.discogs_client.release(int(release_id))
+        return release
 
     def authenticate(self):
         """ Authenticates the user on the discogs api via oauth 1.0a
@@ -155,26 +327,225 @@ class DiscogsConnector(object):
             be called, to make sure, that the user is authenticated already. Furthermore, discogs restricts the
             download of images to 1000 per day. This can be very low on huge volume collections ;-(
         """
-        rate_limit_type = 'image'
+        self.fetch_images([(image_dir, image_url)])
+
+    def fetch_images(self, images):
+        """
+            Downloads the given list of (image_file, image_url) tuples in parallel (see ImageDownloader),
+            the same restrictions as for fetch_image apply. Images already in the image store are
+            linked from there, without using the download quota.
+            The first image is the cover of the album, if the daily image quota runs short, the rest
+            of the quota is kept for the covers and all other images are deferred (see ImageQuota).
+            When offline, all images not in the image store are deferred.
+        """
+        covers = images[:1]
+
+        if self.image_store:
+            images = [(image_file, image_url) for image_file, image_url in images
+                      if not self.image_store.fetch(image_url, image_file)]
+
+            if not images:
+                return
+
+        if self.offline:
+            if self.image_quota:
+                logger.warn('offline, deferring %d images' % len(images))
+                self.image_quota.defer(images, covers)
+            else:
+                logger.warn('offline, skipping %d images' % len(images))
+            return
 
         if not self.discogs_auth:
             logger.error('You are not authenticated, cannot download image - skipping')
             return
 
-        if rate_limit_type in self.rate_limit_pool:
-            if self.rate_limit_pool[rate_limit_type].lastcall >= time.time() - 1:
-                logger.warn('Waiting one second to allow rate limiting...')
-                time.sleep(1)
+        if self.image_quota:
+            images = self.image_quota.allot(images, covers)
 
-        rl = RateLimit()
-        rl.lastcall = time.time()
+        errors = self._download_images(images)
 
-        try:
-            urllib.urlretrieve(image_url,  image_dir)
+        if self.image_quota:
+            # failed downloads are tried again later on, without using up the quota
+            failed = [image for image, error in zip(images, errors) if error is not None]
+
+            if failed:
+                logger.warn('deferring %d images, which could not be downloaded' % len(failed))
+                self.image_quota.give_back(len(failed))
+                self.image_quota.defer(failed, covers)
 
-            self.rate_limit_pool[rate_limit_type] = rl
-        except Exception as e:
-            logger.error("Unable to download image '%s', skipping. (%s)" % (image_url, e))
+    def fetch_deferred_images(self, limit=None):
+        """
+            Downloads the images deferred because of the daily image quota (covers first),
+            as far as the quota of today allows, returns the number of images downloaded
+        """
+        if not self.image_quota:
+            logger.error('No daily image quota configured, no deferred images available')
+            return 0
+
+        if self.offline:
+            logger.error('Offline, cannot download any image')
+            return 0
+
+        if not self.discogs_auth:
+            logger.error('You are not authenticated, cannot download image - skipping')
+            return 0
+
+        images = []
+        covers = []
+        for image_file, image_url, cover in self.image_quota.deferred(limit):
+            if not os.path.isdir(os.path.dirname(image_file)):
+                logger.warn('album directory of %s does not exist anymore, skipping' % image_file)
+                self.image_quota.remove(image_file)
+            elif self.image_store and self.image_store.fetch(image_url, image_file):
+                self.image_quota.remove(image_file)
+            else:
+                images.append((image_file, image_url))
+                if cover:
+                    covers.append((image_file, image_url))
+
+        images = self.image_quota.allot(images, covers)
+        errors = self._download_images(images)
+
+        downloaded = 0
+        for (image_file, image_url), error in zip(images, errors):
+            if error is None:
+                self.image_quota.remove(image_file)
+                downloaded = downloaded + 1
+
+        # the failed images stay in the queue, their budget is given back
+        self.image_quota.give_back(len(images) - downloaded)
+
+        return downloaded
+
+    def _download_images(self, images):
+        """
+            Downloads the given images (thru the image store, if configured), returns the list of
+            errors (None for each successful download)
+        """
+        if not self.image_store:
+            return self.image_downloader.download_all(images)
+
+        downloads = [(self.image_store.incoming_path(image_url), image_url) for image_file, image_url in images]
+        errors = self.image_downloader.download_all(downloads)
+
+        for (image_file, image_url), (incoming_file, x), error in zip(images, downloads, errors):
+            if error is None:
+                stored_file = self.image_store.add(image_url, incoming_file)
+                self.image_store.link(stored_file, image_file)
+
+        return errors
+
+    def close(self):
+        """ stops the image download threads, closes the http session and the caches """
+        self.image_downloader.close()
+        self.session.close()
+
+        for cache in (self.release_cache, self.album_cache, self.release_store, self.image_store,
+                      self.image_quota):
+            if cache is not None:
+                cache.close()
+
+class AsyncDiscogsConnector(object):
+    """ asynchronous variant of the DiscogsConnector: fetch_release, fetch_image
+        and fetch_images return a future immediately (a
+        multiprocessing.pool.AsyncResult, e.g. get() or a callback, as there is
+        neither asyncio nor concurrent.futures on python 2).
+        The requests are done by a fixed number of workers (see config option
+        network:connections), all sharing the http session, the rate limiters,
+        the image quota and the network policy of the delegate. This way the
+        metadata and images of several albums can be in flight at the same time.
+    """
+
+    def __init__(self, delegate_discogs_connector, workers=None):
+        self.delegate = delegate_discogs_connector
+        self.workers = workers or self.delegate.config.getint("network", "connections")
+
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPool(self.workers)
+
+        return self._pool
+
+    def _fetch_release(self, release_id):
+        release = self.delegate.fetch_release(release_id)
+        # the discogs_client fetches lazily, make sure the data is really
+        # fetched by the worker
+        release.fetch("tracklist")
+        return release
+
+    def fetch_release(self, release_id, callback=None):
+        """ fetches the given release, the result is the release """
+        return self.pool.apply_async(self._fetch_release, (release_id,), callback=callback)
+
+    def fetch_releases(self, release_ids):
+        """ fetches all given releases at once, returns the list of futures """
+        return [self.fetch_release(release_id) for release_id in release_ids]
+
+    def fetch_image(self, image_file, image_url, callback=None):
+        return self.fetch_images([(image_file, image_url)], callback)
+
+    def fetch_images(self, images, callback=None):
+        """ fetches the images of an album (see DiscogsConnector.fetch_images) """
+        return self.pool.apply_async(self.delegate.fetch_images, (images,), callback=callback)
+
+    def authenticate(self):
+        self.delegate.authenticate()
+
+    def close(self):
+        """ waits for all outstanding requests, the delegate is not closed """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+# the fields of a release (and its parts) read by DiscogsAlbum.map, all
+# other fields are dropped by decode_release
+RELEASE_FIELDS = ("id", "title", "year", "genres", "styles", "country", "notes", "master_id")
+ARTIST_FIELDS = ("id", "name", "join")
+LABEL_FIELDS = ("name", "catno")
+FORMAT_FIELDS = ("name", "qty", "descriptions")
+IMAGE_FIELDS = ("uri",)
+TRACK_FIELDS = ("position", "title", "duration")
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    elif isinstance(value, list):
+        return [_utf8(element) for element in value]
+    return value
+
+def _select(data, fields):
+    return dict((key, _utf8(data[key])) for key in fields if key in data)
+
+def _select_list(data, key, fields, target):
+    if key in data:
+        target[key] = [_select(element, fields) for element in data[key]]
+
+def decode_release(data):
+    """ returns the release json reduced to the fields used by DiscogsAlbum.map,
+        the strings are encoded as utf-8 (the same way DummyDiscogsAlbum.convert in
+        the tests does it for the complete release). The mapped album is the same
+        as the one mapped from the converted release.
+    """
+    release = _select(data, RELEASE_FIELDS)
+
+    _select_list(data, "artists", ARTIST_FIELDS, release)
+    _select_list(data, "labels", LABEL_FIELDS, release)
+    _select_list(data, "formats", FORMAT_FIELDS, release)
+    _select_list(data, "images", IMAGE_FIELDS, release)
+
+    if "tracklist" in data:
+        tracklist = []
+        for track_data in data["tracklist"]:
+            track = _select(track_data, TRACK_FIELDS)
+            _select_list(track_data, "artists", ARTIST_FIELDS, track)
+            tracklist.append(track)
+        release["tracklist"] = tracklist
+
+    return release
 
 class DummyResponse(object):
     """
@@ -199,23 +570,43 @@ class LocalDiscogsConnector(object):
 
     def __init__(self, delegate_discogs_connector):
         self.delegate = delegate_discogs_connector
+        self.release_store = delegate_discogs_connector.release_store
+
+        # we need a dummy client here ;-(
+        self.client = discogs.Client('Dummy Client - just for testing')
 
     def fetch_release(self, release_id):
         pass
 
-    def fetch_release(self, release_id, source_dir):
-        """ fetches the metadata for the given release_id from a local file
+    def is_available(self, release_id, source_dir=None):
+        """ checks if the metadata of the given release is available locally (in
+            the release store or, if given, in the json file in the source_dir)
         """
-        dummy_response = DummyResponse(release_id, source_dir)
+        if self.release_store is not None and release_id in self.release_store:
+            return True
 
-        # we need a dummy client here ;-(
-        client = discogs.Client('Dummy Client - just for testing')
+        if source_dir is None:
+            return False
+
+        return os.path.exists(os.path.join(source_dir, "%s.json" % release_id))
+
+    def fetch_release(self, release_id, source_dir):
+        """ fetches the metadata for the given release_id from the local release
+            store (see ReleaseStore) or, if it is not stored there, from the
+            <release_id>.json file in the source_dir. Only the fields needed to
+            map the release are decoded (see decode_release).
+        """
+        data = None
+        if self.release_store is not None:
+            data = self.release_store.get(release_id)
 
-        self.content = self.convert(json.loads(dummy_response.content))
+        if data is None:
+            dummy_response = DummyResponse(release_id, source_dir)
+            data = json.loads(dummy_response.content)
 
-        logger.debug('content: %s' % self.content)
+        self.content = decode_release(data)
 
-        release = discogs.Release(client, self.content)
+        release = discogs.Release(self.client, self.content)
 
         return release
 
@@ -225,21 +616,66 @@ class LocalDiscogsConnector(object):
     def fetch_image(self, image_dir, image_url):
         self.delegate.fetch_image(image_dir, image_url)
 
+    def fetch_images(self, images):
+        self.delegate.fetch_images(images)
+
     def updateRateLimits(self, request):
         self.delegate.updateRateLimits(request)
 
-    def convert(self, input):
-        """ This is an exact copy of a method in _common_test, please refactor
-        """
-        if isinstance(input, dict):
-            return {self.convert(key): self.convert(value) for key, value in input.iteritems()}
-        elif isinstance(input, list):
-            return [self.convert(element) for element in input]
-        elif isinstance(input, unicode):
-            return input.encode('utf-8')
-        else:
-            return input
 
+def release_digest(data):
+    """ the digest of the given release data (as used by the album cache) """
+    return hashlib.sha1(json.dumps(data, sort_keys=True)).hexdigest()
+
+_mapper_version = None
+
+def _mapping_sources():
+    """ the code the mapping depends on: the mapped objects, the position parser,
+        the name helpers and the DiscogsAlbum class (but not the connectors)
+    """
+    return [sys.modules[Album.__module__], sys.modules[position_parser.__module__], NameCache,
+            _clean_duplicate_handling, _clean_name, _join_artists, DiscogsAlbum]
+
+def mapper_version():
+    """ the version of the mapping code: MAPPER_VERSION and the digest of the
+        source of the mapping (see _mapping_sources), so that cached albums are
+        mapped again after each change of the mapping code
+    """
+    global _mapper_version
+
+    if _mapper_version is None:
+        digest = hashlib.sha1(discogs.__version__)
+        for source in _mapping_sources():
+            try:
+                digest.update(inspect.getsource(source))
+            except (IOError, TypeError):
+                # no source available, only MAPPER_VERSION can be used
+                logger.warn("no source of %s, cached albums are not checked against it" % source.__name__)
+
+        # the patterns have no source of their own
+        digest.update(repr([YEAR.pattern, DUPLICATE_HANDLING.pattern] +
+                           [(pattern.pattern, replacement) for pattern, replacement in CLEAN_NAME_GROUPS]))
+
+        _mapper_version = "%d-%s" % (MAPPER_VERSION, digest.hexdigest())
+
+    return _mapper_version
+
+# the client used to create the releases mapped by map_many (one per process)
+_map_client = None
+
+def _map_release(data):
+    global _map_client
+
+    if _map_client is None:
+        _map_client = discogs.Client('Dummy Client - just for mapping')
+
+    try:
+        return DiscogsAlbum(discogs.Release(_map_client, data)).map()
+    except AlbumError as ae:
+        return ae
+    except Exception as e:
+        # incomplete release data (e.g. no formats), only this release fails
+        return AlbumError("cannot map release %s: %r" % (data.get("id"), e))
 
 class DiscogsAlbum(object):
     """ Wraps the discogs-client-api script, abstracting the minimal set of
@@ -264,6 +700,56 @@ class DiscogsAlbum(object):
     def __init__(self, release):
         self.release = release
 
+    @staticmethod
+    def map_many(releases, processes=None, chunksize=4):
+        """ maps many releases (discogs.Release objects or their json data) at once,
+            using a pool of processes (one per cpu, if processes is None). Returns the
+            albums in the order of the releases, for releases which cannot be mapped
+            the AlbumError is returned instead of the album.
+        """
+        release_data = []
+        for release in releases:
+            if isinstance(release, discogs.Release):
+                # the discogs_client fetches lazily, make sure the data is complete
+                release.fetch("tracklist")
+                release = release.data
+            release_data.append(release)
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        if processes == 1 or len(release_data) < 2:
+            return [_map_release(data) for data in release_data]
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            return pool.map(_map_release, release_data, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    def map_cached(self, album_cache):
+        """ returns the album from the album cache, if the release did not change
+            since it was mapped (and neither did the mapping code), otherwise the
+            release is mapped and the album is added to the cache
+        """
+        if album_cache is None:
+            return self.map()
+
+        # the discogs_client fetches lazily, make sure the data is complete
+        self.release.fetch("tracklist")
+        digest = release_digest(self.release.data)
+
+        album = album_cache.get(self.release.id, digest)
+
+        if album is None:
+            album = self.map()
+            album_cache.put(self.release.id, digest, album)
+        else:
+            logger.info("using cached album of release %s" % self.release.id)
+
+        return album
+
     def map(self):
         """ map the retrieved information to the tagger specific objects """
 
@@ -271,19 +757,21 @@ class DiscogsAlbum(object):
 
         album.sort_artist = self.sort_artist(self.release.artists)
         album.url = self.url
-        album.catnumbers = [catno for name, catno in self.labels_and_numbers]
-        album.labels = [name for name, catno in self.labels_and_numbers]
+
+        labels_and_numbers = list(self.labels_and_numbers)
+        album.catnumbers = intern_strings([catno for name, catno in labels_and_numbers])
+        album.labels = intern_strings([name for name, catno in labels_and_numbers])
         album.images = self.images
-        album.year = self.year
-        album.genres = self.release.data["genres"]
+        album.year = intern_string(self.year)
+        album.genres = intern_strings(self.release.data["genres"])
 
         try:
-            album.styles = self.release.data["styles"]
+            album.styles = intern_strings(self.release.data["styles"])
         except KeyError:
             album.styles = [""]
 
         if "country" in self.release.data:
-            album.country = self.release.data["country"]
+            album.country = intern_string(self.release.data["country"])
         else:
             logging.warn("no country set for relid %s" % self.release.id)
             album.country = ""
@@ -317,7 +805,8 @@ class DiscogsAlbum(object):
         """ return a single list of images for the given album """
 
         try:
-            return [x["uri"] for x in self.release.data["images"]]
+            # images without an url (e.g. imported from the data dumps) cannot be downloaded
+            return [x["uri"] for x in self.release.data["images"] if x.get("uri")]
         except KeyError:
             pass
 
@@ -325,9 +814,8 @@ class DiscogsAlbum(object):
     def year(self):
         """ returns the album release year obtained from API 2.0 """
 
-        good_year = re.compile("\d\d\d\d")
         try:
-            return good_year.match(str(self.release.data["year"])).group(0)
+            return YEAR.match(str(self.release.data["year"])).group(0)
         except IndexError:
             return "1900"
         except AttributeError:
@@ -382,79 +870,36 @@ class DiscogsAlbum(object):
             logger.debug("album-x: %s" % x.name)
             artists.append(self.clean_name(x.name))
 
-        return artists
+        return intern_strings(artists)
 
     def artists(self, artist_data):
         """ obtain the artists (normalized using clean_name). this is specific for tracks, since tracks are handled
             differently from the album artists.
             here the "join" is taken into account as well....
-
+            the same credits are repeated on many tracks, so the artists are cached by their
+            names and joins (see artist_credit_cache)
         """
-        artists = []
-        last_artist = None
-        join = None
-
-        for x in artist_data:
-#            logger.debug("x: %s" % vars(x))
-#            logger.debug("join: %s" % x.data['join'])
-
-            if isinstance(x, basestring):
-                logger.debug("x: %s" % x)
-                if last_artist:
-                    last_artist = last_artist + " " + x
-                else:
-                    last_artist = x
-            else:
-                if not last_artist == None:
-                    logger.debug("name: %s" % x.name)
-                    concatString = " "
-                    if not join == None:
-                        concatString = " " + join + " "
+        credits = tuple(x if isinstance(x, basestring) else (x.name, x.data.get("join"))
+                        for x in artist_data)
 
-                    last_artist = last_artist + concatString + self.clean_name(x.name)
-                    artists.append(last_artist)
-                    last_artist = None
-                else:
-                    join = x.data['join']
-                    last_artist = self.clean_name(x.name)
+        return list(artist_credit_cache(credits))
 
-            logger.debug("last_artist: %s" % last_artist)
-
-        artists.append(last_artist)
-
-        return artists
 
     def sort_artist(self, artist_data):
         """ Obtain a clean sort artist """
         return self.clean_duplicate_handling(artist_data[0].name)
 
     def disc_and_track_no(self, position):
-        """ obtain the disc and tracknumber from given position
-            problem right now, discogs uses - and/or . as a separator, furthermore discogs uses
-            A1 for vinyl based releases, we should implement this as well
+        """ obtain the disc and tracknumber from given position (see position.POSITION_SCHEMES
+            for the supported schemes, e.g. 12, 1-02, CD1-01 or A1 for vinyl based releases),
+            returns None if the position cannot be parsed
         """
-        if position.find("-") > -1 or position.find(".") > -1:
-            # some variance in how discogs releases spanning multiple discs
-            # or formats are kept, add regexs here as failures are encountered
-            NUMBERING_SCHEMES = (
-                "^CD(?P<discnumber>\d+)-(?P<tracknumber>\d+)$", # CD01-12
-                "^(?P<discnumber>\d+)-(?P<tracknumber>\d+)$",   # 1-02
-                "^(?P<discnumber>\d+).(?P<tracknumber>\d+)$",   # 1.05 (this is not multi-disc but multi-tracks for one track)....
-            )
-
-            for scheme in NUMBERING_SCHEMES:
-                re_match = re.search(scheme, position)
-
-                if re_match:
-                    return {'tracknumber': re_match.group("tracknumber"),
-                            'discnumber': re_match.group("discnumber")}
-        else:
-            return {'tracknumber': position,
-                    'discnumber': 1}
+        result = position_parser.parse(position)
 
+        if result is None:
+            logging.error("Unable to match multi-disc track/position")
 
-        logging.error("Unable to match multi-disc track/position")
-        return False
+        return result
 
     @property
     def is_compilation(self):
@@ -479,6 +924,10 @@ class DiscogsAlbum(object):
 
         discsubtitle = None
 
+        # the sides of a single record (or cassette) are all on the first disc,
+        # the number of discs is only read for releases with sides
+        single_disc = None
+
         for i, t in enumerate(x for x in self.release.tracklist):
 
             if t.position is None:
@@ -501,9 +950,11 @@ class DiscogsAlbum(object):
                 discsubtitle = t["title"]
                 continue
 
-            if t.artists:
-                artists = self.artists(t.artists)
-                sort_artist = self.sort_artist(t.artists)
+            # the discogs_client creates new artist objects on every access
+            track_artists = t.artists
+            if track_artists:
+                artists = self.artists(track_artists)
+                sort_artist = self.sort_artist(track_artists)
             else:
                 artists = album.artists
                 sort_artist = album.sort_artist
@@ -513,17 +964,23 @@ class DiscogsAlbum(object):
             track.position = i
 
             pos = self.disc_and_track_no(t.position)
-            try:
-                track.tracknumber = int(pos["tracknumber"])
-                track.discnumber = int(pos["discnumber"])
-            except ValueError as ve:
+            if pos is None:
                 msg = "cannot convert {0} to a valid track-/discnumber".format(t.position)
                 logger.error(msg)
                 raise AlbumError(msg)
 
+            track.tracknumber = pos.tracknumber
+            track.discnumber = pos.discnumber
+
+            if pos.side is not None:
+                if single_disc is None:
+                    single_disc = self.disctotal <= 1
+                if single_disc:
+                    track.discnumber = 1
+
 #            logger.debug("discsubtitle: {0}".format(discsubtitle))
             if discsubtitle:
-                track.discsubtitle = discsubtitle
+                track.discsubtitle = intern_string(discsubtitle)
 
             track.sort_artist = sort_artist
 
@@ -531,6 +988,10 @@ class DiscogsAlbum(object):
                 disc_list.append(disc)
                 disc = Disc(track.discnumber)
 
+            # the tracks on the sides of a disc (A1, A2, B1...) are counted per disc
+            if pos.side is not None:
+                track.tracknumber = len(disc.tracks) + 1
+
             disc.tracks.append(track)
 
         disc_list.append(disc)
@@ -539,7 +1000,7 @@ class DiscogsAlbum(object):
 
     def clean_duplicate_handling(self, clean_target):
         """ remove discogs duplicate handling eg : John (1) """
-        return re.sub("\s\(\d+\)", "", clean_target)
+        return duplicate_handling_cache(clean_target)
 
     def clean_name(self, clean_target):
         """ Cleans up the format of the artist or label name provided by
@@ -550,13 +1011,4 @@ class DiscogsAlbum(object):
                 'Aphex Twin, The' becomes 'The Aphex Twin'
             Accepts a string to clean, returns a cleansed version """
 
-        groups = {
-            ("(.*),\sThe$", "The \g<1>"),
-        }
-
-        clean_target = self.clean_duplicate_handling(clean_target)
-
-        for regex in groups:
-            clean_target = re.sub(regex[0], regex[1], clean_target)
-
-        return clean_target
+        return clean_name_cache(clean_target)
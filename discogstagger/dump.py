@@ -0,0 +1,198 @@
+import os
+import re
+import gzip
+import logging
+
+from ConfigParser import RawConfigParser
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+logger = logging
+
+API_URL = "http://api.discogs.com"
+
+# the mapping of the sources to the id tags used in the id files (see the
+# section source of the configuration)
+SOURCE_MAPPING = {"name": "discogs", "discogs": "discogs_id", "local": "discogs_id"}
+
+def _text(element, name, default=None):
+    child = element.find(name)
+    if child is None or child.text is None:
+        return default
+    return child.text
+
+def _int(value, default=None):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+def _artists(element):
+    artists = []
+    if element is None:
+        return artists
+
+    for artist in element.findall("artist"):
+        artist_id = _int(_text(artist, "id"))
+        artists.append({
+            "id": artist_id,
+            "name": _text(artist, "name", ""),
+            "anv": _text(artist, "anv", ""),
+            "join": _text(artist, "join", ""),
+            "role": _text(artist, "role", ""),
+            "tracks": _text(artist, "tracks", ""),
+            "resource_url": "%s/artists/%s" % (API_URL, artist_id),
+        })
+
+    return artists
+
+def _track(track):
+    data = {
+        "position": _text(track, "position", ""),
+        "title": _text(track, "title", ""),
+        "duration": _text(track, "duration", ""),
+    }
+
+    artists = _artists(track.find("artists"))
+    if artists:
+        data["artists"] = artists
+
+    extraartists = _artists(track.find("extraartists"))
+    if extraartists:
+        data["extraartists"] = extraartists
+
+    return data
+
+def release_from_element(element):
+    """ converts a release element of the discogs data dump into the json
+        structure returned by the discogs api (see LocalDiscogsConnector)
+    """
+    release_id = int(element.get("id"))
+
+    released = _text(element, "released", "")
+    year = re.match(r"\d{4}", released)
+
+    data = {
+        "id": release_id,
+        "status": element.get("status"),
+        "title": _text(element, "title", ""),
+        "artists": _artists(element.find("artists")),
+        "extraartists": _artists(element.find("extraartists")),
+        "labels": [{"id": _int(label.get("id")),
+                    "name": label.get("name", ""),
+                    "catno": label.get("catno", ""),
+                    "entity_type": "",
+                    "resource_url": "%s/labels/%s" % (API_URL, label.get("id"))}
+                   for label in element.findall("labels/label")],
+        "formats": [],
+        "genres": [genre.text for genre in element.findall("genres/genre")],
+        "styles": [style.text for style in element.findall("styles/style")],
+        "released": released,
+        "year": int(year.group(0)) if year else 0,
+        "notes": _text(element, "notes"),
+        "data_quality": _text(element, "data_quality"),
+        "tracklist": [_track(track) for track in element.findall("tracklist/track")],
+        # the dumps do not contain the image urls (uri is empty), those images
+        # cannot be downloaded
+        "images": [dict(image.attrib) for image in element.findall("images/image") if image.get("uri")],
+        "uri": "http://www.discogs.com/release/%d" % release_id,
+        "resource_url": "%s/releases/%d" % (API_URL, release_id),
+    }
+
+    for format in element.findall("formats/format"):
+        format_data = {"name": format.get("name", ""), "qty": format.get("qty", "1")}
+        descriptions = [x.text for x in format.findall("descriptions/description")]
+        if descriptions:
+            format_data["descriptions"] = descriptions
+        if format.get("text"):
+            format_data["text"] = format.get("text")
+        data["formats"].append(format_data)
+
+    country = _text(element, "country")
+    if country is not None:
+        data["country"] = country
+
+    master_id = _int(_text(element, "master_id"))
+    if master_id is not None:
+        data["master_id"] = master_id
+
+    return data
+
+def open_dump(dump_file):
+    if dump_file.endswith(".gz"):
+        return gzip.open(dump_file, "rb")
+    return open(dump_file, "rb")
+
+def iter_releases(dump, release_ids=None):
+    """ stream-parses the given releases dump (file object) and yields the
+        releases (as api json) one after the other. The parsed elements are
+        thrown away immediately, so the memory usage stays constant
+        regardless of the size of the dump.
+        If release_ids is given, only these releases are converted.
+    """
+    context = ElementTree.iterparse(dump, events=("start", "end"))
+    event, root = next(context)
+
+    for event, element in context:
+        if event != "end" or element.tag != "release":
+            continue
+
+        if release_ids is None or int(element.get("id")) in release_ids:
+            yield release_from_element(element)
+
+        # drop the release (and the reference from the root element)
+        root.clear()
+
+def import_dump(dump_file, release_store, release_ids=None, batch_size=1000):
+    """ imports the releases of the given dump file into the release store,
+        returns the number of releases imported
+    """
+    count = 0
+    batch = []
+
+    with open_dump(dump_file) as dump:
+        for release in iter_releases(dump, release_ids):
+            batch.append((release["id"], release))
+
+            if len(batch) >= batch_size:
+                release_store.put_many(batch)
+                count = count + len(batch)
+                batch = []
+                logger.info("imported %d releases" % count)
+
+    release_store.put_many(batch)
+    count = count + len(batch)
+
+    return count
+
+def read_library_ids(base_dir, id_file="id.txt", source_mapping=SOURCE_MAPPING):
+    """ returns the set of discogs release ids used in the id files of the
+        library beneath base_dir, the id tag is looked up in the given
+        source mapping (the section source of the configuration, which can be
+        overridden by the id files), the same way as the tagger does
+    """
+    release_ids = set()
+
+    for root, dirs, files in os.walk(os.path.expanduser(base_dir)):
+        if not id_file in files:
+            continue
+
+        parser = RawConfigParser()
+        parser.add_section("source")
+        for key, value in source_mapping.items():
+            parser.set("source", key, value)
+        parser.read(os.path.join(root, id_file))
+
+        try:
+            source_name = parser.get("source", "name")
+            # local releases are discogs releases as well
+            if source_name in ("discogs", "local"):
+                id_name = parser.get("source", source_name)
+                release_ids.add(int(parser.get("source", id_name)))
+        except Exception as e:
+            logger.warn("cannot read release id from %s: %s" % (os.path.join(root, id_file), e))
+
+    return release_ids
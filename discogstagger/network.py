@@ -0,0 +1,278 @@
+import os
+import time
+import random
+import tempfile
+import threading
+import logging
+
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from discogs_client.fetchers import OAuth2Fetcher
+
+logger = logging
+
+def create_session(user_agent, pool_size=4):
+    """ creates a keep-alive http session with a connection pool of the given
+        size, to be shared by all requests to discogs
+    """
+    session = requests.Session()
+    session.headers["User-Agent"] = user_agent
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+class NetworkPolicy(object):
+    """ the policy for all requests to discogs (metadata and images): each
+        request gets a deadline (timeout), requests answered with 429 or a server
+        error (5xx) or failing because of a network error are retried with an
+        exponential backoff (with jitter). If several requests in a row fail,
+        discogs seems to be down and the circuit breaker pauses all requests
+        for breaker_pause seconds, afterwards a single failing request opens the
+        circuit again.
+    """
+
+    def __init__(self, timeout=30, retries=3, backoff=1.0, max_backoff=60,
+                 breaker_threshold=5, breaker_pause=60):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_pause = breaker_pause
+
+        self.stats = {"retries": 0, "wait_time": 0.0, "pauses": 0, "pause_time": 0.0}
+
+        self._failures = 0
+        self._open_until = 0
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, tagger_config):
+        return cls(tagger_config.getfloat("network", "timeout"),
+                   tagger_config.getint("network", "retries"),
+                   tagger_config.getfloat("network", "backoff"),
+                   tagger_config.getfloat("network", "max_backoff"),
+                   tagger_config.getint("network", "breaker_threshold"),
+                   tagger_config.getfloat("network", "breaker_pause"))
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.stats[key] = self.stats[key] + value
+
+    def _delay(self, attempt, response):
+        """ the backoff before the given retry, respecting the Retry-After header """
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        delay = delay / 2 + self._random.uniform(0, delay / 2)
+
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            delay = max(delay, min(self.max_backoff, float(response.headers["Retry-After"])))
+
+        return delay
+
+    def _wait_for_circuit(self):
+        with self._lock:
+            pause = self._open_until - time.time()
+
+        if pause > 0:
+            self._count("pause_time", pause)
+            time.sleep(pause)
+
+    def _record(self, failed):
+        with self._lock:
+            if not failed:
+                self._failures = 0
+                return
+
+            self._failures = self._failures + 1
+            now = time.time()
+
+            if self._failures >= self.breaker_threshold and self._open_until <= now:
+                logger.error("discogs seems to be down (%d failed requests in a row), pausing for %d seconds" %
+                             (self._failures, self.breaker_pause))
+                self._open_until = now + self.breaker_pause
+                self.stats["pauses"] = self.stats["pauses"] + 1
+
+    def call(self, request, url):
+        """ calls request(timeout), which sends the request to the given url and
+            returns the response (see requests), as defined by this policy.
+            Returns the last response, if all retries failed, or raises the
+            last network error.
+        """
+        attempt = 0
+
+        while True:
+            self._wait_for_circuit()
+
+            response = None
+            try:
+                response = request(self.timeout)
+                error = None
+                retry = response.status_code == 429 or response.status_code >= 500
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                retry = True
+
+            # too many requests does not mean that discogs is down
+            self._record(retry and (response is None or response.status_code != 429))
+
+            if not retry or attempt >= self.retries:
+                if error is not None:
+                    raise error
+                return response
+
+            delay = self._delay(attempt, response)
+            reason = error if error is not None else "status %d" % response.status_code
+
+            if response is not None:
+                response.close()
+
+            logger.warn("request to %s failed (%s), retrying in %.1f seconds" % (url, reason, delay))
+
+            self._count("retries")
+            self._count("wait_time", delay)
+            time.sleep(delay)
+
+            attempt = attempt + 1
+
+class DiscogsFetcher(OAuth2Fetcher):
+    """ fetches via HTTP (and OAuth 1.0a, if a consumer key is given) from the
+        discogs api server. In contrast to the fetchers of the discogs_client,
+        every request is passed thru the given rate limiter, which gets updated
+        with the rate limit headers of each response, and follows the given
+        network policy (deadlines and retries). If a session is given, its
+        connections are reused.
+    """
+
+    def __init__(self, rate_limit, consumer_key=None, consumer_secret=None, network_policy=None,
+                 session=None):
+        self.rate_limit = rate_limit
+        self.network_policy = network_policy or NetworkPolicy()
+        self.session = session
+        self.client = None
+
+        if consumer_key and consumer_secret:
+            OAuth2Fetcher.__init__(self, consumer_key, consumer_secret)
+
+    def fetch(self, client, method, url, data=None, headers=None, json_format=True):
+        def request(timeout):
+            # every retry needs a new signature (nonce and timestamp)
+            if self.client:
+                uri, signed_headers, body = self.client.sign(url, http_method=method,
+                                                             body=data, headers=headers)
+            else:
+                uri, signed_headers, body = url, headers, data
+
+            self.rate_limit.acquire()
+
+            resp = (self.session or requests).request(method, uri, headers=signed_headers,
+                                                      data=body, timeout=timeout)
+
+            self.rate_limit.update(resp.status_code, resp.headers)
+
+            return resp
+
+        resp = self.network_policy.call(request, url)
+
+        return resp.content, resp.status_code
+
+class ImageDownloader(object):
+    """ downloads images from discogs using a single keep-alive http session
+        (the given one or a new one, see create_session).
+        Several images are downloaded in parallel (each download is still
+        passed thru the image rate limiter), the data is streamed into a
+        temporary file in the target directory, which is renamed after the
+        download is complete. This way no half-written images are left behind.
+        The requests follow the given network policy, additionally each download
+        has to be complete within timeout seconds.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, rate_limit, user_agent, threads=4, timeout=30, network_policy=None,
+                 session=None):
+        self.rate_limit = rate_limit
+        self.threads = threads
+        self.timeout = timeout
+        self.network_policy = network_policy or NetworkPolicy()
+        self.session = session or create_session(user_agent, threads)
+
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPool(self.threads)
+
+        return self._pool
+
+    def download(self, image_file, image_url):
+        """ downloads a single image, raises an exception on errors or if the
+            download takes longer than the configured timeout
+        """
+        def request(timeout):
+            self.rate_limit.acquire()
+
+            response = self.session.get(image_url, stream=True, timeout=min(timeout, self.timeout))
+            self.rate_limit.update(response.status_code, response.headers)
+
+            return response
+
+        start = time.time()
+        response = self.network_policy.call(request, image_url)
+
+        try:
+            response.raise_for_status()
+
+            fd, temp_file = tempfile.mkstemp(prefix=".", suffix=".part",
+                                             dir=os.path.dirname(image_file))
+            try:
+                with os.fdopen(fd, "wb") as fh:
+                    for chunk in response.iter_content(ImageDownloader.CHUNK_SIZE):
+                        if time.time() - start > self.timeout:
+                            raise IOError("download of %s took more than %d seconds" %
+                                          (image_url, self.timeout))
+                        fh.write(chunk)
+
+                os.rename(temp_file, image_file)
+            except:
+                os.remove(temp_file)
+                raise
+        finally:
+            response.close()
+
+    def _download(self, image):
+        image_file, image_url = image
+
+        try:
+            self.download(image_file, image_url)
+            return None
+        except Exception as e:
+            logger.error("Unable to download image '%s', skipping. (%s)" % (image_url, e))
+            return e
+
+    def download_all(self, images):
+        """ downloads the given list of (image_file, image_url) tuples in parallel,
+            returns the list of errors (None for each successful download)
+        """
+        # the thread pool is only started for several images
+        if not images:
+            return []
+
+        if len(images) == 1:
+            return [self._download(images[0])]
+
+        return self.pool.map(self._download, images)
+
+    def close(self):
+        """ waits for the running downloads and stops the download threads """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
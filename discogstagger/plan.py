@@ -0,0 +1,165 @@
+import os
+import json
+import logging
+
+from multiprocessing.pool import ThreadPool
+
+from discogstagger.taggerutils import TaggerUtils, TagHandler, FileHandler, TaggerError
+from discogstagger.taggerutils import write_tags, add_replay_gain_tags, write_file, copy_files, copy_other_files
+from discogstagger.taggerutils import download_images, embed_coverart_files, create_done_file
+from discogstagger.dirscan import missing_files
+
+logger = logging
+
+# the version of the plan format, plans of other versions are rejected (see check_plan)
+PLAN_VERSION = 1
+
+def plan_album(source_dir, dest_dir, tagger_config, album, replaygain=False):
+    """ the plan of tagging the given album: everything that is decided from the
+        release and the source directory (target files, tags, images, playlist
+        and info file), without touching any file. The plan is a dict of plain
+        values (see write_plans) to be applied by a PlanExecutor later on (or on
+        another host). Raises TaggerError if the files cannot be mapped.
+    """
+    tagger_utils = TaggerUtils(source_dir, dest_dir, tagger_config, album)
+    tagger_utils._get_target_list()
+
+    for disc in album.discs:
+        for track in disc.tracks:
+            if track.orig_file is None:
+                raise TaggerError("no source file for track %d-%d (%s)" % (disc.discnumber, track.tracknumber,
+                                                                           track.title))
+
+    tag_handler = TagHandler(album, tagger_config)
+    file_handler = FileHandler(album, tagger_config)
+
+    files = []
+    for track, source_file, target_file in file_handler.track_files():
+        files.append({"source": source_file, "target": target_file,
+                      "tags": tag_handler.track_tags(track)})
+
+    documents = [{"file": os.path.join(album.target_dir, tagger_utils.m3u_filename),
+                  "content": tagger_utils.render_template("m3u.txt")},
+                 {"file": os.path.join(album.target_dir, tagger_utils.nfo_filename),
+                  "content": tagger_utils.render_template("info.txt")}]
+
+    return {
+        "version": PLAN_VERSION,
+        "release_id": album.id,
+        "title": "%s - %s" % (album.artist, album.title),
+        "source_dir": album.sourcedir,
+        "target_dir": album.target_dir,
+        "files": files,
+        "keep_tags": [name for name in tag_handler.keep_tags.split(",") if name],
+        "other_files": file_handler.other_files(),
+        "images": file_handler.image_downloads(),
+        "cover": file_handler.cover_file(),
+        "replaygain": replaygain,
+        "documents": documents,
+        "done_file": os.path.join(album.sourcedir, tagger_config.get("details", "done_file")),
+    }
+
+def check_plan(plan, snapshot=None):
+    """ returns the problems preventing the given plan from being applied
+        (an empty list if there are none). The source files are looked up in
+        the given snapshot of the source directory (if the album was planned
+        in this process, see TaggerUtils._get_target_list), otherwise each
+        source folder is read once.
+    """
+    problems = []
+
+    if plan.get("version") != PLAN_VERSION:
+        problems.append("unsupported plan version %s (expected %d)" % (plan.get("version"), PLAN_VERSION))
+        return problems
+
+    sources = [entry["source"] for entry in plan["files"]]
+    sources.extend(source_file for source_file, target_file in plan["other_files"])
+
+    for source_file in missing_files(sources, snapshot):
+        problems.append("source file %s does not exist" % source_file)
+
+    targets = set()
+    for entry in plan["files"]:
+        if entry["target"] in targets:
+            problems.append("target file %s is used more than once" % entry["target"])
+        targets.add(entry["target"])
+
+    return problems
+
+def write_plans(plans, fh):
+    """ writes the given plans to the given file, one json document per line """
+    for plan in plans:
+        fh.write(json.dumps(plan, sort_keys=True))
+        fh.write("\n")
+
+def read_plans(fh):
+    """ reads the plans written by write_plans """
+    return [json.loads(line) for line in fh if line.strip()]
+
+class PlanExecutor(object):
+    """ applies album plans (see plan_album): copies and tags the files, copies
+        the other files, downloads and embeds the images, writes the playlist,
+        the info file and the done file. The plans do not depend on each other,
+        so several albums can be applied in parallel (see apply_many). The files
+        are written by the functions of taggerutils, which the FileHandler uses
+        as well.
+    """
+
+    def __init__(self, connector, workers=1):
+        self.connector = connector
+        self.workers = workers
+
+    def apply(self, plan):
+        """ applies the given plan (see check_plan) """
+        logger.info("Applying plan of album '%s'" % plan["title"])
+
+        track_files = [entry["target"] for entry in plan["files"]]
+
+        copy_files((entry["source"], entry["target"]) for entry in plan["files"])
+
+        logger.debug("Tagging files")
+        for entry in plan["files"]:
+            write_tags(entry["target"], entry["tags"], plan["keep_tags"])
+
+        logger.debug("Copy other interesting files (on request)")
+        copy_other_files(plan["other_files"])
+
+        logger.debug("Downloading and storing images")
+        download_images(self.connector, [tuple(image) for image in plan["images"]], plan["target_dir"])
+
+        logger.debug("Embedding Albumart")
+        embed_coverart_files(plan["cover"], track_files)
+
+        if plan["replaygain"]:
+            logger.debug("Add ReplayGain tags (if necessary)")
+            add_replay_gain_tags(plan["target_dir"])
+
+        logger.debug("Generate m3u and nfo")
+        for document in plan["documents"]:
+            write_file(document["content"], document["file"])
+
+        create_done_file(plan["done_file"])
+
+    def apply_many(self, plans):
+        """ applies the given plans (using the configured number of workers),
+            returns the (plan, exception) of all plans that failed
+        """
+        def apply_plan(plan):
+            try:
+                self.apply(plan)
+            except Exception as e:
+                logger.error("Error while applying the plan of '%s': %s" % (plan["title"], e))
+                return (plan, e)
+            return None
+
+        if self.workers > 1 and len(plans) > 1:
+            pool = ThreadPool(self.workers)
+            try:
+                results = pool.map(apply_plan, plans)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [apply_plan(plan) for plan in plans]
+
+        return [result for result in results if result is not None]
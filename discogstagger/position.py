@@ -0,0 +1,142 @@
+import re
+import logging
+import collections
+
+logger = logging
+
+# the schemes of the track positions used by discogs, tried in this order.
+# Each pattern has to match the complete (stripped) position and defines the
+# groups tracknumber and optionally discnumber or side (a vinyl or cassette
+# side, two sides per disc; the mapping keeps all sides on the first disc
+# unless the release has several discs, and counts the track numbers on
+# sides per disc).
+# Add schemes here (or use PositionParser.add_scheme) as failures are encountered
+POSITION_SCHEMES = (
+    ("track", "^(?P<tracknumber>\d+)$"),                                # 12
+    ("disc", "^(?P<discnumber>\d+)-(?P<tracknumber>\d+)$"),             # 1-02
+    ("cd", "^CD\s?(?P<discnumber>\d+)[-.](?P<tracknumber>\d+)$"),       # CD01-12, CD1-01, CD 2.03
+    # this is not multi-disc but multi-tracks for one track (see 513904),
+    # mapped like a disc to be able to detect it later on
+    ("subtrack", "^(?P<discnumber>\d+)\.(?P<tracknumber>\d+)$"),        # 1.05
+    ("side", "^(?P<side>[A-Z])(?P<tracknumber>\d*)$"),                  # A1, B2, A
+)
+
+class Position(object):
+    """ a parsed track position: the disc number, the track number and the
+        side (None if the release has no sides) the track is on
+    """
+
+    __slots__ = ("scheme", "discnumber", "tracknumber", "side")
+
+    def __init__(self, scheme, discnumber, tracknumber, side=None):
+        self.scheme = scheme
+        self.discnumber = discnumber
+        self.tracknumber = tracknumber
+        self.side = side
+
+    def __eq__(self, other):
+        return isinstance(other, Position) and \
+            (self.scheme, self.discnumber, self.tracknumber, self.side) == \
+            (other.scheme, other.discnumber, other.tracknumber, other.side)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "Position(%r, %r, %r, %r)" % (self.scheme, self.discnumber, self.tracknumber, self.side)
+
+class PositionParser(object):
+    """ parses the track positions of discogs releases using the given table
+        of (name, pattern) schemes (see POSITION_SCHEMES), the patterns are
+        compiled once. Positions are repeated a lot (1, 2, 1-01, ...), so the
+        results are kept in a memo table (positions not matching any scheme
+        as well). If more than max_entries positions are kept, the oldest ones
+        are evicted.
+    """
+
+    def __init__(self, schemes=POSITION_SCHEMES, max_entries=10000):
+        self.schemes = []
+        self.max_entries = max_entries
+        self._memo = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        for name, pattern in schemes:
+            self.add_scheme(name, pattern)
+
+    def add_scheme(self, name, pattern, index=None):
+        """ adds a scheme (tried last, or at the given index of the table) """
+        scheme = (name, re.compile(pattern))
+
+        if index is None:
+            self.schemes.append(scheme)
+        else:
+            self.schemes.insert(index, scheme)
+
+        # positions could be parsed differently now
+        self._memo.clear()
+
+    def parse(self, position):
+        """ returns the Position of the given position string, None if it does
+            not match any scheme
+        """
+        try:
+            result = self._memo[position]
+            self.hits = self.hits + 1
+            return result
+        except KeyError:
+            pass
+
+        self.misses = self.misses + 1
+        result = self._parse(position)
+
+        if len(self._memo) >= self.max_entries:
+            self._memo.popitem(last=False)
+            self.evictions = self.evictions + 1
+
+        self._memo[position] = result
+
+        return result
+
+    def _parse(self, position):
+        stripped = position.strip()
+
+        # the most common scheme, without a regex
+        if stripped.isdigit():
+            return Position("track", 1, int(stripped))
+
+        for name, pattern in self.schemes:
+            match = pattern.match(stripped)
+
+            if match is None:
+                continue
+
+            groups = match.groupdict()
+            side = groups.get("side")
+
+            if groups.get("discnumber"):
+                discnumber = int(groups["discnumber"])
+            elif side is not None:
+                # two sides per disc: A and B on the first, C and D on the second...
+                discnumber = (ord(side) - ord("A")) // 2 + 1
+            else:
+                discnumber = 1
+
+            # a side may have a single track without a number (e.g. singles)
+            tracknumber = int(groups["tracknumber"] or 1)
+
+            return Position(name, discnumber, tracknumber, side)
+
+        logger.debug("no position scheme matches '%s'" % position)
+        return None
+
+    @property
+    def stats(self):
+        """ memo hits, misses and evictions """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "positions": len(self._memo)}
+
+# the parser used by the mapping
+position_parser = PositionParser()
@@ -0,0 +1,138 @@
+import threading
+import logging
+
+logger = logging
+
+class ReleasePrefetcher(object):
+    """ fetches the releases of a batch run in the background, while the albums
+        before are copied and tagged.
+        The release ids are deduplicated and fetched in the given order, but
+        never more than window releases ahead of the release currently
+        requested by the tagging loop, so that the memory usage does not grow
+        with the size of the library. The rate limiting is done by the
+        connector (see DiscogsFetcher).
+
+        Provides the same fetch_release method as the DiscogsConnector, releases
+        not known to the prefetcher are fetched directly.
+    """
+
+    def __init__(self, connector, release_ids, window=10, threads=2):
+        self.connector = connector
+        self.window = window
+        self.thread_count = threads
+
+        self.release_ids = []
+        self.positions = {}
+        self.references = {}
+
+        for release_id in release_ids:
+            key = str(release_id)
+            if not key in self.positions:
+                self.positions[key] = len(self.release_ids)
+                self.release_ids.append(key)
+            self.references[key] = self.references.get(key, 0) + 1
+
+        self.results = {}
+        self.next_index = 0
+        self.position = 0
+        self.stopped = False
+
+        self.prefetched = 0
+        self.waited = 0
+
+        self.condition = threading.Condition()
+        self.threads = []
+
+    def start(self):
+        logger.info("prefetching %d releases (window: %d)" % (len(self.release_ids), self.window))
+
+        for x in range(self.thread_count):
+            thread = threading.Thread(target=self._work, name="prefetch-%d" % x)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def _next_release_id(self):
+        """ waits until the next release is inside of the look-ahead window """
+        with self.condition:
+            while not self.stopped and self.next_index < len(self.release_ids) and \
+                    self.next_index >= self.position + self.window:
+                self.condition.wait()
+
+            if self.stopped or self.next_index >= len(self.release_ids):
+                return None
+
+            release_id = self.release_ids[self.next_index]
+            self.next_index = self.next_index + 1
+
+            return release_id
+
+    def _work(self):
+        while True:
+            release_id = self._next_release_id()
+
+            if release_id is None:
+                return
+
+            try:
+                release = self.connector.fetch_release(release_id)
+                # the discogs_client fetches lazily, make sure the data is
+                # really there before handing the release out
+                release.fetch("tracklist")
+                result = (release, None)
+            except Exception as e:
+                logger.error("prefetching release %s failed: %s" % (release_id, e))
+                result = (None, e)
+
+            with self.condition:
+                self.results[release_id] = result
+                self.prefetched = self.prefetched + 1
+                self.condition.notify_all()
+
+    def fetch_release(self, release_id):
+        """ returns the prefetched release (waits, if it is still fetched) """
+        key = str(release_id)
+
+        if not self.references.get(key):
+            return self.connector.fetch_release(release_id)
+
+        with self.condition:
+            # move the window forward
+            self.position = max(self.position, self.positions[key] + 1)
+            self.condition.notify_all()
+
+            if not key in self.results:
+                logger.debug("waiting for prefetched release %s" % key)
+                self.waited = self.waited + 1
+
+            while not key in self.results and not self.stopped:
+                self.condition.wait()
+
+            if not key in self.results:
+                release, error = None, None
+            else:
+                release, error = self.results[key]
+
+            # free the release, as soon as it is not needed anymore
+            self.references[key] = self.references[key] - 1
+            if self.references[key] <= 0:
+                self.results.pop(key, None)
+
+        if error:
+            raise error
+
+        if release is None:
+            return self.connector.fetch_release(release_id)
+
+        return release
+
+    @property
+    def stats(self):
+        return {"prefetched": self.prefetched, "waited": self.waited}
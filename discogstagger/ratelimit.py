@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import threading
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    # no lock files available (e.g. windows), the budget is only shared
+    # between the threads of this process
+    fcntl = None
+
+from cache import cache_dir, mkdir_p
+
+logger = logging
+
+class TokenBucket(object):
+    """ token bucket rate limiter for the calls to discogs.
+        The state of the bucket (tokens, refill rate and capacity) is stored in
+        a small json file, which is locked during each update. This way several
+        tagger processes on one host share a single budget.
+        The refill rate and the capacity are adapted using the rate limit
+        headers sent by discogs (see update).
+    """
+
+    def __init__(self, state_file, rate=1.0, capacity=1.0):
+        if float(rate) <= 0:
+            raise ValueError("the rate of %s must be greater than 0 (got %s)" % (state_file, rate))
+        if float(capacity) < 1:
+            raise ValueError("the capacity of %s must be at least 1 (got %s)" % (state_file, capacity))
+
+        self.state_file = state_file
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+
+        self.waits = 0
+        self.wait_time = 0.0
+
+        self._lock = threading.Lock()
+        self._state_dir_created = False
+
+    @classmethod
+    def from_config(cls, tagger_config, rate_limit_type):
+        """ creates the bucket for the given type (metadata or image) using the
+            settings in the section ratelimit
+        """
+        state_file = os.path.join(cache_dir(tagger_config), "ratelimit-%s.json" % rate_limit_type)
+
+        return cls(state_file,
+                   tagger_config.getfloat("ratelimit", "%s_rate" % rate_limit_type),
+                   tagger_config.getfloat("ratelimit", "%s_burst" % rate_limit_type))
+
+    def _initial_state(self, now):
+        return {"tokens": self.capacity, "rate": self.rate,
+                "capacity": self.capacity, "updated": now}
+
+    def _transaction(self, func):
+        """ reads the state, calls func(state, now) and writes the (changed) state
+            back, while holding the lock on the state file
+        """
+        with self._lock:
+            # the cache directory is created on the first request, not when the
+            # bucket is created (e.g. by a connector which is never used)
+            if not self._state_dir_created:
+                mkdir_p(os.path.dirname(self.state_file))
+                self._state_dir_created = True
+
+            fd = os.open(self.state_file, os.O_RDWR | os.O_CREAT, 0644)
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+
+                now = time.time()
+                content = os.read(fd, 4096)
+
+                try:
+                    state = json.loads(content)
+                except ValueError:
+                    state = self._initial_state(now)
+
+                if not state.get("rate", 0) > 0:
+                    # e.g. written by an older version, the bucket would never refill
+                    logger.warn("invalid rate in %s, resetting the bucket" % self.state_file)
+                    state = self._initial_state(now)
+
+                # refill the bucket according to the time passed since the last update
+                elapsed = max(0.0, now - state["updated"])
+                state["tokens"] = min(state["capacity"], state["tokens"] + elapsed * state["rate"])
+                state["updated"] = now
+
+                result = func(state, now)
+
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, json.dumps(state))
+            finally:
+                # closing the file releases the lock as well
+                os.close(fd)
+
+        return result
+
+    def _take(self, state, now):
+        if state["tokens"] >= 1:
+            state["tokens"] = state["tokens"] - 1
+            return 0
+
+        return (1 - state["tokens"]) / state["rate"]
+
+    def acquire(self):
+        """ blocks until a token is available and consumes it """
+        while True:
+            wait = self._transaction(self._take)
+
+            if wait <= 0:
+                return
+
+            logger.warn("Waiting %.2f seconds to allow rate limiting..." % wait)
+            self.waits = self.waits + 1
+            self.wait_time = self.wait_time + wait
+            time.sleep(wait)
+
+    def update(self, status_code, headers):
+        """ adapts the bucket to the rate limit headers of a discogs response,
+            X-Discogs-Ratelimit is the number of requests allowed in a moving
+            window of 60 seconds, X-Discogs-Ratelimit-Remaining the number of
+            requests still available in the current window
+        """
+        limit = headers.get("X-Discogs-Ratelimit")
+        remaining = headers.get("X-Discogs-Ratelimit-Remaining")
+
+        if limit is None and status_code != 429:
+            return
+
+        def adapt(state, now):
+            # a limit of 0 would stop the bucket from refilling, it is ignored
+            if limit is not None and float(limit) > 0:
+                state["capacity"] = max(1.0, float(limit))
+                state["rate"] = state["capacity"] / 60
+            if remaining is not None:
+                state["tokens"] = min(state["tokens"], float(remaining))
+            if status_code == 429:
+                logger.warn("discogs rate limit exceeded, emptying bucket")
+                state["tokens"] = 0.0
+
+        self._transaction(adapt)
+
+    @property
+    def stats(self):
+        return {"waits": self.waits, "wait_time": self.wait_time}
@@ -0,0 +1,122 @@
+import os
+import json
+import zlib
+import time
+import random
+import sqlite3
+import logging
+
+from cache import SqliteCache, cache_dir
+
+logger = logging
+
+class ReleaseStore(SqliteCache):
+    """ local store of complete releases (e.g. imported from the discogs data
+        dumps). In contrast to the ReleaseCache nothing expires or gets evicted,
+        the releases are stored as zlib compressed json, indexed by the
+        release id.
+    """
+
+    SCHEMA = ("""CREATE TABLE IF NOT EXISTS releases (
+                   release_id INTEGER PRIMARY KEY,
+                   data BLOB NOT NULL)""",)
+
+    def __init__(self, store_file):
+        SqliteCache.__init__(self, store_file)
+
+    @classmethod
+    def from_config(cls, tagger_config, create=False):
+        """ the store configured as cache:release_store (relative to cache:dir),
+            returns None if the store does not exist (and should not be created)
+        """
+        store_file = os.path.join(cache_dir(tagger_config), tagger_config.get("cache", "release_store"))
+        store_file = os.path.expanduser(store_file)
+
+        if not create and not os.path.exists(store_file):
+            return None
+
+        return cls(store_file)
+
+    def get(self, release_id):
+        """ returns the json data (dict) of the given release or None """
+        with self._lock:
+            row = self.connection.execute("SELECT data FROM releases WHERE release_id = ?",
+                                          (int(release_id),)).fetchone()
+
+        if row is None:
+            return None
+
+        return json.loads(zlib.decompress(row[0]))
+
+    def __contains__(self, release_id):
+        with self._lock:
+            return self.connection.execute("SELECT 1 FROM releases WHERE release_id = ?",
+                                           (int(release_id),)).fetchone() is not None
+
+    def put(self, release_id, data):
+        self.put_many([(release_id, data)])
+
+    def put_many(self, releases):
+        """ stores the given (release_id, data) tuples in a single transaction """
+        rows = [(int(release_id), sqlite3.Binary(zlib.compress(json.dumps(data))))
+                for release_id, data in releases]
+
+        with self._lock:
+            self.connection.executemany("INSERT OR REPLACE INTO releases VALUES (?, ?)", rows)
+            self.connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM releases").fetchone()[0]
+
+    def ids(self):
+        """ returns all stored release ids (sorted) """
+        with self._lock:
+            return [row[0] for row in
+                    self.connection.execute("SELECT release_id FROM releases ORDER BY release_id")]
+
+    def stats(self, sample_size=1000):
+        """ returns the size of the store and the lookup latency (in milliseconds)
+            measured on a random sample of the stored releases
+        """
+        with self._lock:
+            count, stored_bytes = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM releases").fetchone()
+
+        release_ids = self.ids()
+        sample = random.sample(release_ids, min(sample_size, len(release_ids)))
+
+        latencies = []
+        for release_id in sample:
+            start = time.time()
+            self.get(release_id)
+            latencies.append((time.time() - start) * 1000)
+
+        latencies.sort()
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+        return {
+            "releases": count,
+            "stored_bytes": stored_bytes,
+            "file_bytes": os.path.getsize(self.cache_file) if os.path.exists(self.cache_file) else 0,
+            "lookups": len(latencies),
+            "lookup_avg_ms": sum(latencies) / len(latencies) if latencies else 0.0,
+            "lookup_p50_ms": percentile(0.5),
+            "lookup_p99_ms": percentile(0.99),
+        }
+
+def read_release_json(json_file):
+    """ reads a release json file as written by scripts/fetch_json.py (or the
+        wrapped format used in test/release)
+    """
+    with open(json_file, "r") as fh:
+        data = json.load(fh)
+
+    if "resp" in data:
+        data = data["resp"]["release"]
+
+    return data
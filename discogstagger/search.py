@@ -0,0 +1,466 @@
+import os
+import re
+import logging
+
+from cache import SqliteCache, cache_dir
+
+logger = logging
+
+TOKEN = re.compile("\w+", re.UNICODE)
+DUPLICATE = re.compile("\s\(\d+\)")
+CATNO_SEPARATOR = "; "
+
+# the weights of the fields in the confidence of a candidate
+WEIGHTS = {"artist": 0.3, "title": 0.35, "text": 0.65, "label": 0.1, "catno": 0.15, "tracks": 0.1}
+
+def tokenize(text):
+    """ splits the given text into lower case words, the discogs duplicate
+        handling (e.g. 'Goldie (12)') is removed
+    """
+    if not text:
+        return []
+
+    if not isinstance(text, unicode):
+        text = text.decode("utf-8", "replace")
+
+    return TOKEN.findall(DUPLICATE.sub("", text).lower())
+
+def catno_key(catno):
+    """ catalog numbers are compared without spaces and separators,
+        'MOLECD 023-2' is the same as 'molecd0232' (and as 'molecd_023-2'
+        in a directory name, see TaggerUtils.get_clean_filename)
+    """
+    return "".join(tokenize(catno)).replace("_", "")
+
+def release_fields(data):
+    """ the searchable fields of the given release json """
+    labels = data.get("labels", [])
+
+    return {
+        "artist": " ".join(artist.get("name", "") for artist in data.get("artists", [])),
+        "title": data.get("title", ""),
+        "label": " ".join(label.get("name", "") for label in labels),
+        "catno": CATNO_SEPARATOR.join(label.get("catno", "") for label in labels
+                                      if label.get("catno") != "none"),
+        "tracks": len([track for track in data.get("tracklist", []) if track.get("position")]),
+    }
+
+def field_terms(field, value):
+    """ the terms of the given field value in the index """
+    terms = set(tokenize(value))
+
+    if field == "catno":
+        # the complete catalog numbers as well (e.g. molecd0232)
+        terms.update(catno_key(catno) for catno in value.split(CATNO_SEPARATOR))
+        terms.discard("")
+
+    return terms
+
+# directory names as created using the dir format %ALBARTIST%-%ALBTITLE%-(%CATNO%)-%YEAR%
+DIR_NAME = re.compile("^(?P<name>.*?)(-\((?P<catno>[^)]*)\))?(-(?P<year>\d{4}))?$")
+
+AUDIO_FILES = (".mp3", ".flac")
+
+# the disc directories of multi disc albums (e.g. cd1, Disc 2)
+DISC_DIR = re.compile("^(cd|dis[ck])[\s_-]*\d+", re.IGNORECASE)
+
+def untagged_dirs(start_dir, id_file):
+    """ the album directories beneath start_dir without id file: the directories
+        containing audio files (see AUDIO_FILES) and the directories whose
+        subdirectories are all disc directories (see DISC_DIR). The directories
+        of albums with an id file are not searched.
+    """
+    album_dirs = []
+
+    for root, dirs, files in os.walk(start_dir):
+        if id_file in files:
+            dirs[:] = []
+            continue
+
+        has_audio_files = any(x.lower().endswith(AUDIO_FILES) for x in files)
+        has_disc_dirs = dirs and all(DISC_DIR.match(x) for x in dirs)
+
+        if has_audio_files or has_disc_dirs:
+            album_dirs.append(root)
+            dirs[:] = []
+
+        dirs.sort()
+
+    return album_dirs
+
+def dir_catno(source_dir):
+    """ the catalog number in the name of the given directory (see the dir
+        format) or None
+    """
+    match = DIR_NAME.match(os.path.basename(os.path.normpath(source_dir)))
+    return match.group("catno") if match else None
+
+def folder_query(source_dir):
+    """ builds the search query (see SearchIndex.search) for the album in the
+        given directory, using the tags of its audio files (album artist, album,
+        label and catalog number) or, if there are no tags, the directory name
+        (see the dir format). The number of tracks is the number of audio files.
+    """
+    audio_files = []
+    for root, dirs, files in os.walk(source_dir):
+        audio_files.extend(os.path.join(root, x) for x in sorted(files) if x.lower().endswith(AUDIO_FILES))
+
+    query = {"tracks": len(audio_files)}
+
+    if audio_files:
+        # imported here, to be able to use the index without mutagen
+        from ext.mediafile import MediaFile
+
+        try:
+            metadata = MediaFile(audio_files[0])
+
+            query["artist"] = metadata.albumartist or metadata.artist
+            query["title"] = metadata.album
+            query["label"] = metadata.label
+            query["catno"] = metadata.catalognum
+        except Exception as e:
+            logger.warn("cannot read the tags of %s: %s" % (audio_files[0], e))
+
+    if not query.get("title"):
+        match = DIR_NAME.match(os.path.basename(os.path.normpath(source_dir)).replace("_", " "))
+
+        # without tags, the artist and title cannot be separated reliably
+        query["text"] = match.group("name")
+        query["catno"] = query.get("catno") or match.group("catno")
+
+    return dict((key, value) for key, value in query.items() if value)
+
+class SearchIndex(SqliteCache):
+    """ local inverted index over the releases in the release store and the
+        release cache (artist, title, label, catalog number and the number of
+        tracks), to propose release ids for albums without an id file.
+        The candidates are ranked by a confidence between 0 and 1, which is
+        the weighted overlap (dice coefficient) of the words of the query and
+        the release (see WEIGHTS), only the fields given in the query are taken
+        into account. Terms found in more than max_postings releases (e.g. 'the'
+        or 'various') are not used to find the candidates, only to score them.
+    """
+
+    SCHEMA = ("""CREATE TABLE IF NOT EXISTS releases (
+                   release_id INTEGER PRIMARY KEY,
+                   artist TEXT NOT NULL,
+                   title TEXT NOT NULL,
+                   label TEXT NOT NULL,
+                   catno TEXT NOT NULL,
+                   tracks INTEGER NOT NULL)""",
+              """CREATE TABLE IF NOT EXISTS terms (
+                   term TEXT NOT NULL,
+                   field TEXT NOT NULL,
+                   release_id INTEGER NOT NULL)""",
+              """CREATE INDEX IF NOT EXISTS terms_term ON terms (term)""",
+              """CREATE INDEX IF NOT EXISTS terms_release_id ON terms (release_id)""")
+
+    FIELDS = ("artist", "title", "label", "catno")
+
+    def __init__(self, index_file, max_candidates=200, max_postings=10000):
+        SqliteCache.__init__(self, index_file)
+
+        self.max_candidates = max_candidates
+        self.max_postings = max_postings
+
+    @classmethod
+    def from_config(cls, tagger_config, create=False):
+        """ the index configured as cache:search_index (relative to cache:dir),
+            returns None if the index does not exist (and should not be created)
+        """
+        index_file = os.path.join(cache_dir(tagger_config), tagger_config.get("cache", "search_index"))
+
+        if not create and not os.path.exists(index_file):
+            return None
+
+        return cls(index_file)
+
+    def add_many(self, releases):
+        """ indexes the given releases (json data) in a single transaction """
+        with self._lock:
+            for data in releases:
+                release_id = int(data["id"])
+                fields = release_fields(data)
+
+                self.connection.execute("DELETE FROM terms WHERE release_id = ?", (release_id,))
+                self.connection.execute("INSERT OR REPLACE INTO releases VALUES (?, ?, ?, ?, ?, ?)",
+                                        (release_id, fields["artist"], fields["title"], fields["label"],
+                                         fields["catno"], fields["tracks"]))
+
+                for field in SearchIndex.FIELDS:
+                    self.connection.executemany("INSERT INTO terms VALUES (?, ?, ?)",
+                                                [(term, field, release_id)
+                                                 for term in field_terms(field, fields[field])])
+
+            self.connection.commit()
+
+    def add(self, data):
+        self.add_many([data])
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM releases").fetchone()[0]
+
+    def _release_terms(self, field, release):
+        if field == "text":
+            return field_terms("artist", release["artist"]) | field_terms("title", release["title"])
+        return field_terms(field, release[field])
+
+    def search(self, artist=None, title=None, label=None, catno=None, tracks=None, text=None, limit=10):
+        """ returns the best matching releases as list of (release_id, confidence)
+            tuples, the best one first. text is matched against the artist and
+            the title at once (e.g. a directory name).
+        """
+        query = {"artist": artist, "title": title, "label": label, "catno": catno, "text": text}
+
+        query_terms = {}
+        for field, value in query.items():
+            if value and field_terms(field, value):
+                query_terms[field] = field_terms(field, value)
+
+        if not query_terms:
+            return []
+
+        weights = dict((field, WEIGHTS[field]) for field in query_terms)
+        if tracks:
+            weights["tracks"] = WEIGHTS["tracks"]
+
+        terms = set()
+        for field in query_terms:
+            terms.update(query_terms[field])
+
+        with self._lock:
+            candidates = self._candidates(terms)
+
+            # the matched terms per release and field of the query (for the candidates only)
+            hits = dict((release_id, {}) for release_id in candidates)
+            for field, release_id, term in self._postings(candidates, terms):
+                query_fields = [field]
+                if field in ("artist", "title"):
+                    query_fields.append("text")
+
+                for query_field in query_fields:
+                    if term in query_terms.get(query_field, ()):
+                        hits[release_id].setdefault(query_field, set()).add(term)
+
+            rows = self._rows(candidates)
+
+        total = sum(weights.values())
+
+        results = []
+        for release_id in candidates:
+            release = dict(zip(("artist", "title", "label", "catno", "tracks"), rows[release_id]))
+
+            score = 0.0
+            for field in query_terms:
+                matched = len(hits[release_id].get(field, ()))
+                if matched:
+                    # dice coefficient of the words of the query and the release
+                    score = score + weights[field] * 2.0 * matched / \
+                        (len(query_terms[field]) + len(self._release_terms(field, release)))
+
+            if tracks:
+                difference = abs(int(tracks) - release["tracks"])
+                score = score + weights["tracks"] * max(0.0, 1.0 - float(difference) / max(int(tracks), 1))
+
+            results.append((release_id, min(1.0, score / total)))
+
+        results.sort(key=lambda x: (-x[1], x[0]))
+
+        return results[:limit]
+
+    def _frequent(self, term):
+        """ checks if the given term is in more than max_postings releases (the
+            releases are counted up to this limit only)
+        """
+        count = self.connection.execute(
+            "SELECT COUNT(*) FROM (SELECT DISTINCT release_id FROM terms WHERE term = ? LIMIT ?)",
+            (term, self.max_postings + 1)).fetchone()[0]
+
+        return count > self.max_postings
+
+    def _candidates(self, terms):
+        """ the releases matching most of the given terms (at most max_candidates),
+            ranked by sqlite. Frequent terms are skipped, unless all terms are frequent.
+        """
+        rare_terms = [term for term in terms if not self._frequent(term)]
+
+        if rare_terms:
+            terms = rare_terms
+        else:
+            logger.debug("only frequent terms in the query: %s" % ", ".join(terms))
+
+        terms = list(terms)
+
+        return [row[0] for row in self.connection.execute(
+            """SELECT release_id FROM terms WHERE term IN (%s) GROUP BY release_id
+               ORDER BY COUNT(*) DESC, release_id LIMIT ?""" % ", ".join("?" * len(terms)),
+            terms + [self.max_candidates])]
+
+    def _postings(self, release_ids, terms):
+        """ the (field, release_id, term) postings of the given terms in the given releases """
+        if not release_ids:
+            return []
+
+        terms = list(terms)
+
+        return self.connection.execute(
+            """SELECT field, release_id, term FROM terms WHERE release_id IN (%s) AND term IN (%s)""" %
+            (", ".join("?" * len(release_ids)), ", ".join("?" * len(terms))),
+            list(release_ids) + terms).fetchall()
+
+    def _rows(self, release_ids):
+        """ the (artist, title, label, catno, tracks) of the given releases, by release id """
+        if not release_ids:
+            return {}
+
+        return dict((row[0], row[1:]) for row in self.connection.execute(
+            """SELECT release_id, artist, title, label, catno, tracks FROM releases
+               WHERE release_id IN (%s)""" % ", ".join("?" * len(release_ids)),
+            list(release_ids)))
+
+    def propose(self, source_dir, threshold=0.8, limit=5):
+        """ proposes a release id for the album in the given directory (see
+            folder_query), returns the release id (None, if the best candidate
+            is not confident enough or not better than the second one) and
+            the ranked candidates
+        """
+        candidates = self.search(limit=limit, **folder_query(source_dir))
+
+        if not candidates or candidates[0][1] < threshold:
+            return None, candidates
+
+        if len(candidates) > 1 and candidates[1][1] == candidates[0][1]:
+            logger.warn("ambiguous candidates for %s: %s" % (source_dir, candidates))
+            return None, candidates
+
+        return candidates[0][0], candidates
+
+class CatalogIndex(SqliteCache):
+    """ index of the catalog numbers (and labels) of the releases in the release
+        store, to resolve the release ids of albums whose catalog number is
+        known (e.g. from the directory name, see the dir format) without any
+        search. The catalog numbers are compared without spaces and separators
+        (see catno_key), the same for the labels.
+    """
+
+    SCHEMA = ("""CREATE TABLE IF NOT EXISTS catnos (
+                   catno TEXT NOT NULL,
+                   label TEXT NOT NULL,
+                   release_id INTEGER NOT NULL)""",
+              """CREATE INDEX IF NOT EXISTS catnos_catno ON catnos (catno)""",
+              """CREATE INDEX IF NOT EXISTS catnos_release_id ON catnos (release_id)""")
+
+    # maximum number of parameters of a single query (see sqlite)
+    CHUNK_SIZE = 500
+
+    def __init__(self, index_file):
+        SqliteCache.__init__(self, index_file)
+
+    @classmethod
+    def from_config(cls, tagger_config, create=False):
+        """ the index configured as cache:catalog_index (relative to cache:dir),
+            returns None if the index does not exist (and should not be created)
+        """
+        index_file = os.path.join(cache_dir(tagger_config), tagger_config.get("cache", "catalog_index"))
+
+        if not create and not os.path.exists(index_file):
+            return None
+
+        return cls(index_file)
+
+    def add_many(self, releases):
+        """ indexes the given releases (json data) in a single transaction """
+        with self._lock:
+            for data in releases:
+                release_id = int(data["id"])
+
+                self.connection.execute("DELETE FROM catnos WHERE release_id = ?", (release_id,))
+                self.connection.executemany("INSERT INTO catnos VALUES (?, ?, ?)",
+                                            set((catno_key(label.get("catno")), catno_key(label.get("name")),
+                                                 release_id)
+                                                for label in data.get("labels", [])
+                                                if catno_key(label.get("catno")) not in ("", "none")))
+
+            self.connection.commit()
+
+    def add(self, data):
+        self.add_many([data])
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(DISTINCT release_id) FROM catnos").fetchone()[0]
+
+    def resolve_many(self, queries):
+        """ resolves the given (catno, label) tuples (label may be None) at once,
+            returns a dict (catno, label) -> list of release ids. If a label is
+            given, only the releases of this label are returned, unless there
+            is none.
+        """
+        keys = dict((query, (catno_key(query[0]), catno_key(query[1]))) for query in queries)
+        catnos = list(set(catno for catno, label in keys.values() if catno))
+
+        matches = {}
+        with self._lock:
+            for start in range(0, len(catnos), CatalogIndex.CHUNK_SIZE):
+                chunk = catnos[start:start + CatalogIndex.CHUNK_SIZE]
+                for catno, label, release_id in self.connection.execute(
+                        "SELECT catno, label, release_id FROM catnos WHERE catno IN (%s) ORDER BY release_id" %
+                        ", ".join("?" * len(chunk)), chunk):
+                    matches.setdefault(catno, []).append((label, release_id))
+
+        results = {}
+        for query, (catno, label) in keys.items():
+            candidates = matches.get(catno, [])
+            release_ids = [release_id for candidate_label, release_id in candidates if candidate_label == label]
+
+            if not label or not release_ids:
+                release_ids = [release_id for candidate_label, release_id in candidates]
+
+            # a release can have the same catalog number on several labels
+            results[query] = sorted(set(release_ids))
+
+        return results
+
+    def resolve(self, catno, label=None):
+        """ returns the ids of the releases with the given catalog number """
+        return self.resolve_many([(catno, label)])[(catno, label)]
+
+    def resolve_tree(self, base_dir, id_file=None):
+        """ resolves the release ids of all albums beneath base_dir by the catalog
+            numbers in their directory names (see the dir format). Directories
+            containing id_file are skipped. Returns a dict directory -> list of
+            release ids (empty, if none is found) for all directories with a
+            catalog number in their name.
+        """
+        dirs = {}
+        for root, subdirs, files in os.walk(os.path.expanduser(base_dir)):
+            if id_file and id_file in files:
+                continue
+
+            catno = dir_catno(root)
+            if catno:
+                dirs[root] = catno
+
+        results = self.resolve_many((catno, None) for catno in dirs.values())
+
+        return dict((root, results[(catno, None)]) for root, catno in dirs.items())
+
+def index_releases(index, release_store=None, release_cache=None, batch_size=1000):
+    """ (re-)indexes all releases of the release store and the release cache
+        in the given index (SearchIndex or CatalogIndex), returns the number
+        of releases indexed
+    """
+    count = 0
+
+    for source in (release_store, release_cache):
+        if source is None:
+            continue
+
+        release_ids = source.ids()
+        for start in range(0, len(release_ids), batch_size):
+            batch = [source.get(release_id) for release_id in release_ids[start:start + batch_size]]
+            index.add_many(data for data in batch if data is not None)
+            count = count + len(batch)
+
+    return count
@@ -0,0 +1,206 @@
+import os
+import re
+import json
+import time
+import random
+import shutil
+import threading
+import collections
+import logging
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from releasestore import read_release_json
+
+logger = logging
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    """ answers the requests to the stand-in server, see StandInServer """
+
+    RELEASE_PATH = re.compile("^/releases/(?P<release_id>\d+)/?$")
+    IMAGE_PATH = re.compile("^/images/(?P<name>[^/]+)$")
+
+    def do_GET(self):
+        standin = self.server.standin
+        path = self.path.split("?")[0]
+
+        time.sleep(standin.latency)
+
+        status_code, headers = standin.admit()
+
+        if status_code == 429:
+            self.send_json(429, {"message": "You are making requests too quickly."}, headers)
+            return
+
+        if status_code is not None:
+            self.send_json(status_code, {"message": "Injected server error."}, headers)
+            return
+
+        match = StandInRequestHandler.RELEASE_PATH.match(path)
+        if match:
+            data = standin.release(match.group("release_id"))
+            if data is None:
+                self.send_json(404, {"message": "Release not found."}, headers)
+            else:
+                self.send_json(200, data, headers)
+            return
+
+        match = StandInRequestHandler.IMAGE_PATH.match(path)
+        if match:
+            image_file = standin.image(match.group("name"))
+            if image_file is None:
+                self.send_json(404, {"message": "Image not found."}, headers)
+            else:
+                self.send_file(image_file, headers)
+            return
+
+        self.send_json(404, {"message": "The requested resource was not found."}, headers)
+
+    def send_headers(self, status_code, content_type, content_length, headers):
+        self.send_response(status_code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(content_length))
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        self.end_headers()
+
+    def send_json(self, status_code, data, headers):
+        content = json.dumps(data)
+        self.send_headers(status_code, "application/json", len(content), headers)
+        self.wfile.write(content)
+
+    def send_file(self, file_name, headers):
+        self.send_headers(200, "image/jpeg", os.path.getsize(file_name), headers)
+        with open(file_name, "rb") as fh:
+            shutil.copyfileobj(fh, self.wfile)
+
+    def log_message(self, format, *args):
+        logger.debug("stand-in: %s" % (format % args))
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # e.g. the client gave up waiting (see the latency)
+        logger.debug("stand-in: request from %s:%d aborted" % client_address)
+
+class StandInServer(object):
+    """ local stand-in for the discogs api server, to be able to test and
+        benchmark the fetching of releases and images without a network (and
+        without authentication). The releases are read from the <release_id>.json
+        files in release_dir (as written by scripts/fetch_json.py), the images
+        from image_dir (default_image is served for all other images). The image
+        uris of the releases point to the stand-in server.
+        Like discogs, the number of requests is limited in a moving window of
+        60 seconds (see the X-Discogs-Ratelimit headers), further requests are
+        answered with 429. Additionally each request can be delayed (latency)
+        and server errors can be injected (error_rate or fail).
+    """
+
+    WINDOW = 60
+
+    def __init__(self, release_dir, image_dir=None, default_image=None, host="127.0.0.1", port=0,
+                 rate_limit=60, latency=0.0, error_rate=0.0, seed=None):
+        self.release_dir = release_dir
+        self.image_dir = image_dir
+        self.default_image = default_image
+        self.rate_limit = rate_limit
+        self.latency = latency
+        self.error_rate = error_rate
+
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0}
+
+        self._random = random.Random(seed)
+        self._requests = collections.deque()
+        self._failures = collections.deque()
+        self._lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer((host, port), StandInRequestHandler)
+        self.server.standin = self
+
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return "http://%s:%d" % (host, port)
+
+    def start(self):
+        """ serves the requests in a background thread """
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fail(self, count=1, status_code=503):
+        """ answers the next count requests with the given status code """
+        with self._lock:
+            self._failures.extend([status_code] * count)
+
+    def admit(self):
+        """ counts the request in the rate limit window, returns the status code
+            to answer with (None if the request is served) and the rate limit headers
+        """
+        with self._lock:
+            now = time.time()
+            self.stats["requests"] = self.stats["requests"] + 1
+
+            while self._requests and self._requests[0] <= now - StandInServer.WINDOW:
+                self._requests.popleft()
+
+            status_code = None
+            if len(self._requests) >= self.rate_limit:
+                self.stats["throttled"] = self.stats["throttled"] + 1
+                status_code = 429
+            else:
+                self._requests.append(now)
+
+                if self._failures:
+                    status_code = self._failures.popleft()
+                elif self.error_rate and self._random.random() < self.error_rate:
+                    status_code = self._random.choice((500, 502, 503))
+
+                if status_code is not None:
+                    self.stats["errors"] = self.stats["errors"] + 1
+
+            used = len(self._requests)
+
+        headers = {"X-Discogs-Ratelimit": self.rate_limit,
+                   "X-Discogs-Ratelimit-Used": used,
+                   "X-Discogs-Ratelimit-Remaining": max(0, self.rate_limit - used)}
+
+        return status_code, headers
+
+    def release(self, release_id):
+        """ the json data of the given release (None if there is no json file) """
+        json_file = os.path.join(self.release_dir, "%s.json" % release_id)
+        if not os.path.exists(json_file):
+            return None
+
+        data = read_release_json(json_file)
+
+        for image in data.get("images", []):
+            for key in ("uri", "uri150", "resource_url"):
+                if key in image:
+                    image[key] = "%s/images/%s" % (self.base_url, image[key].split("/")[-1])
+
+        return data
+
+    def image(self, name):
+        """ the file to serve for the given image name (None if there is none) """
+        if self.image_dir:
+            image_file = os.path.join(self.image_dir, os.path.basename(name))
+            if os.path.isfile(image_file):
+                return image_file
+
+        return self.default_image
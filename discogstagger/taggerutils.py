@@ -2,11 +2,14 @@
 from urllib import FancyURLopener
 import errno
 import os
+import subprocess
 import re
 import sys
 import logging
 import shutil
 import imghdr
+import time
+import collections
 
 from unicodedata import normalize
 
@@ -15,6 +18,7 @@ from mako.lookup import TemplateLookup
 
 from discogstagger.discogsalbum import DiscogsAlbum
 from discogstagger.album import Album, Disc, Track
+from discogstagger.dirscan import DirectorySnapshot, missing_files
 
 from ext.mediafile import MediaFile
 
@@ -23,6 +27,211 @@ sys.setdefaultencoding("utf-8")
 
 logger = logging
 
+# the variables of the file-formatting options (see conf/default.conf), each
+# evaluated using the album, the disc and track number and the file type
+FORMAT_VARIABLES = {
+    "ALBTITLE": lambda album, discno, trackno, filetype: album.title,
+    "ALBARTIST": lambda album, discno, trackno, filetype: album.artist,
+    "YEAR": lambda album, discno, trackno, filetype: album.year,
+    "CATNO": lambda album, discno, trackno, filetype: album.catnumbers[0],
+    "GENRE": lambda album, discno, trackno, filetype: album.genre,
+    "STYLE": lambda album, discno, trackno, filetype: album.style,
+    "ARTIST": lambda album, discno, trackno, filetype: album.disc(discno).track(trackno).artist,
+    "TITLE": lambda album, discno, trackno, filetype: album.disc(discno).track(trackno).title,
+    "DISCNO": lambda album, discno, trackno, filetype: discno,
+    "TRACKNO": lambda album, discno, trackno, filetype: "%.2d" % trackno,
+    "TYPE": lambda album, discno, trackno, filetype: filetype,
+    "LABEL": lambda album, discno, trackno, filetype: album.labels[0],
+}
+
+FORMAT_VARIABLE = re.compile("%%(%s)%%" % "|".join(FORMAT_VARIABLES))
+
+class FormatProgram(object):
+    """ a file-formatting option (e.g. %TRACKNO%-%ARTIST%-%TITLE%%TYPE%) compiled
+        into a list of literal strings and the variables used, so that only
+        those variables are evaluated when filling in the format
+    """
+
+    def __init__(self, format):
+        self.format = format
+        self.program = []
+
+        position = 0
+        for match in FORMAT_VARIABLE.finditer(format):
+            if match.start() > position:
+                self.program.append((format[position:match.start()], None))
+            self.program.append((None, FORMAT_VARIABLES[match.group(1)]))
+            position = match.end()
+
+        if position < len(format):
+            self.program.append((format[position:], None))
+
+    def render(self, album, discno=1, trackno=1, filetype=".mp3"):
+        parts = []
+        for literal, variable in self.program:
+            if variable is None:
+                parts.append(literal)
+            else:
+                parts.append(str(variable(album, discno, trackno, filetype)))
+
+        return "".join(parts)
+
+# the compiled format programs by their format
+_format_programs = {}
+
+def compile_format(format):
+    """ returns the (cached) FormatProgram of the given format """
+    try:
+        return _format_programs[format]
+    except KeyError:
+        program = _format_programs[format] = FormatProgram(format)
+        return program
+
+# the characters removed from file names (after the character exceptions)
+UNWANTED_CHARACTERS = re.compile(r"[^-\w.\(\)_]")
+
+class FilenameSanitizer(object):
+    """ removes unwanted characters from file names (see TaggerUtils.get_clean_filename),
+        compiled once from the character exceptions: the single characters are
+        replaced by a translation table, the longer ones in one pass of a regex.
+        This gives the same names as replacing the exceptions one after another,
+        as long as they do not interfere (no key contains a character of another
+        key or of a replacement), otherwise they are still replaced one after
+        another. The clean names are kept in a bounded memo.
+    """
+
+    def __init__(self, char_exceptions, use_lower, max_entries=20000):
+        self.use_lower = use_lower
+        self.max_entries = max_entries
+
+        # the keys and values are utf-8 encoded
+        exceptions = [(unicode(k, "utf-8"), unicode(v, "utf-8")) for k, v in char_exceptions.iteritems()]
+
+        self.sequential = None
+        self.translation = {}
+        self.pattern = None
+        self.replacements = {}
+
+        if self._interfere(exceptions):
+            self.sequential = exceptions
+        else:
+            longer = []
+            for k, v in exceptions:
+                if len(k) == 1:
+                    self.translation[ord(k)] = v
+                elif k:
+                    self.replacements[k] = v
+                    longer.append(k)
+
+            if longer:
+                longer.sort(key=len, reverse=True)
+                self.pattern = re.compile("|".join(re.escape(k) for k in longer), re.UNICODE)
+
+        self._names = collections.OrderedDict()
+
+    def _interfere(self, exceptions):
+        """ checks if replacing the exceptions one after another depends on their order """
+        seen = set()
+        for k, v in exceptions:
+            if not k or seen.intersection(k):
+                return True
+            seen.update(k)
+
+        return any(seen.intersection(v) for k, v in exceptions)
+
+    def clean(self, f):
+        try:
+            return self._names[f]
+        except KeyError:
+            pass
+
+        cf = self._clean(f)
+
+        if len(self._names) >= self.max_entries:
+            self._names.popitem(last=False)
+        self._names[f] = cf
+
+        return cf
+
+    def _clean(self, f):
+        filename, fileext = os.path.splitext(f)
+
+        if not fileext in TaggerUtils.FILE_TYPE and not fileext in [".m3u", ".nfo"]:
+            filename = f
+            fileext = ""
+
+        a = unicode(filename, "utf-8")
+
+        if self.sequential is not None:
+            for k, v in self.sequential:
+                a = a.replace(k, v)
+        else:
+            if self.translation:
+                a = a.translate(self.translation)
+            if self.pattern is not None:
+                a = self.pattern.sub(lambda match: self.replacements[match.group(0)], a)
+
+        a = normalize("NFKD", a).encode("ascii", "ignore")
+
+        cf = UNWANTED_CHARACTERS.sub("", a)
+
+        cf = cf.replace(" ", "_")
+        cf = cf.replace("__", "_")
+        cf = cf.replace("_-_", "-")
+
+        cf = "".join([cf, fileext])
+
+        if self.use_lower:
+            cf = cf.lower()
+
+        return cf
+
+# the sanitizers by their character exceptions (in order) and use_lower
+_filename_sanitizers = {}
+
+def filename_sanitizer(char_exceptions, use_lower):
+    """ returns the (shared) FilenameSanitizer for the given options """
+    key = (tuple(char_exceptions.iteritems()), use_lower)
+
+    try:
+        return _filename_sanitizers[key]
+    except KeyError:
+        sanitizer = _filename_sanitizers[key] = FilenameSanitizer(char_exceptions, use_lower)
+        return sanitizer
+
+# the template lookups shared by all albums, by their directories and module directory
+_template_lookups = {}
+_compiled_templates = set()
+
+# the time spent on compiling (or loading the compiled modules of) the templates
+# and on rendering them, for the whole run
+template_stats = {"compiled": 0, "compile_time": 0.0, "rendered": 0, "render_time": 0.0}
+
+def template_lookup(module_directory=None, directories=("templates", )):
+    """ returns the (shared) mako template lookup for the given template directories,
+        the templates are compiled into python modules in module_directory (if
+        given), so that they are compiled only once for all runs and processes
+    """
+    key = (tuple(directories), module_directory)
+
+    try:
+        return _template_lookups[key]
+    except KeyError:
+        lookup = _template_lookups[key] = TemplateLookup(directories=list(directories),
+                                                         module_directory=module_directory)
+        return lookup
+
+def template_module_directory(tagger_config):
+    """ the directory of the compiled templates (see cache:template_modules), None
+        if the templates are compiled in memory only
+    """
+    module_directory = tagger_config.get("cache", "template_modules")
+
+    if not module_directory:
+        return None
+
+    return os.path.join(os.path.expanduser(tagger_config.get("cache", "dir")), module_directory)
+
 class TagOpener(FancyURLopener, object):
 
     version = "discogstagger2"
@@ -69,77 +278,224 @@ class TagHandler(object):
         # load metadata information
         logger.debug("target_folder: %s" % target_folder)
 
-        metadata = MediaFile(os.path.join(target_folder, track.new_file))
-
-        # read already existing (and still wanted) properties
-        keepTags = {}
-        for name in self.keep_tags.split(","):
-            logger.debug("name %s" % name)
-            if getattr(metadata, name):
-                keepTags[name] = getattr(metadata, name)
+        write_tags(os.path.join(target_folder, track.new_file), self.track_tags(track),
+                   self.keep_tags.split(","))
 
-        # remove current metadata
-        metadata.delete()
+    def track_tags(self, track):
+        """ the tags of the given track, as a list of (name, value) pairs set
+            in this order (see write_tags)
+        """
+        tags = []
 
         # set album metadata
-        metadata.album = self.album.title
-        metadata.composer = self.album.artist
+        tags.append(("album", self.album.title))
+        tags.append(("composer", self.album.artist))
 
         # use list of albumartists
-        metadata.albumartists = self.album.artists
+        tags.append(("albumartists", self.album.artists))
 
 # !TODO really, or should we generate this using a specific method?
-        metadata.albumartist_sort = self.album.sort_artist
+        tags.append(("albumartist_sort", self.album.sort_artist))
 
 # !TODO should be joined
-        metadata.label = self.album.labels[0]
+        tags.append(("label", self.album.labels[0]))
 
-        metadata.year = self.album.year
-        metadata.country = self.album.country
+        tags.append(("year", self.album.year))
+        tags.append(("country", self.album.country))
 
-        metadata.catalognum = self.album.catnumbers[0]
+        tags.append(("catalognum", self.album.catnumbers[0]))
 
         # add styles to the grouping tag
-        metadata.groupings = self.album.styles
+        tags.append(("groupings", self.album.styles))
 
         # use genres to allow multiple genres in muliple fields
-        metadata.genres = self.album.genres
+        tags.append(("genres", self.album.genres))
 
         # this assumes, that there is a metadata-tag with the id_tag_name in the
         # metadata object
-        setattr(metadata, self.config.id_tag_name, self.album.id)
-        metadata.discogs_release_url = self.album.url
+        tags.append((self.config.id_tag_name, self.album.id))
+        tags.append(("discogs_release_url", self.album.url))
 
-        metadata.disc = track.discnumber
-        metadata.disctotal = len(self.album.discs)
+        tags.append(("disc", track.discnumber))
+        tags.append(("disctotal", len(self.album.discs)))
 
         if self.album.is_compilation:
-            metadata.comp = True
+            tags.append(("comp", True))
 
-        metadata.comments = self.album.notes
+        tags.append(("comments", self.album.notes))
 
-        tags = self.config.get_configured_tags
-        logger.debug("tags: %s" % tags)
-        for name in tags:
+        configured_tags = self.config.get_configured_tags
+        logger.debug("tags: %s" % configured_tags)
+        for name in configured_tags:
             value = self.config.get("tags", name)
             if not value == None:
-                setattr(metadata, name, value)
+                tags.append((name, value))
 
         # set track metadata
-        metadata.title = track.title
-        metadata.artists = track.artists
+        tags.append(("title", track.title))
+        tags.append(("artists", track.artists))
 
 # !TODO take care about sortartist ;-)
-        metadata.artist_sort = track.sort_artist
-        metadata.track = track.tracknumber
+        tags.append(("artist_sort", track.sort_artist))
+        tags.append(("track", track.tracknumber))
+
+        tags.append(("tracktotal", len(self.album.disc(track.discnumber).tracks)))
+
+        return tags
+
+def write_tags(file_name, tags, keep_tags=()):
+    """ replaces the metadata of the given file by the given (name, value) tags,
+        the tags named in keep_tags keep their current values (if set)
+    """
+    metadata = MediaFile(file_name)
+
+    # read already existing (and still wanted) properties
+    keepTags = {}
+    for name in keep_tags:
+        logger.debug("name %s" % name)
+        if getattr(metadata, name):
+            keepTags[name] = getattr(metadata, name)
+
+    # remove current metadata
+    metadata.delete()
+
+    for name, value in tags:
+        setattr(metadata, name, value)
+
+    for name in keepTags:
+        setattr(metadata, name, keepTags[name])
+
+    metadata.save()
+
+def embed_coverart(track_file, imgdata):
+    """ embeds the given image into a single file """
+    metadata = MediaFile(track_file)
+    metadata.art = imgdata
+    metadata.save()
+
+def is_embeddable(image_file):
+    """ returns the data of the given image, if it can be embedded (None otherwise) """
+    if not os.path.exists(image_file):
+        return None
+
+    imgdata = open(image_file).read()
+    imgtype = imghdr.what(None, imgdata)
+
+    if imgtype in ("jpeg", "png"):
+        return imgdata
+
+    return None
+
+def add_replay_gain_tags(albumdir):
+    """
+        Add replay gain tags to all flac files in the given directory.
+
+        Uses the default metaflac command, therefor this has to be installed
+        on your system, to be able to use this method.
+    """
+    cmd = []
+    cmd.append("metaflac")
+    cmd.append("--preserve-modtime")
+    cmd.append("--add-replay-gain")
 
-        metadata.tracktotal = len(self.album.disc(track.discnumber).tracks)
+    subdirs = next(os.walk(albumdir))[1]
 
-        if not keepTags is None:
-            for name in keepTags:
-                setattr(metadata, name, keepTags[name])
+    pattern = albumdir
+    if not subdirs:
+        pattern = pattern + "/*.flac"
+    else:
+        pattern = pattern + "/**/*.flac"
 
-        metadata.save()
+    cmd.append(pattern)
+
+    line = subprocess.list2cmdline(cmd)
+    p = subprocess.Popen(line, shell=True)
+    return_code = p.wait()
+    logging.debug("return %s" % str(return_code))
+
+def mkdir_p(path):
+    try:
+        os.makedirs(path)
+    except OSError as exc: # Python >2.5
+        if exc.errno == errno.EEXIST and os.path.isdir(path):
+            pass
+        else: raise
+
+def copy_files(files):
+    """ copies the given (source file, target file) pairs, renaming the files
+        if necessary. Files staying in their folder are not copied, existing
+        target files are kept (each target folder is listed once instead of
+        checking each file)
+    """
+    target_files = {}
+
+    for source_file, target_file in files:
+        target_folder, target_name = os.path.split(target_file)
+
+        if os.path.dirname(source_file) == target_folder:
+            continue
+
+        if not target_folder in target_files:
+            if os.path.isdir(target_folder):
+                target_files[target_folder] = set(os.listdir(target_folder))
+            else:
+                mkdir_p(target_folder)
+                target_files[target_folder] = set()
+
+        if not target_name in target_files[target_folder]:
+            logger.debug("copying file %s" % source_file)
+            shutil.copyfile(source_file, target_file)
+            target_files[target_folder].add(target_name)
+
+def copy_other_files(files):
+    """ copies the given (source file, target file) pairs of the "other files" """
+    if files:
+        logger.info("copying files from source directory")
+
+    target_folders = set()
+
+    for source_file, target_file in files:
+        target_folder = os.path.dirname(target_file)
+
+        if not target_folder in target_folders:
+            mkdir_p(target_folder)
+            target_folders.add(target_folder)
+
+        shutil.copyfile(source_file, target_file)
+
+def download_images(connector, downloads, target_dir):
+    """ downloads the given (target file, url) images using the given connector,
+        errors are logged only (the images are not needed to tag the album)
+    """
+    if not downloads:
+        return
+
+    mkdir_p(target_dir)
+
+    try:
+        connector.fetch_images(downloads)
+    except Exception as e:
+        logger.error("Unable to download images to '%s', skipping: %s" % (target_dir, e))
+
+def embed_coverart_files(image_file, track_files):
+    """ embeds the given image into all given files (if it can be embedded) """
+    if image_file is None:
+        return
+
+    imgdata = is_embeddable(image_file)
+
+    if imgdata is not None:
+        logger.info("Embedding album art...")
+        for track_file in track_files:
+            embed_coverart(track_file, imgdata)
+
+def create_done_file(done_file):
+    try:
+        open(done_file, "w").close()
+    except IOError as e:
+        # could be, that the directory does not exist anymore ;-)
+        if e.errno != errno.ENOENT:
+            raise
 
 class FileHandler(object):
     """ this class contains all file handling tasks for the tagger,
@@ -156,22 +512,37 @@ class FileHandler(object):
         self.album = album
 
     def mkdir_p(self, path):
-        try:
-            os.makedirs(path)
-        except OSError as exc: # Python >2.5
-            if exc.errno == errno.EEXIST and os.path.isdir(path):
-                pass
-            else: raise
+        mkdir_p(path)
 
     def create_done_file(self):
-        # could be, that the directory does not exist anymore ;-)
-        if os.path.exists(self.album.sourcedir):
-            done_file = os.path.join(self.album.sourcedir, self.config.get("details", "done_file"))
-            open(done_file, "w")
+        create_done_file(os.path.join(self.album.sourcedir, self.config.get("details", "done_file")))
+
+    def disc_folders(self, disc):
+        """ the source and the target folder of the given disc """
+        if disc.sourcedir != None:
+            source_folder = os.path.join(self.album.sourcedir, disc.sourcedir)
+        else:
+            source_folder = self.album.sourcedir
+
+        if disc.target_dir != None:
+            target_folder = os.path.join(self.album.target_dir, disc.target_dir)
+        else:
+            target_folder = self.album.target_dir
+
+        return source_folder, target_folder
+
+    def track_files(self):
+        """ the (track, source file, target file) of all tracks of the album """
+        files = []
+
+        for disc in self.album.discs:
+            source_folder, target_folder = self.disc_folders(disc)
 
-    def create_album_dir(self):
-        if not os.path.exists(self.album.target_dir):
-            self.mkdir_p(self.album.target_dir)
+            for track in disc.tracks:
+                files.append((track, os.path.join(source_folder, track.orig_file),
+                              os.path.join(target_folder, track.new_file)))
+
+        return files
 
     def copy_files(self):
         """
@@ -181,43 +552,14 @@ class FileHandler(object):
         logger.debug("album sourcedir: %s" % self.album.sourcedir)
         logger.debug("album targetdir: %s" % self.album.target_dir)
 
-        for disc in self.album.discs:
-            logger.debug("disc.sourcedir: %s" % disc.sourcedir)
-            logger.debug("disc.target_dir: %s" % disc.target_dir)
-
-            if disc.sourcedir != None:
-                source_folder = os.path.join(self.album.sourcedir, disc.sourcedir)
-            else:
-                source_folder = self.album.sourcedir
-
-            if disc.target_dir != None:
-                target_folder = os.path.join(self.album.target_dir, disc.target_dir)
-            else:
-                target_folder = self.album.target_dir
+        files = [(source_file, target_file) for track, source_file, target_file in self.track_files()]
 
-            copy_needed = False
-            if not source_folder == target_folder:
-                if not os.path.exists(target_folder):
-                    self.mkdir_p(target_folder)
-                copy_needed = True
+        # the sources are looked up in the snapshot (see TaggerUtils._get_target_list)
+        for source_file in missing_files([source_file for source_file, target_file in files],
+                                         self.album.snapshot):
+            logger.error("Source %s does not exist" % source_file)
 
-            for track in disc.tracks:
-                logger.debug("source_folder: %s" % source_folder)
-                logger.debug("target_folder: %s" % target_folder)
-                logger.debug("orig_file: %s" % track.orig_file)
-                logger.debug("new_file: %s" % track.new_file)
-
-                source_file = os.path.join(source_folder, track.orig_file)
-                target_file = os.path.join(target_folder, track.new_file)
-
-                if copy_needed and not os.path.exists(target_file):
-                    if not os.path.exists(source_file):
-                        logger.error("Source does not exists")
-                        # throw error
-                    logger.debug("copying files (%s/%s)", source_folder, track.orig_file)
-                    
-                    shutil.copyfile(os.path.join(source_folder, track.orig_file),
-                        os.path.join(target_folder, track.new_file))
+        copy_files(files)
 
     def remove_source_dir(self):
         """
@@ -233,40 +575,64 @@ class FileHandler(object):
             logger.warn("Deleting source directory '%s'" % source_dir)
             shutil.rmtree(source_dir)
 
+    def other_files(self):
+        """ the (source file, target file) of the "other files" to copy (see
+            config option details:copy_other_files)
+        """
+        files = []
+
+        if not self.config.getboolean("details", "copy_other_files"):
+            return files
+
+        if self.album.copy_files != None:
+            for fname in self.album.copy_files:
+                files.append((os.path.join(self.album.sourcedir, fname), os.path.join(self.album.target_dir, fname)))
+
+        for disc in self.album.discs:
+            source_path, target_path = self.disc_folders(disc)
+
+            for fname in disc.copy_files:
+                if not fname.endswith(".m3u"):
+                    files.append((os.path.join(source_path, fname), os.path.join(target_path, fname)))
+
+        return files
+
     def copy_other_files(self):
         # copy "other files" on request
-        copy_other_files = self.config.getboolean("details", "copy_other_files")
+        copy_other_files(self.other_files())
 
-        if copy_other_files:
-            logger.info("copying files from source directory")
+    def image_downloads(self):
+        """
+            the (target file, url) of the images to download, the first image
+            (mostly folder.jpg) is the cover (see cover_file)
+        """
+        downloads = []
 
-            if not os.path.exists(self.album.target_dir):
-                self.mkdir_p(self.album.target_dir)
+        if not self.album.images:
+            return downloads
 
-            copy_files = self.album.copy_files
+        image_format = self.config.get("file-formatting", "image")
+        use_folder_jpg = self.config.getboolean("details", "use_folder_jpg")
+        download_only_cover = self.config.getboolean("details", "download_only_cover")
 
-            if copy_files != None:
-                for fname in copy_files:
-                    shutil.copyfile(os.path.join(self.album.sourcedir, fname), os.path.join(self.album.target_dir, fname))
+        logger.debug("image-format: %s" % image_format)
+        logger.debug("use_folder_jpg: %s" % use_folder_jpg)
 
-            for disc in self.album.discs:
-                copy_files = disc.copy_files
+        no = 0
+        for i, image_url in enumerate(self.album.images, 0):
+            picture_name = ""
+            if i == 0 and use_folder_jpg:
+                picture_name = "folder.jpg"
+            else:
+                no = no + 1
+                picture_name = image_format + "-%.2d.jpg" % no
 
-                for fname in copy_files:
-                    if not fname.endswith(".m3u"):
-                        if disc.sourcedir != None:
-                            source_path = os.path.join(self.album.sourcedir, disc.sourcedir)
-                        else:
-                            source_path = self.album.sourcedir
+            downloads.append((os.path.join(self.album.target_dir, picture_name), image_url))
 
-                        if disc.target_dir != None:
-                            target_path = os.path.join(self.album.target_dir, disc.target_dir)
-                        else:
-                            target_path = self.album.target_dir
+            if i == 0 and download_only_cover:
+                break
 
-                        if not os.path.exists(target_path):
-                            self.mkdir_p(target_path)
-                        shutil.copyfile(os.path.join(source_path, fname), os.path.join(target_path, fname))
+        return downloads
 
     def get_images(self, conn_mgr):
         """
@@ -278,45 +644,18 @@ class FileHandler(object):
             we need http access here as well (see discogsalbum), and therefore the
             user-agent
         """
-        if self.album.images:
-            images = self.album.images
-
-            logger.debug("images: %s" % images)
-
-            image_format = self.config.get("file-formatting", "image")
-            use_folder_jpg = self.config.getboolean("details", "use_folder_jpg")
-            download_only_cover = self.config.getboolean("details", "download_only_cover")
-
-            logger.debug("image-format: %s" % image_format)
-            logger.debug("use_folder_jpg: %s" % use_folder_jpg)
-
-            self.create_album_dir()
-
-            no = 0
-            for i, image_url in enumerate(images, 0):
-                logger.debug("Downloading image '%s'" % image_url)
-                try:
-                    picture_name = ""
-                    if i == 0 and use_folder_jpg:
-                        picture_name = "folder.jpg"
-                    else:
-                        no = no + 1
-                        picture_name = image_format + "-%.2d.jpg" % no
-
-                    conn_mgr.fetch_image(os.path.join(self.album.target_dir, picture_name), image_url)
+        logger.debug("images: %s" % self.album.images)
 
-                    if i == 0 and download_only_cover:
-                        break
+        download_images(conn_mgr, self.image_downloads(), self.album.target_dir)
 
-                except Exception as e:
-                    logger.error("Unable to download image '%s', skipping." % image_url)
-                    print e
-
-    def embed_coverart_album(self):
+    def cover_file(self):
         """
-            Embed cover art into all album files
+            the image to embed into all album files, None if embedding is
+            not requested (see config option details:embed_coverart)
         """
-        embed_coverart = self.config.getboolean("details", "embed_coverart")
+        if not self.config.getboolean("details", "embed_coverart"):
+            return None
+
         image_format = self.config.get("file-formatting", "image")
         use_folder_jpg = self.config.getboolean("details", "use_folder_jpg")
 
@@ -325,62 +664,31 @@ class FileHandler(object):
         else:
             first_image_name = image_format + "-01.jpg"
 
-        image_file = os.path.join(self.album.target_dir, first_image_name)
+        return os.path.join(self.album.target_dir, first_image_name)
 
+    def embed_coverart_album(self):
+        """
+            Embed cover art into all album files
+        """
         logger.debug("Start to embed coverart (on request)...")
 
-        if embed_coverart and os.path.exists(image_file):
-            logger.debug("embed_coverart and image_file")
-            imgdata = open(image_file).read()
-            imgtype = imghdr.what(None, imgdata)#
-
-            if imgtype in ("jpeg", "png"):
-                logger.info("Embedding album art...")
-                for disc in self.album.discs:
-                    for track in disc.tracks:
-                        self.embed_coverart_track(disc, track, imgdata)
+        embed_coverart_files(self.cover_file(),
+                             [target_file for track, source_file, target_file in self.track_files()])
 
     def embed_coverart_track(self, disc, track, imgdata):
         """
             Embed cover art into a single file
         """
-        if disc.target_dir != None:
-            track_dir = os.path.join(self.album.target_dir, disc.target_dir)
-        else:
-            track_dir = self.album.target_dir
+        source_folder, target_folder = self.disc_folders(disc)
 
-        track_file = os.path.join(track_dir, track.new_file)
-        metadata = MediaFile(track_file)
-        metadata.art = imgdata
-        metadata.save()
+        embed_coverart(os.path.join(target_folder, track.new_file), imgdata)
 
     def add_replay_gain_tags(self):
         """
-            Add replay gain tags to all flac files in the given directory.
-
-            Uses the default metaflac command, therefor this has to be installed
-            on your system, to be able to use this method.
+            Add replay gain tags to all flac files in the album directory
+            (see add_replay_gain_tags)
         """
-        cmd = []
-        cmd.append("metaflac")
-        cmd.append("--preserve-modtime")
-        cmd.append("--add-replay-gain")
-
-        albumdir = self.album.target_dir
-        subdirs = next(os.walk(albumdir))[1]
-
-        pattern = albumdir
-        if not subdirs:
-            pattern = pattern + "/*.flac"
-        else:
-            pattern = pattern + "/**/*.flac"
-
-        cmd.append(pattern)
-
-        line = subprocess.list2cmdline(cmd)
-        p = subprocess.Popen(line, shell=True)
-        return_code = p.wait()
-        logging.debug("return %s" % str(return_code))
+        add_replay_gain_tags(self.album.target_dir)
 
 
 class TaggerUtils(object):
@@ -414,6 +722,7 @@ class TaggerUtils(object):
 #        self.first_image_name = "folder.jpg"
         self.copy_other_files = self.config.getboolean("details", "copy_other_files")
         self.char_exceptions = self.config.get_character_exceptions
+        self.sanitizer = filename_sanitizer(self.char_exceptions, self.use_lower)
 
         self.sourcedir = sourcedir
         self.destdir = destdir
@@ -431,34 +740,17 @@ class TaggerUtils(object):
         logging.debug("album.target_dir: %s" % self.dest_dir_name)
 
         # add template functionality ;-)
-        self.template_lookup = TemplateLookup(directories=["templates"])
+        self.template_lookup = template_lookup(template_module_directory(self.config))
 
     def _value_from_tag_format(self, format, discno=1, trackno=1, filetype=".mp3"):
         """ Fill in the used variables using the track information
             Transform all variables and use them in the given format string, make this
             slightly more flexible to be able to add variables easier
 
-            Transfer this via a map.
+            Transfer this via a compiled program (see FormatProgram and FORMAT_VARIABLES),
+            only the variables used in the format are evaluated.
         """
-        property_map = {
-            "%ALBTITLE%": self.album.title,
-            "%ALBARTIST%": self.album.artist,
-            "%YEAR%": self.album.year,
-            "%CATNO%": self.album.catnumbers[0],
-            "%GENRE%": self.album.genre,
-            "%STYLE%": self.album.style,
-            "%ARTIST%": self.album.disc(discno).track(trackno).artist,
-            "%TITLE%": self.album.disc(discno).track(trackno).title,
-            "%DISCNO%": discno,
-            "%TRACKNO%": "%.2d" % trackno,
-            "%TYPE%": filetype,
-            "%LABEL%": self.album.labels[0],
-        }
-
-        for hashtag in property_map.keys():
-            format = format.replace(hashtag, str(property_map[hashtag]))
-
-        return format
+        return compile_format(format).render(self.album, discno, trackno, filetype)
 
     def _value_from_tag(self, format, discno=1, trackno=1, filetype=".mp3"):
         """ Generates the filename tagging map
@@ -514,21 +806,38 @@ class TaggerUtils(object):
         logger.debug("sourcedir: %s" % sourcedir)
 
         try:
-            dir_list = os.listdir(sourcedir)
-            dir_list.sort()
+            # the source directory is read only once, all later stages use the snapshot
+            snapshot = DirectorySnapshot.scan(sourcedir)
+            self.album.snapshot = snapshot
+
+            dir_list = snapshot.names()
 
             filetype = ""
 
             self.album.copy_files = []
 
-            if self.album.has_multi_disc:
+            # the discs of a release (e.g. the sides of a 2xLP) could be ripped
+            # into a single folder, the files are split between the discs in order
+            # (but not the sub-tracks mapped like discs, see position.POSITION_SCHEMES)
+            single_folder = self.album.has_multi_disc and not snapshot.dirs() and \
+                len(self.album.discs) == self.album.disctotal
+
+            if single_folder:
+                logger.debug("is multi disc album in a single folder")
+
+                for disc in self.album.discs:
+                    disc.sourcedir = None
+
+                self.album.copy_files = [x for x in dir_list
+                                         if not x.lower().endswith(TaggerUtils.FILE_TYPE)]
+            elif self.album.has_multi_disc:
                 logger.debug("is multi disc album, looping discs")
 
                 logger.debug("dir_list: %s" % dir_list)
                 dirno = 0
                 for y in dir_list:
                     logger.debug("is it a dir? %s" % y)
-                    if os.path.isdir(os.path.join(sourcedir, y)):
+                    if snapshot.entry(y).is_dir:
                         logger.debug("Setting disc(%s) sourcedir to: %s" % (dirno, y))
                         self.album.discs[dirno].sourcedir = y
                         dirno = dirno + 1
@@ -539,6 +848,9 @@ class TaggerUtils(object):
                 logger.debug("Setting disc sourcedir to none")
                 self.album.discs[0].sourcedir = None
 
+            # the files of the previous discs (in a single folder)
+            offset = 0
+
             for disc in self.album.discs:
                 try:
                     disc_source_dir = disc.sourcedir
@@ -548,13 +860,19 @@ class TaggerUtils(object):
 
                 if disc_source_dir == None:
                     disc_source_dir = self.album.sourcedir
+                    disc_snapshot = snapshot
+                else:
+                    disc_snapshot = snapshot.subdir(disc_source_dir)
+
+                    if disc_snapshot is None:
+                        raise TaggerError("cannot read the disc directory %s" %
+                                          os.path.join(sourcedir, disc_source_dir))
 
                 logger.debug("discno: %d" % disc.discnumber)
                 logger.debug("sourcedir: %s" % disc.sourcedir)
 
                 # strip unwanted files
-                disc_list = os.listdir(os.path.join(self.album.sourcedir, disc_source_dir))
-                disc_list.sort()
+                disc_list = disc_snapshot.names()
 
                 disc.copy_files = [x for x in disc_list
                                 if not x.lower().endswith(TaggerUtils.FILE_TYPE)]
@@ -562,6 +880,12 @@ class TaggerUtils(object):
                 target_list = [os.path.join(disc_source_dir, x) for x in disc_list
                                  if x.lower().endswith(TaggerUtils.FILE_TYPE)]
 
+                if single_folder:
+                    # the other files are copied once (see album.copy_files)
+                    disc.copy_files = []
+                    target_list = target_list[offset:offset + len(disc.tracks)]
+                    offset = offset + len(disc.tracks)
+
                 if not len(target_list) == len(disc.tracks):
                     logger.debug("target_list: %s" % target_list)
                     logger.error("not matching number of files....")
@@ -628,40 +952,29 @@ class TaggerUtils(object):
 
 
     def get_clean_filename(self, f):
-        """ Removes unwanted characters from file names """
-
-        filename, fileext = os.path.splitext(f)
-
-        if not fileext in TaggerUtils.FILE_TYPE and not fileext in [".m3u", ".nfo"]:
-            logger.debug("fileext: %s" % fileext)
-            filename = f
-            fileext = ""
-
-        a = unicode(filename, "utf-8")
-
-        for k, v in self.char_exceptions.iteritems():
-            a = a.replace(k, v)
-
-        a = normalize("NFKD", a).encode("ascii", "ignore")
+        """ Removes unwanted characters from file names (see FilenameSanitizer) """
 
-        cf = re.compile(r"[^-\w.\(\)_]")
-        cf = cf.sub("", str(a))
+        return self.sanitizer.clean(f)
 
-        cf = cf.replace(" ", "_")
-        cf = cf.replace("__", "_")
-        cf = cf.replace("_-_", "-")
+    def create_file_from_template(self, template_name, file_name):
+        return write_file(self.render_template(template_name), os.path.join(self.album.target_dir, file_name))
 
-        cf = "".join([cf, fileext])
+    def render_template(self, template_name):
+        """ the content of the given template rendered for the album """
+        start = time.time()
+        file_template = self.template_lookup.get_template(template_name)
 
-        if self.use_lower:
-            cf = cf.lower()
+        if not (id(self.template_lookup), template_name) in _compiled_templates:
+            _compiled_templates.add((id(self.template_lookup), template_name))
+            template_stats["compiled"] = template_stats["compiled"] + 1
+            template_stats["compile_time"] = template_stats["compile_time"] + time.time() - start
 
-        return cf
+        start = time.time()
+        content = file_template.render(album=self.album)
+        template_stats["rendered"] = template_stats["rendered"] + 1
+        template_stats["render_time"] = template_stats["render_time"] + time.time() - start
 
-    def create_file_from_template(self, template_name, file_name):
-        file_template = self.template_lookup.get_template(template_name)
-        return write_file(file_template.render(album=self.album),
-            os.path.join(self.album.target_dir, file_name))
+        return content
 
     def create_nfo(self, dest_dir):
         """ Writes the .nfo file to disk. """
@@ -10,9 +10,15 @@ from optparse import OptionParser
 
 from discogstagger.tagger_config import TaggerConfig
 from discogstagger.discogsalbum import DiscogsAlbum, DiscogsConnector, LocalDiscogsConnector, AlbumError
-from discogstagger.taggerutils import TaggerUtils, TagHandler, FileHandler, TaggerError
+from discogstagger.discogsalbum import clean_name_cache, artist_credit_cache
+from discogstagger.taggerutils import TaggerError, template_stats
+from discogstagger.plan import plan_album, check_plan, write_plans, read_plans, PlanExecutor
+from discogstagger.prefetch import ReleasePrefetcher
+from discogstagger.search import SearchIndex, CatalogIndex, dir_catno, untagged_dirs
+
+def read_id_file(dir, file_name, options, tagger_config):
+    releaseid = None
 
-def read_id_file(dir, file_name, options):
     # read tags from batch file if available
     idfile = os.path.join(dir, file_name)
     if os.path.exists(idfile):
@@ -26,6 +32,33 @@ def read_id_file(dir, file_name, options):
 
     return releaseid
 
+def propose_release(source_dir, catalog_index, search_index, tagger_config):
+    """ looks up the album in the given directory in the local catalog number
+        index and the search index (both may be None), returns the proposed
+        release id or None
+    """
+    catno = dir_catno(source_dir)
+
+    if catalog_index is not None and catno:
+        release_ids = catalog_index.resolve(catno)
+
+        if len(release_ids) == 1:
+            logger.info("using release %s found by catalog number %s" % (release_ids[0], catno))
+            return release_ids[0]
+
+    if search_index is None:
+        return None
+
+    releaseid, candidates = search_index.propose(source_dir, tagger_config.getfloat("search", "threshold"))
+
+    for candidate, confidence in candidates:
+        logger.info("candidate release %s (confidence %.2f)" % (candidate, confidence))
+
+    if releaseid:
+        logger.info("using release %s found in the search index" % releaseid)
+
+    return releaseid
+
 def walk_dir_tree(start_dir, id_file):
     source_dirs = []
     for root, dirs, files in os.walk(start_dir):
@@ -35,6 +68,65 @@ def walk_dir_tree(start_dir, id_file):
 
     return source_dirs
 
+def is_done(source_dir, tagger_config):
+    done_file = tagger_config.get("details", "done_file")
+    return os.path.exists(os.path.join(source_dir, done_file))
+
+def prefetch_releases(source_dirs, discogs_connector, options, id_file, tagger_config):
+    """ reads the release ids of all albums to tag and starts fetching them
+        in the background
+    """
+    release_ids = []
+    for source_dir in source_dirs:
+        id_config = TaggerConfig(options.conffile)
+
+        if is_done(source_dir, id_config) and not options.forceUpdate:
+            continue
+
+        releaseid = read_id_file(source_dir, id_file, options, id_config)
+
+        # local releases are read from the source directory, no need to prefetch those
+        if releaseid and not id_config.get("source", "name") == "local":
+            release_ids.append(releaseid)
+
+    window = tagger_config.getint("batch", "prefetch_window")
+    threads = tagger_config.getint("batch", "prefetch_threads")
+
+    return ReleasePrefetcher(discogs_connector, release_ids, window, threads).start()
+
+def resolve_offline(source_dirs, options, id_file, discogs_connector, local_discogs_connector):
+    """ checks which albums can be tagged offline (the metadata of the release is
+        available locally), reports all missing releases upfront and returns the
+        source directories to tag and the missing ones
+    """
+    available = []
+    missing = []
+    for source_dir in source_dirs:
+        id_config = TaggerConfig(options.conffile)
+
+        if is_done(source_dir, id_config) and not options.forceUpdate:
+            available.append(source_dir)
+            continue
+
+        releaseid = read_id_file(source_dir, id_file, options, id_config)
+
+        if id_config.get("source", "name") == "local":
+            connector = local_discogs_connector
+        else:
+            connector = discogs_connector
+
+        if not releaseid or connector.is_available(releaseid, source_dir):
+            available.append(source_dir)
+        else:
+            missing.append((releaseid, source_dir))
+
+    if missing:
+        logger.warn("the following %d releases are not available offline, skipping their albums:" % len(missing))
+        for releaseid, source_dir in missing:
+            logger.warn("    %s (%s)" % (releaseid, source_dir))
+
+    return available, missing
+
 p = OptionParser(version="discogstagger2 2.1")
 p.add_option("-r", "--releaseid", action="store", dest="releaseid",
              help="The release id of the target album")
@@ -50,11 +142,21 @@ p.add_option("-f", "--force", action="store_true", dest="forceUpdate",
              help="Should albums be updated even though the done token exists?")
 p.add_option("-g", "--replay-gain", action="store_true", dest="replaygain",
              help="Should replaygain tags be added to the album? (metaflac needs to be installed)")
+p.add_option("--offline", action="store_true", dest="offline",
+             help="Tag only albums whose releases are available locally (cache or release store)")
+p.add_option("--plan", action="store", dest="planfile",
+             help="Write the plans of the albums to the given file instead of tagging them")
+p.add_option("--apply", action="store", dest="applyfile",
+             help="Tag the albums using the plans in the given file (see --plan)")
+p.add_option("-j", "--jobs", action="store", dest="jobs", type="int",
+             help="The number of albums tagged in parallel")
 
 p.set_defaults(conffile="conf/default.conf")
 p.set_defaults(recursive=False)
 p.set_defaults(forceUpdate=False)
 p.set_defaults(replaygain=False)
+p.set_defaults(offline=False)
+p.set_defaults(jobs=1)
 
 if len(sys.argv) == 1:
     p.print_help()
@@ -62,9 +164,15 @@ if len(sys.argv) == 1:
 
 (options, args) = p.parse_args()
 
-if not options.sourcedir or not os.path.exists(options.sourcedir):
+if options.applyfile:
+    if not os.path.exists(options.applyfile):
+        p.error("Please specify a valid plan file ('--apply')")
+elif not options.sourcedir or not os.path.exists(options.sourcedir):
     p.error("Please specify a valid source directory ('-s')")
 
+if options.planfile and options.applyfile:
+    p.error("Please specify either '--plan' or '--apply'")
+
 tagger_config = TaggerConfig(options.conffile)
 
 # initialize logging
@@ -76,30 +184,59 @@ logger = logging.getLogger(__name__)
 # read necessary config options for batch processing
 id_file = tagger_config.get("batch", "id_file")
 
-if options.recursive:
+# the local indexes are opened once for all albums (see propose_release)
+catalog_index = CatalogIndex.from_config(tagger_config)
+search_index = SearchIndex.from_config(tagger_config)
+
+if options.applyfile:
+    # the albums were planned before, nothing to read
+    source_dirs = []
+elif options.recursive:
     logger.debug("determine sourcedirs")
     source_dirs = walk_dir_tree(options.sourcedir, id_file)
+
+    if catalog_index is not None or search_index is not None:
+        # the releases of the albums without id file are proposed (see propose_release)
+        untagged = untagged_dirs(options.sourcedir, id_file)
+        logger.info("found %d albums without %s" % (len(untagged), id_file))
+        source_dirs = sorted(source_dirs + untagged)
 else:
     logger.debug("using sourcedir: %s" % options.sourcedir)
     source_dirs = [options.sourcedir]
 
+if options.offline:
+    tagger_config.set("discogs", "offline", "True")
+
 # initialize connection (could be a problem if using multiple sources...)
 discogs_connector = DiscogsConnector(tagger_config)
 local_discogs_connector = LocalDiscogsConnector(discogs_connector)
 
+offline_missing = []
+if discogs_connector.offline:
+    source_dirs, offline_missing = resolve_offline(source_dirs, options, id_file, discogs_connector,
+                                                   local_discogs_connector)
+
+prefetcher = None
+if options.recursive and tagger_config.getboolean("batch", "prefetch") and not discogs_connector.offline:
+    prefetcher = prefetch_releases(source_dirs, discogs_connector, options, id_file, tagger_config)
+
 logger.info("start tagging")
 discs_with_errors = []
 
+plan_executor = PlanExecutor(discogs_connector, options.jobs)
+
+# the plans to write (see --plan) or to apply in parallel (see --jobs)
+plans = []
+
 converted_discs = 0
+planned_discs = 0
 
 releaseid = None
 
 for source_dir in source_dirs:
     try:
-        done_file = tagger_config.get("details", "done_file")
-        done_file_path = os.path.join(source_dir, done_file)
-
-        if os.path.exists(done_file_path) and not options.forceUpdate:
+        if is_done(source_dir, tagger_config) and not options.forceUpdate:
+            done_file = tagger_config.get("details", "done_file")
             logger.warn("Do not read %s, because %s exists and forceUpdate is false" % (source_dir, done_file))
             continue
 
@@ -107,12 +244,20 @@ for source_dir in source_dirs:
         # album
         tagger_config = TaggerConfig(options.conffile)
 
-        releaseid = read_id_file(source_dir, id_file, options)
-
+        releaseid = read_id_file(source_dir, id_file, options, tagger_config)
 
         if not releaseid:
+            releaseid = propose_release(source_dir, catalog_index, search_index, tagger_config)
+
+        if not releaseid and not options.recursive:
             p.error("Please specify the discogs.com releaseid ('-r')")
 
+        if not releaseid:
+            msg = "No release found for {0}, please add {1} or use '-r'".format(source_dir, id_file)
+            logger.error(msg)
+            discs_with_errors.append(msg)
+            continue
+
         # read destination directory
         # !TODO if both are the same, we are not copying anything,
         # this should be "configurable"
@@ -129,15 +274,15 @@ for source_dir in source_dirs:
         #! TODO this is dirty, refactor it to be able to reuse it for later enhancements
         if tagger_config.get("source", "name") == "local":
             release = local_discogs_connector.fetch_release(releaseid, source_dir)
-            connector = local_discogs_connector
+        elif prefetcher:
+            release = prefetcher.fetch_release(releaseid)
         else:
             release = discogs_connector.fetch_release(releaseid)
-            connector = discogs_connector
 
         discogs_album = DiscogsAlbum(release)
 
         try:
-            album = discogs_album.map()
+            album = discogs_album.map_cached(discogs_connector.album_cache)
         except AlbumError as ae:
             msg = "Error during mapping ({0}), {1}: {2}".format(releaseid, source_dir, ae)
             logger.error(msg)
@@ -146,46 +291,30 @@ for source_dir in source_dirs:
 
         logger.info("Tagging album '%s - %s'" % (album.artist, album.title))
 
-        taggerUtils = TaggerUtils(source_dir, destdir, tagger_config, album)
-
-        tagHandler = TagHandler(album, tagger_config)
-        fileHandler = FileHandler(album, tagger_config)
-
         try:
-            taggerUtils._get_target_list()
+            plan = plan_album(source_dir, destdir, tagger_config, album, options.replaygain)
         except TaggerError as te:
             msg = "Error during Tagging ({0}), {1}: {2}".format(releaseid, source_dir, te)
             logger.error(msg)
             discs_with_errors.append(msg)
             continue
 
-        fileHandler.copy_files()
-
-        logger.debug("Tagging files")
-        tagHandler.tag_album()
-
-        logger.debug("Copy other interesting files (on request)")
-        fileHandler.copy_other_files()
-
-        logger.debug("Downloading and storing images")
-        fileHandler.get_images(connector)
-
-        logger.debug("Embedding Albumart")
-        fileHandler.embed_coverart_album()
-
-        if options.replaygain:
-            logger.debug("Add ReplayGain tags (if necessary)")
-            fileHandler.add_replay_gain_tags()
-
-    # !TODO make this more generic to use different templates and files,
-    # furthermore adopt to reflect multi-disc-albums
-        logger.debug("Generate m3u")
-        taggerUtils.create_m3u(album.target_dir)
+        # the source files are looked up in the snapshot read while planning
+        problems = check_plan(plan, album.snapshot)
+        if problems:
+            msg = "Error in plan ({0}), {1}: {2}".format(releaseid, source_dir, "; ".join(problems))
+            logger.error(msg)
+            discs_with_errors.append(msg)
+            continue
 
-        logger.debug("Generate nfo")
-        taggerUtils.create_nfo(album.target_dir)
+        if options.planfile or options.jobs > 1:
+            # written or applied after all albums are planned (see apply_many)
+            plans.append(plan)
+            planned_discs = planned_discs + 1
+            logger.info("Planned %d/%d" % (planned_discs, len(source_dirs)))
+            continue
 
-        fileHandler.create_done_file()
+        plan_executor.apply(plan)
     except Exception as ex:
         if releaseid:
             msg = "Error during tagging ({0}), {1}: {2}".format(releaseid, source_dir, ex)
@@ -204,12 +333,92 @@ for source_dir in source_dirs:
     converted_discs = converted_discs + 1
     logger.info("Converted %d/%d" % (converted_discs, len(source_dirs)))
 
+if prefetcher:
+    prefetcher.stop()
+
+if options.planfile:
+    logger.info("writing %d plans to %s" % (len(plans), options.planfile))
+    with open(options.planfile, "w") as fh:
+        write_plans(plans, fh)
+    plans = []
+elif options.applyfile:
+    with open(options.applyfile) as fh:
+        read = read_plans(fh)
+
+    source_dirs = [plan.get("source_dir") for plan in read]
+
+    for plan in read:
+        problems = check_plan(plan)
+        if problems:
+            msg = "Error in plan ({0}), {1}: {2}".format(plan.get("release_id"), plan.get("source_dir"),
+                                                         "; ".join(problems))
+            logger.error(msg)
+            discs_with_errors.append(msg)
+        else:
+            plans.append(plan)
+
+if plans:
+    logger.info("applying %d plans (%d jobs)" % (len(plans), options.jobs))
+    failed = plan_executor.apply_many(plans)
+    for plan, ex in failed:
+        msg = "Error during tagging ({0}), {1}: {2}".format(plan["release_id"], plan["source_dir"], ex)
+        discs_with_errors.append(msg)
+    converted_discs = converted_discs + len(plans) - len(failed)
+
 logger.info("Tagging complete.")
+if options.planfile:
+    logger.info("planned successful: %d" % planned_discs)
 logger.info("converted successful: %d" % converted_discs)
 logger.info("converted with Errors %d" % len(discs_with_errors))
 logger.info("releases touched: %s" % len(source_dirs))
 
+if discogs_connector.offline:
+    logger.info("skipped (not available offline): %d" % len(offline_missing))
+
+for rate_limit_type, rate_limit in discogs_connector.rate_limit_pool.items():
+    logger.info("rate limit (%s): waited %d times, %.1f seconds" %
+                (rate_limit_type, rate_limit.stats["waits"], rate_limit.stats["wait_time"]))
+
+logger.info("network: %(retries)d retries (waited %(wait_time).1f seconds), "
+            "%(pauses)d pauses (%(pause_time).1f seconds) because discogs seemed to be down" %
+            discogs_connector.network_policy.stats)
+
+if prefetcher:
+    logger.info("prefetched %(prefetched)d releases, waited for %(waited)d of them" % prefetcher.stats)
+
+if discogs_connector.release_cache is not None:
+    logger.info("release cache: %(hits)d hits, %(misses)d misses, %(evictions)d evicted" %
+                discogs_connector.release_cache.stats)
+
+if discogs_connector.album_cache is not None:
+    logger.info("album cache: %(hits)d hits, %(misses)d misses, %(stale)d mapped again, "
+                "%(evictions)d evicted" % discogs_connector.album_cache.stats)
+
+for cache_name, name_cache in (("name", clean_name_cache), ("track artist", artist_credit_cache)):
+    logger.info("%s cache: %d hits, %d misses (%.0f%% hit rate), %d evicted" %
+                (cache_name, name_cache.hits, name_cache.misses, name_cache.stats["hit_rate"] * 100,
+                 name_cache.evictions))
+
+if template_stats["rendered"]:
+    logger.info("templates: %d compiled or loaded in %.1f ms, %d rendered (%.1f ms each)" %
+                (template_stats["compiled"], template_stats["compile_time"] * 1000, template_stats["rendered"],
+                 template_stats["render_time"] * 1000 / template_stats["rendered"]))
+
+if discogs_connector.image_quota:
+    logger.info("image quota: %(used)d of %(quota)d used today, %(deferred)d images deferred, "
+                "%(queued)d queued in total" % discogs_connector.image_quota.stats)
+
+if discogs_connector.image_store:
+    logger.info("image store: %(hits)d images (%(bytes_saved)d bytes) reused instead of downloaded, "
+                "%(misses)d not stored yet" % discogs_connector.image_store.stats)
+
 if discs_with_errors:
     logger.error("The following discs could not get converted.")
     for msg in discs_with_errors:
         logger.error(msg)
+
+for index in (catalog_index, search_index):
+    if index is not None:
+        index.close()
+
+discogs_connector.close()
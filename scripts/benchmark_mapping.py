@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import glob
+import time
+import logging
+
+from optparse import OptionParser
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+import discogs_client as discogs
+
+from discogstagger.discogsalbum import DiscogsAlbum, decode_release
+from discogstagger.releasestore import read_release_json
+
+usage = "%prog [options] [<json file>...]"
+
+p = OptionParser(usage=usage, version="discogstagger2 2.1 - mapping benchmark")
+p.add_option("-n", "--rounds", action="store", dest="rounds", type="int",
+             help="How often the releases are mapped")
+p.add_option("-p", "--processes", action="store", dest="processes", type="int",
+             help="The number of processes used by map_many (default: one per cpu)")
+
+p.set_defaults(rounds=200)
+
+(options, args) = p.parse_args()
+
+# the mapping logs a lot, which would be measured as well
+logging.basicConfig(level=logging.ERROR)
+
+json_files = args or sorted(glob.glob(os.path.join(parentdir, "test/release/*.json")))
+releases = [read_release_json(json_file) for json_file in json_files]
+
+def convert(input):
+    """ the complete release encoded as utf-8, as the releases were read before
+        decode_release
+    """
+    if isinstance(input, dict):
+        return {convert(key): convert(value) for key, value in input.iteritems()}
+    elif isinstance(input, list):
+        return [convert(element) for element in input]
+    elif isinstance(input, unicode):
+        return input.encode('utf-8')
+    else:
+        return input
+
+def convert_release(data):
+    """ the old way: a new client and the complete release converted """
+    client = discogs.Client('Dummy Client - just for testing')
+    return discogs.Release(client, convert(data))
+
+client = discogs.Client('Dummy Client - just for testing')
+
+def decoded_release(data):
+    """ the fast path used by the LocalDiscogsConnector """
+    return discogs.Release(client, decode_release(data))
+
+def benchmark(create_release):
+    start = time.time()
+
+    for x in range(options.rounds):
+        for data in releases:
+            DiscogsAlbum(create_release(data)).map()
+
+    return len(releases) * options.rounds / (time.time() - start)
+
+def benchmark_map_many(processes):
+    batch = [decode_release(data) for data in releases] * options.rounds
+
+    start = time.time()
+    DiscogsAlbum.map_many(batch, processes)
+
+    return len(batch) / (time.time() - start)
+
+print "mapping %d releases %d times" % (len(releases), options.rounds)
+
+for name, create_release in (("convert", convert_release), ("decode", decoded_release)):
+    print "%-10s %8.1f releases/s" % (name, benchmark(create_release))
+
+print "%-10s %8.1f releases/s" % ("map_many", benchmark_map_many(options.processes))
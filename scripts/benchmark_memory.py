@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import glob
+import time
+import logging
+
+from optparse import OptionParser
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+import discogs_client as discogs
+
+from discogstagger.album import Album, Disc, Track
+from discogstagger.discogsalbum import DiscogsAlbum, decode_release
+from discogstagger.releasestore import read_release_json
+
+usage = "%prog [options] [<json file>...]"
+
+p = OptionParser(usage=usage, version="discogstagger2 2.1 - memory benchmark")
+p.add_option("-n", "--rounds", action="store", dest="rounds", type="int",
+             help="How often the releases are mapped (and kept in memory)")
+
+p.set_defaults(rounds=200)
+
+(options, args) = p.parse_args()
+
+# the mapping logs a lot, which would be measured as well
+logging.basicConfig(level=logging.ERROR)
+
+json_files = args or sorted(glob.glob(os.path.join(parentdir, "test/release/*.json")))
+
+class DictObject(object):
+    """ the objects as they were before: the attributes kept in a dict """
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return None
+
+def copy_string(value):
+    """ a private copy of the string, like parsing the json of each release gives """
+    if isinstance(value, unicode):
+        return value.encode("utf-8").decode("utf-8")
+    elif isinstance(value, str):
+        return (value + " ")[:-1]
+    return value
+
+def dict_copy(obj):
+    """ the given album (disc, track) as dict backed objects with private strings """
+    if isinstance(obj, (Album, Disc, Track)):
+        copy = DictObject()
+        for name, value in obj.__getstate__().items():
+            setattr(copy, name, dict_copy(value))
+        return copy
+    elif isinstance(obj, list):
+        return [dict_copy(element) for element in obj]
+    return copy_string(obj)
+
+def deep_size(roots):
+    """ the bytes used by the given objects and everything they reference,
+        shared objects are counted once
+    """
+    seen = set()
+    stack = list(roots)
+    size = 0
+
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+
+        size = size + sys.getsizeof(obj)
+
+        if isinstance(obj, (Album, Disc, Track)):
+            stack.extend(obj.__getstate__().values())
+        elif isinstance(obj, DictObject):
+            stack.append(obj.__dict__)
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+
+    return size
+
+client = discogs.Client('Dummy Client - just for testing')
+
+start = time.time()
+albums = []
+for x in range(options.rounds):
+    for json_file in json_files:
+        # every round reads the json again, to have the strings of each album in memory
+        data = decode_release(read_release_json(json_file))
+        albums.append(DiscogsAlbum(discogs.Release(client, data)).map())
+duration = time.time() - start
+
+dict_albums = [dict_copy(album) for album in albums]
+
+print "mapped %d albums (%d releases %d times) in %.1f seconds" % (len(albums), len(json_files),
+                                                                   options.rounds, duration)
+
+dict_size = deep_size(dict_albums)
+compact_size = deep_size(albums)
+
+print "%-10s %10.1f KB %8.1f bytes/album" % ("dict", dict_size / 1024.0, float(dict_size) / len(albums))
+print "%-10s %10.1f KB %8.1f bytes/album" % ("compact", compact_size / 1024.0, float(compact_size) / len(albums))
+print "%-10s %10.1f %%" % ("saved", 100.0 * (dict_size - compact_size) / dict_size)
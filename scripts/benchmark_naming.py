@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import logging
+
+from optparse import OptionParser
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.album import Album, Disc, Track
+from discogstagger.taggerutils import TaggerUtils
+
+usage = "%prog [options]"
+
+p = OptionParser(usage=usage, version="discogstagger2 2.1 - file naming benchmark")
+p.add_option("-n", "--rounds", action="store", dest="rounds", type="int",
+             help="How often all files of the box set are named")
+p.add_option("-d", "--discs", action="store", dest="discs", type="int",
+             help="The number of discs of the box set (20 tracks each)")
+p.add_option("-c", "--conf", action="store", dest="conffile",
+             help="The discogstagger configuration file.")
+
+p.set_defaults(rounds=20)
+p.set_defaults(discs=10)
+p.set_defaults(conffile="conf/default.conf")
+
+(options, args) = p.parse_args()
+
+# the naming logs a lot, which would be measured as well
+logging.basicConfig(level=logging.ERROR)
+
+tagger_config = TaggerConfig(options.conffile)
+
+def box_set(discs):
+    """ a box set with 20 tracks on each disc """
+    album = Album(1, u"Die gr\xf6\xdften Hits der 80er", ["Various"])
+    album.year = "1999"
+    album.catnumbers = ["BOX 0815-%d" % discs]
+    album.labels = ["Polystar"]
+    album.genres = ["Electronic", "Pop"]
+    album.styles = ["Synth-pop"]
+
+    for discno in range(1, discs + 1):
+        disc = Disc(discno)
+        for trackno in range(1, 21):
+            track = Track(trackno, u"Song N\xb0 %d (Radio Edit)" % trackno, [u"K\xfcnstler %d" % trackno])
+            track.discnumber = discno
+            disc.tracks.append(track)
+        album.discs.append(disc)
+
+    return album
+
+class LegacyTaggerUtils(TaggerUtils):
+    """ the formats filled in as before: all variables evaluated and replaced """
+
+    def _value_from_tag_format(self, format, discno=1, trackno=1, filetype=".mp3"):
+        property_map = {
+            "%ALBTITLE%": self.album.title,
+            "%ALBARTIST%": self.album.artist,
+            "%YEAR%": self.album.year,
+            "%CATNO%": self.album.catnumbers[0],
+            "%GENRE%": self.album.genre,
+            "%STYLE%": self.album.style,
+            "%ARTIST%": self.album.disc(discno).track(trackno).artist,
+            "%TITLE%": self.album.disc(discno).track(trackno).title,
+            "%DISCNO%": discno,
+            "%TRACKNO%": "%.2d" % trackno,
+            "%TYPE%": filetype,
+            "%LABEL%": self.album.labels[0],
+        }
+
+        for hashtag in property_map.keys():
+            format = format.replace(hashtag, str(property_map[hashtag]))
+
+        return format
+
+def benchmark(tagger_utils_class):
+    album = box_set(options.discs)
+    tagger_utils = tagger_utils_class("source", "target", tagger_config, album)
+    tracks = options.discs * 20
+
+    start = time.time()
+    for x in range(options.rounds):
+        for disc in album.discs:
+            for track in disc.tracks:
+                tagger_utils._value_from_tag_format(tagger_utils.va_song_format, disc.discnumber,
+                                                    track.tracknumber, ".flac")
+    format_time = (time.time() - start) / (options.rounds * tracks)
+
+    start = time.time()
+    for x in range(options.rounds):
+        tagger_utils._set_target_discs_and_tracks(".flac")
+        tagger_utils.dest_dir_name
+        tagger_utils.m3u_filename
+        tagger_utils.nfo_filename
+    naming_time = (time.time() - start) / (options.rounds * tracks)
+
+    return format_time * 1000000, naming_time * 1000000
+
+print "naming the %d tracks of a box set (%d discs) %d times" % (options.discs * 20, options.discs,
+                                                                 options.rounds)
+print "%-10s %12s %12s" % ("", "format", "naming")
+
+for name, tagger_utils_class in (("legacy", LegacyTaggerUtils), ("compiled", TaggerUtils)):
+    print "%-10s %9.1f us %9.1f us per track" % ((name, ) + benchmark(tagger_utils_class))
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import glob
+import time
+import logging
+
+from optparse import OptionParser
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.position import PositionParser
+from discogstagger.releasestore import read_release_json
+
+usage = "%prog [options] [<json file>...]"
+
+p = OptionParser(usage=usage, version="discogstagger2 2.1 - track position benchmark")
+p.add_option("-n", "--rounds", action="store", dest="rounds", type="int",
+             help="How often all positions are parsed")
+
+p.set_defaults(rounds=2000)
+
+(options, args) = p.parse_args()
+
+logging.basicConfig(level=logging.ERROR)
+
+json_files = args or sorted(glob.glob(os.path.join(parentdir, "test/release/*.json")))
+
+positions = []
+for json_file in json_files:
+    positions.extend(track["position"] for track in read_release_json(json_file)["tracklist"]
+                     if track["position"])
+
+def legacy_parse(position):
+    """ the parsing as it was before: the patterns compiled on each call """
+    if position.find("-") > -1 or position.find(".") > -1:
+        for scheme in ("^CD(?P<discnumber>\d+)-(?P<tracknumber>\d+)$",
+                       "^(?P<discnumber>\d+)-(?P<tracknumber>\d+)$",
+                       "^(?P<discnumber>\d+).(?P<tracknumber>\d+)$"):
+            re_match = re.search(scheme, position)
+
+            if re_match:
+                return {'tracknumber': re_match.group("tracknumber"),
+                        'discnumber': re_match.group("discnumber")}
+    else:
+        return {'tracknumber': position,
+                'discnumber': 1}
+
+    return False
+
+def benchmark(parse):
+    start = time.time()
+
+    for x in range(options.rounds):
+        for position in positions:
+            parse(position)
+
+    return len(positions) * options.rounds / (time.time() - start)
+
+parser = PositionParser()
+
+print "parsing %d positions (%d distinct) %d times" % (len(positions), len(set(positions)), options.rounds)
+
+print "%-10s %12.1f positions/s" % ("legacy", benchmark(legacy_parse))
+print "%-10s %12.1f positions/s" % ("parser", benchmark(parser.parse))
+print "%-10s %12.1f positions/s" % ("no memo", benchmark(parser._parse))
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import logging
+import logging.config
+import sys
+import time
+
+from optparse import OptionParser
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.releasestore import ReleaseStore
+from discogstagger.search import CatalogIndex, index_releases
+
+usage = """%prog [options] build
+       %prog [options] lookup [-l <label>] <catno>...
+       %prog [options] resolve [-w] <directory>..."""
+
+p = OptionParser(usage=usage, version="discogstagger2 2.1 - catalog number index")
+p.add_option("-l", "--label", action="store", dest="label",
+             help="The label of the catalog numbers to look up")
+p.add_option("-w", "--write", action="store_true", dest="write",
+             help="Write the id file for all albums resolved to a single release")
+p.add_option("-c", "--conf", action="store", dest="conffile",
+             help="The discogstagger configuration file.")
+
+p.set_defaults(conffile="conf/default.conf")
+p.set_defaults(write=False)
+
+(options, args) = p.parse_args()
+
+if not args or not args[0] in ("build", "lookup", "resolve"):
+    p.print_help()
+    sys.exit(1)
+
+command = args[0]
+
+tagger_config = TaggerConfig(options.conffile)
+
+# initialize logging
+logger_config_file = tagger_config.get("logging", "config_file")
+logging.config.fileConfig(logger_config_file)
+
+logger = logging.getLogger(__name__)
+
+id_file = tagger_config.get("batch", "id_file")
+
+catalog_index = CatalogIndex.from_config(tagger_config, create=(command == "build"))
+
+if catalog_index is None:
+    p.error("There is no catalog index yet, build it first")
+
+if command == "build":
+    release_store = ReleaseStore.from_config(tagger_config)
+
+    if release_store is None:
+        p.error("There is no release store yet, import some releases first")
+
+    start = time.time()
+    count = index_releases(catalog_index, release_store)
+
+    logger.info("indexed %d releases in %.1f seconds" % (count, time.time() - start))
+
+elif command == "lookup":
+    results = catalog_index.resolve_many((catno, options.label) for catno in args[1:])
+
+    for catno in args[1:]:
+        print "%-20s %s" % (catno, " ".join(str(x) for x in results[(catno, options.label)]) or "-")
+
+elif command == "resolve":
+    resolved = 0
+    ambiguous = 0
+    missing = 0
+
+    start = time.time()
+    for base_dir in args[1:]:
+        results = catalog_index.resolve_tree(base_dir, id_file)
+
+        for source_dir in sorted(results):
+            release_ids = results[source_dir]
+
+            if len(release_ids) == 1:
+                resolved = resolved + 1
+                print "%-10s %s" % (release_ids[0], source_dir)
+
+                if options.write:
+                    with open(os.path.join(source_dir, id_file), "w") as fh:
+                        fh.write("[source]\nname=discogs\ndiscogs_id=%s\n" % release_ids[0])
+            elif release_ids:
+                ambiguous = ambiguous + 1
+                print "%-10s %s (%s)" % ("ambiguous", source_dir, " ".join(str(x) for x in release_ids))
+            else:
+                missing = missing + 1
+                print "%-10s %s" % ("-", source_dir)
+
+    logger.info("resolved %d albums, %d ambiguous, %d not found in %.1f seconds" %
+                (resolved, ambiguous, missing, time.time() - start))
@@ -0,0 +1,45 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import logging
+import logging.config
+import sys
+
+from optparse import OptionParser
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.discogsalbum import DiscogsConnector
+
+p = OptionParser(version="discogstagger2 2.1 - deferred image fetcher")
+p.add_option("-c", "--conf", action="store", dest="conffile",
+             help="The discogstagger configuration file.")
+p.add_option("-n", "--number", action="store", dest="number", type="int",
+             help="Download at most this number of deferred images")
+
+p.set_defaults(conffile="conf/default.conf")
+
+(options, args) = p.parse_args()
+
+tagger_config = TaggerConfig(options.conffile)
+
+# initialize logging
+logger_config_file = tagger_config.get("logging", "config_file")
+logging.config.fileConfig(logger_config_file)
+
+logger = logging.getLogger(__name__)
+
+discogs_connector = DiscogsConnector(tagger_config)
+
+if discogs_connector.image_quota:
+    downloaded = discogs_connector.fetch_deferred_images(options.number)
+
+    logger.info("downloaded %d deferred images" % downloaded)
+    logger.info("image quota: %(used)d of %(quota)d used today, %(queued)d images still queued" %
+                discogs_connector.image_quota.stats)
+else:
+    logger.error("no daily image quota configured (images:daily_quota)")
+
+discogs_connector.close()
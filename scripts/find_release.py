@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import logging
+import logging.config
+import sys
+import time
+
+from optparse import OptionParser
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.cache import ReleaseCache
+from discogstagger.releasestore import ReleaseStore
+from discogstagger.search import SearchIndex, untagged_dirs, index_releases
+
+usage = """%prog [options] build
+       %prog [options] propose [-w] [-t <threshold>] <directory>..."""
+
+p = OptionParser(usage=usage, version="discogstagger2 2.1 - release search")
+p.add_option("-t", "--threshold", action="store", dest="threshold", type="float",
+             help="The minimum confidence of a proposed release (default: search:threshold)")
+p.add_option("-w", "--write", action="store_true", dest="write",
+             help="Write the id file for all albums with a confident proposal")
+p.add_option("--recursive", action="store_true", dest="recursive",
+             help="Propose releases for all albums without id file beneath the directories")
+p.add_option("-c", "--conf", action="store", dest="conffile",
+             help="The discogstagger configuration file.")
+
+p.set_defaults(conffile="conf/default.conf")
+p.set_defaults(write=False)
+p.set_defaults(recursive=False)
+
+(options, args) = p.parse_args()
+
+if not args or not args[0] in ("build", "propose"):
+    p.print_help()
+    sys.exit(1)
+
+command = args[0]
+
+tagger_config = TaggerConfig(options.conffile)
+
+# initialize logging
+logger_config_file = tagger_config.get("logging", "config_file")
+logging.config.fileConfig(logger_config_file)
+
+logger = logging.getLogger(__name__)
+
+id_file = tagger_config.get("batch", "id_file")
+
+def album_dirs(paths):
+    """ the album directories (containing audio files, but no id file) """
+    for path in paths:
+        if not options.recursive:
+            yield path
+            continue
+
+        for album_dir in untagged_dirs(path, id_file):
+            yield album_dir
+
+if command == "build":
+    search_index = SearchIndex.from_config(tagger_config, create=True)
+
+    start = time.time()
+    count = index_releases(search_index, ReleaseStore.from_config(tagger_config),
+                           ReleaseCache.from_config(tagger_config))
+
+    logger.info("indexed %d releases in %.1f seconds" % (count, time.time() - start))
+
+elif command == "propose":
+    search_index = SearchIndex.from_config(tagger_config)
+
+    if search_index is None:
+        p.error("There is no search index yet, build it first")
+
+    threshold = options.threshold
+    if threshold is None:
+        threshold = tagger_config.getfloat("search", "threshold")
+
+    for source_dir in album_dirs(args[1:]):
+        start = time.time()
+        release_id, candidates = search_index.propose(source_dir, threshold)
+        duration = (time.time() - start) * 1000
+
+        print "%s (%.1f ms)" % (source_dir, duration)
+        for candidate, confidence in candidates:
+            print "    %-10s %.2f%s" % (candidate, confidence, " *" if candidate == release_id else "")
+
+        if release_id and options.write:
+            with open(os.path.join(source_dir, id_file), "w") as fh:
+                fh.write("[source]\nname=discogs\ndiscogs_id=%s\n" % release_id)
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import logging
+import logging.config
+import sys
+import time
+
+from optparse import OptionParser
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.releasestore import ReleaseStore
+from discogstagger.dump import import_dump, read_library_ids
+
+p = OptionParser(version="discogstagger2 2.1 - data dump importer")
+p.add_option("-f", "--file", action="store", dest="dumpfile",
+             help="The discogs releases dump (e.g. discogs_20150101_releases.xml.gz)")
+p.add_option("-l", "--library", action="store", dest="librarydir",
+             help="Import only the releases used in the id files beneath this directory")
+p.add_option("-c", "--conf", action="store", dest="conffile",
+             help="The discogstagger configuration file.")
+
+p.set_defaults(conffile="conf/default.conf")
+
+if len(sys.argv) == 1:
+    p.print_help()
+    sys.exit(1)
+
+(options, args) = p.parse_args()
+
+if not options.dumpfile or not os.path.exists(options.dumpfile):
+    p.error("Please specify a valid dump file ('-f')")
+
+tagger_config = TaggerConfig(options.conffile)
+
+# initialize logging
+logger_config_file = tagger_config.get("logging", "config_file")
+logging.config.fileConfig(logger_config_file)
+
+logger = logging.getLogger(__name__)
+
+release_ids = None
+if options.librarydir:
+    release_ids = read_library_ids(options.librarydir, tagger_config.get("batch", "id_file"),
+                                   dict(tagger_config.items("source")))
+    logger.info("importing %d releases used in %s" % (len(release_ids), options.librarydir))
+
+release_store = ReleaseStore.from_config(tagger_config, create=True)
+
+start = time.time()
+count = import_dump(options.dumpfile, release_store, release_ids)
+
+logger.info("imported %d releases into %s in %d seconds" % (count, release_store.cache_file,
+                                                            time.time() - start))
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import re
+import json
+import logging
+import logging.config
+import sys
+
+from optparse import OptionParser
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.releasestore import ReleaseStore, read_release_json
+
+usage = """%prog [options] import <json file or directory>...
+       %prog [options] export -d <directory> [<release id>...]
+       %prog [options] stats"""
+
+p = OptionParser(usage=usage, version="discogstagger2 2.1 - release store")
+p.add_option("-d", "--destination", action="store", dest="destdir",
+             help="The directory to export the json files to")
+p.add_option("-c", "--conf", action="store", dest="conffile",
+             help="The discogstagger configuration file.")
+
+p.set_defaults(conffile="conf/default.conf")
+
+(options, args) = p.parse_args()
+
+if not args or not args[0] in ("import", "export", "stats"):
+    p.print_help()
+    sys.exit(1)
+
+command = args[0]
+
+tagger_config = TaggerConfig(options.conffile)
+
+# initialize logging
+logger_config_file = tagger_config.get("logging", "config_file")
+logging.config.fileConfig(logger_config_file)
+
+logger = logging.getLogger(__name__)
+
+release_store = ReleaseStore.from_config(tagger_config, create=(command == "import"))
+
+if release_store is None:
+    p.error("There is no release store yet, import some releases first")
+
+json_file_name = re.compile("^\d+\.json$")
+
+def find_json_files(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                if json_file_name.match(name):
+                    yield os.path.join(root, name)
+
+if command == "import":
+    batch = []
+    count = 0
+    for json_file in find_json_files(args[1:]):
+        data = read_release_json(json_file)
+        batch.append((data["id"], data))
+
+        if len(batch) >= 1000:
+            release_store.put_many(batch)
+            count = count + len(batch)
+            batch = []
+
+    release_store.put_many(batch)
+    count = count + len(batch)
+
+    logger.info("imported %d releases" % count)
+
+elif command == "export":
+    if not options.destdir:
+        p.error("Please specify the destination directory ('-d')")
+
+    release_ids = args[1:] or release_store.ids()
+    for release_id in release_ids:
+        data = release_store.get(release_id)
+
+        if data is None:
+            logger.error("release %s is not stored" % release_id)
+            continue
+
+        with open(os.path.join(options.destdir, "%s.json" % release_id), "w") as fh:
+            fh.write(json.dumps(data))
+
+    logger.info("exported %d releases to %s" % (len(release_ids), options.destdir))
+
+elif command == "stats":
+    stats = release_store.stats()
+
+    print "releases:       %d" % stats["releases"]
+    print "stored bytes:   %d" % stats["stored_bytes"]
+    print "file bytes:     %d" % stats["file_bytes"]
+    print "lookups:        %d" % stats["lookups"]
+    print "lookup avg:     %.3f ms" % stats["lookup_avg_ms"]
+    print "lookup p50:     %.3f ms" % stats["lookup_p50_ms"]
+    print "lookup p99:     %.3f ms" % stats["lookup_p99_ms"]
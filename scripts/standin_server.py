@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import logging
+
+from optparse import OptionParser
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from discogstagger.standin import StandInServer
+
+usage = "%prog [options]"
+
+p = OptionParser(usage=usage, version="discogstagger2 2.1 - discogs stand-in server")
+p.add_option("-p", "--port", action="store", dest="port", type="int",
+             help="The port to listen on")
+p.add_option("-r", "--releases", action="store", dest="release_dir",
+             help="The directory containing the <release id>.json files to serve")
+p.add_option("-i", "--images", action="store", dest="image_dir",
+             help="The directory containing the images to serve")
+p.add_option("-d", "--default-image", action="store", dest="default_image",
+             help="The image served for all images not found in the image directory")
+p.add_option("-l", "--rate-limit", action="store", dest="rate_limit", type="int",
+             help="The number of requests allowed per minute")
+p.add_option("-w", "--latency", action="store", dest="latency", type="float",
+             help="The delay of each response in seconds")
+p.add_option("-e", "--error-rate", action="store", dest="error_rate", type="float",
+             help="The fraction of requests answered with a server error (5xx)")
+p.add_option("-s", "--seed", action="store", dest="seed", type="int",
+             help="The seed for the injected server errors")
+
+p.set_defaults(port=8765, release_dir=os.path.join(parentdir, "test/release"),
+               default_image=os.path.join(parentdir, "test/files/cover.jpeg"),
+               rate_limit=60, latency=0.0, error_rate=0.0)
+
+(options, args) = p.parse_args()
+
+logging.basicConfig(level=logging.INFO)
+
+standin = StandInServer(options.release_dir, options.image_dir, options.default_image,
+                        port=options.port, rate_limit=options.rate_limit,
+                        latency=options.latency, error_rate=options.error_rate,
+                        seed=options.seed)
+
+print "serving releases from %s at %s (set discogs:base_url to use it)" % (options.release_dir, standin.base_url)
+
+try:
+    standin.serve_forever()
+except KeyboardInterrupt:
+    pass
+
+print "requests: %(requests)d, throttled: %(throttled)d, errors: %(errors)d" % standin.stats
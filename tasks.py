@@ -20,3 +20,11 @@ def test_all():
     nocapture is needed, because the authentication needs an input from the user (the pin)
     """
     run("nosetests --nocapture --with-coverage --cover-erase --cover-branches --cover-html --cover-package=discogstagger --cover-min-percentage=76")
+
+@task
+def standin():
+    """
+    serves the releases in test/release on port 8765, set discogs:base_url to
+    http://127.0.0.1:8765 to run the tagger against it
+    """
+    run("python scripts/standin_server.py")
@@ -0,0 +1,66 @@
+import os, sys
+import logging
+import shutil
+import subprocess
+import tempfile
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+logger.debug("parentdir: %s" % parentdir)
+
+from ext.mediafile import MediaFile
+
+from discogstagger.search import SearchIndex
+from discogstagger.releasestore import ReleaseStore, read_release_json
+
+class TestRecursiveBatch(object):
+    """ runs discogstagger2 over a library (without network access) """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.source_dir = tempfile.mkdtemp()
+        self.target_dir = tempfile.mkdtemp()
+
+        data = read_release_json(os.path.join(parentdir, "test/release/3083.json"))
+
+        release_store = ReleaseStore(os.path.join(self.cache_dir, "release-store.db"))
+        release_store.put(3083, data)
+        release_store.close()
+
+        search_index = SearchIndex(os.path.join(self.cache_dir, "search-index.db"))
+        search_index.add(data)
+        search_index.close()
+
+        self.conf_file = os.path.join(self.cache_dir, "test.conf")
+        with open(self.conf_file, "w") as fh:
+            fh.write("[cache]\ndir=%s\n" % self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.target_dir)
+
+    def test_recursive_untagged(self):
+        """ the release of an album without id file is proposed by the search index """
+        album_dir = os.path.join(self.source_dir, "incoming", "yonderboi-shallow_and_profound-(molecd023-2)-2000")
+        os.makedirs(album_dir)
+        for i in range(1, 18):
+            track_file = os.path.join(album_dir, "%.2d-song.flac" % i)
+            shutil.copyfile(os.path.join(parentdir, "test/files/test.flac"), track_file)
+
+            metadata = MediaFile(track_file)
+            metadata.albumartist = "Yonderboi"
+            metadata.album = "Shallow and Profound"
+            metadata.save()
+
+        subprocess.check_call([sys.executable, os.path.join(parentdir, "discogstagger2.py"), "-c", self.conf_file,
+                               "-s", self.source_dir, "--recursive", "--offline", "-d", self.target_dir],
+                              cwd=parentdir)
+
+        target_dir = os.path.join(self.target_dir, "yonderboi-shallow_and_profound-(molecd023-2)-2000")
+        assert len([x for x in os.listdir(target_dir) if x.endswith(".flac")]) == 17
+        assert os.path.exists(os.path.join(album_dir, "dt.done"))
@@ -0,0 +1,323 @@
+import os, sys
+import logging
+import shutil
+import tempfile
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+logger.debug("parentdir: %s" % parentdir)
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.cache import ReleaseCache, AlbumCache, ImageStore, ImageQuota
+from discogstagger.album import Album
+from discogstagger.discogsalbum import DiscogsConnector
+
+class TestReleaseCache(object):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.cache_dir, "releases.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        self.cache_dir = None
+
+    def test_get_and_put(self):
+        cache = ReleaseCache(self.cache_file)
+
+        assert cache.get(3083) == None
+
+        cache.put(3083, {"id": 3083, "title": u"Shallow And Profound"})
+
+        data = cache.get("3083")
+        assert data["id"] == 3083
+        assert data["title"] == "Shallow And Profound"
+
+        assert cache.stats["hits"] == 1
+        assert cache.stats["misses"] == 1
+
+        cache.close()
+
+        # the cache should survive the end of the run
+        cache = ReleaseCache(self.cache_file)
+        assert cache.get(3083)["id"] == 3083
+        assert len(cache) == 1
+
+    def test_ttl(self):
+        cache = ReleaseCache(self.cache_file, ttl=1)
+
+        cache.put(3083, {"id": 3083})
+        cache.connection.execute("UPDATE releases SET fetched = fetched - 10")
+
+        # expired entries are still usable (e.g. when offline)
+        assert cache.contains(3083, expired=True)
+        assert not cache.contains(3083)
+        assert cache.get(3083, expired=True)["id"] == 3083
+
+        assert cache.get(3083) == None
+        assert len(cache) == 0
+
+    def test_lru_eviction(self):
+        cache = ReleaseCache(self.cache_file, max_entries=2)
+
+        cache.put(1, {"id": 1})
+        cache.put(2, {"id": 2})
+        cache.connection.execute("UPDATE releases SET accessed = accessed - 10")
+
+        # touch release 1, so that release 2 is the least recently used one
+        cache.get(1)
+        cache.put(3, {"id": 3})
+
+        assert len(cache) == 2
+        assert cache.get(2) == None
+        assert cache.get(1)["id"] == 1
+        assert cache.get(3)["id"] == 3
+        assert cache.stats["evictions"] == 1
+
+    def test_from_config(self):
+        config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+        config.set("cache", "dir", self.cache_dir)
+
+        cache = ReleaseCache.from_config(config)
+        assert cache.cache_file == self.cache_file
+        assert cache.max_entries == 25000
+
+        config.set("cache", "release_cache", "False")
+        assert ReleaseCache.from_config(config) == None
+
+    def test_fetch_release_cached(self):
+        config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+        config.set("cache", "dir", self.cache_dir)
+        config.set("discogs", "skip_auth", "True")
+
+        discogs_connection = DiscogsConnector(config)
+
+        fetched = []
+
+        class DummyRelease(object):
+            data = {"id": 3083, "title": "Shallow And Profound"}
+
+            def refresh(self):
+                pass
+
+        def release(release_id):
+            fetched.append(release_id)
+            return DummyRelease()
+
+        discogs_connection.discogs_client.release = release
+
+        # an empty cache is still a cache
+        assert len(discogs_connection.release_cache) == 0
+
+        discogs_connection.fetch_release("3083")
+        assert discogs_connection.release_cache.stats["misses"] == 1
+
+        release = discogs_connection.fetch_release("3083")
+        assert release.data["title"] == "Shallow And Profound"
+
+        assert fetched == [3083]
+        assert discogs_connection.release_cache.stats["hits"] == 1
+
+class TestAlbumCache(object):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.cache_dir, "albums.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        self.cache_dir = None
+
+    def test_get_and_put(self):
+        cache = AlbumCache(self.cache_file, "1-abc")
+
+        assert cache.get(3083, "digest") == None
+
+        cache.put(3083, "digest", Album(3083, "Shallow And Profound", ["Yonderboi"]))
+        cache.close()
+
+        cache = AlbumCache(self.cache_file, "1-abc")
+        album = cache.get("3083", "digest")
+        assert album.title == "Shallow And Profound"
+        assert album.artist == "Yonderboi"
+        assert album.target_dir == None
+
+        assert cache.stats["hits"] == 1
+        assert len(cache) == 1
+
+    def test_stale(self):
+        cache = AlbumCache(self.cache_file, "1-abc")
+        cache.put(3083, "digest", Album(3083, "Shallow And Profound", ["Yonderboi"]))
+
+        # the release changed
+        assert cache.get(3083, "other digest") == None
+
+        # the mapping code changed
+        cache = AlbumCache(self.cache_file, "1-def")
+        assert cache.get(3083, "digest") == None
+
+        assert cache.stats["stale"] == 1
+        assert cache.stats["hits"] == 0
+
+    def test_lru_eviction(self):
+        cache = AlbumCache(self.cache_file, "1-abc", max_entries=2)
+
+        cache.put(1, "1", Album(1, "One", ["A"]))
+        cache.put(2, "2", Album(2, "Two", ["B"]))
+        cache.connection.execute("UPDATE albums SET accessed = accessed - 10")
+
+        cache.get(1, "1")
+        cache.put(3, "3", Album(3, "Three", ["C"]))
+
+        assert len(cache) == 2
+        assert cache.get(2, "2") == None
+        assert cache.get(1, "1").title == "One"
+        assert cache.stats["evictions"] == 1
+
+    def test_from_config(self):
+        config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+        config.set("cache", "dir", self.cache_dir)
+
+        cache = AlbumCache.from_config(config, "1-abc")
+        assert cache.cache_file == self.cache_file
+        assert cache.mapper_version == "1-abc"
+
+        config.set("cache", "album_cache", "False")
+        assert AlbumCache.from_config(config, "1-abc") == None
+
+class TestImageStore(object):
+
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        self.target_dir = tempfile.mkdtemp()
+        self.image_url = "http://api.discogs.com/image/R-3083-1167766285.jpeg"
+
+    def tearDown(self):
+        shutil.rmtree(self.store_dir)
+        shutil.rmtree(self.target_dir)
+
+    def download(self, store, image_url):
+        incoming = store.incoming_path(image_url)
+        shutil.copyfile(os.path.join(parentdir, "test/files/cover.jpeg"), incoming)
+        return store.add(image_url, incoming)
+
+    def test_add_and_fetch(self):
+        store = ImageStore(self.store_dir)
+
+        target_file = os.path.join(self.target_dir, "folder.jpg")
+        assert not store.fetch(self.image_url, target_file)
+
+        stored_file = self.download(store, self.image_url)
+        assert os.path.exists(stored_file)
+
+        assert store.fetch(self.image_url, target_file)
+        assert open(target_file, "rb").read() == open(stored_file, "rb").read()
+
+        # the album gets its own copy, changing it does not change the store
+        assert not os.path.samefile(stored_file, target_file)
+
+        assert store.stats["hits"] == 1
+        assert store.stats["misses"] == 1
+        assert store.stats["bytes_saved"] == os.path.getsize(target_file)
+
+    def test_same_content_stored_once(self):
+        store = ImageStore(self.store_dir)
+
+        first = self.download(store, self.image_url)
+        second = self.download(store, "http://api.discogs.com/image/R-367882-1193559996.jpeg")
+
+        assert first == second
+
+    def test_link_instead_of_copy(self):
+        store = ImageStore(self.store_dir, use_links=True)
+
+        stored_file = self.download(store, self.image_url)
+        target_file = os.path.join(self.target_dir, "folder.jpg")
+        store.fetch(self.image_url, target_file)
+
+        assert os.path.samefile(stored_file, target_file)
+
+    def test_eviction(self):
+        size = os.path.getsize(os.path.join(parentdir, "test/files/cover.jpeg"))
+        store = ImageStore(self.store_dir, max_size=size)
+
+        stored_file = self.download(store, self.image_url)
+
+        # same content, nothing to evict
+        self.download(store, "http://example.org/second.jpeg")
+        assert os.path.exists(stored_file)
+
+        store.connection.execute("UPDATE images SET digest = 'x' WHERE url = 'http://example.org/second.jpeg'")
+        self.download(store, "http://example.org/third.jpeg")
+
+        assert store.stats["evictions"] == 1
+        assert store.lookup("http://example.org/second.jpeg") == None
+
+class TestImageQuota(object):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.cache_dir, "image-quota.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_allot(self):
+        quota = ImageQuota(self.cache_file, daily_quota=5, cover_reserve=2)
+
+        album = [("/a/folder.jpg", "http://x/a1.jpg"), ("/a/image-01.jpg", "http://x/a2.jpg"),
+                 ("/a/image-02.jpg", "http://x/a3.jpg"), ("/a/image-03.jpg", "http://x/a4.jpg")]
+
+        granted = quota.allot(album, album[:1])
+
+        # the last two downloads are kept for covers
+        assert granted == album[:3]
+        assert quota.used == 3
+
+        # covers can use the reserved budget
+        granted = quota.allot([("/b/folder.jpg", "http://x/b1.jpg")], [("/b/folder.jpg", "http://x/b1.jpg")])
+        assert len(granted) == 1
+
+        assert quota.stats["deferred"] == 1
+        assert quota.deferred() == [("/a/image-03.jpg", "http://x/a4.jpg", False)]
+
+        quota.remove("/a/image-03.jpg")
+        assert quota.deferred() == []
+
+    def test_quota_persists(self):
+        quota = ImageQuota(self.cache_file, daily_quota=1, cover_reserve=0)
+        cover = [("/a/folder.jpg", "http://x/a1.jpg")]
+        assert quota.allot(cover, cover) == cover
+        quota.close()
+
+        quota = ImageQuota(self.cache_file, daily_quota=1, cover_reserve=0)
+        cover = [("/b/folder.jpg", "http://x/b1.jpg")]
+        assert quota.allot(cover, cover) == []
+        assert quota.deferred() == [("/b/folder.jpg", "http://x/b1.jpg", True)]
+
+    def test_give_back(self):
+        quota = ImageQuota(self.cache_file, daily_quota=2, cover_reserve=0)
+        album = [("/a/folder.jpg", "http://x/a1.jpg"), ("/a/image-01.jpg", "http://x/a2.jpg")]
+
+        assert quota.allot(album) == album
+
+        quota.give_back(1)
+        assert quota.used == 1
+
+        quota.give_back(5)
+        assert quota.used == 0
+
+    def test_defer(self):
+        quota = ImageQuota(self.cache_file, daily_quota=5, cover_reserve=2)
+        album = [("/a/folder.jpg", "http://x/a1.jpg"), ("/a/image-01.jpg", "http://x/a2.jpg")]
+
+        quota.defer(album, album[:1])
+
+        assert quota.used == 0
+        assert quota.stats["deferred"] == 2
+        assert quota.deferred() == [("/a/folder.jpg", "http://x/a1.jpg", True),
+                                    ("/a/image-01.jpg", "http://x/a2.jpg", False)]
@@ -0,0 +1,116 @@
+import os, sys
+import logging
+import shutil
+import tempfile
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+logger.debug("parentdir: %s" % parentdir)
+
+from discogstagger import dirscan
+from discogstagger.dirscan import DirectorySnapshot, missing_files
+
+class TestDirectorySnapshot(object):
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+
+        for disc_dir in ("disc1", "disc2"):
+            os.makedirs(os.path.join(self.source_dir, disc_dir, "scans"))
+            with open(os.path.join(self.source_dir, disc_dir, "01-song.flac"), "w") as fh:
+                fh.write("x" * 10)
+
+        open(os.path.join(self.source_dir, "id.txt"), "w").close()
+        os.symlink(os.path.join(self.source_dir, "missing"), os.path.join(self.source_dir, "broken"))
+
+    def tearDown(self):
+        shutil.rmtree(self.source_dir)
+
+    def check(self, snapshot):
+        assert snapshot.names() == ["broken", "disc1", "disc2", "id.txt"]
+        assert snapshot.dirs() == ["disc1", "disc2"]
+        assert snapshot.files() == ["broken", "id.txt"]
+
+        assert "id.txt" in snapshot
+        assert not "other.txt" in snapshot
+        assert snapshot.entry("other.txt") == None
+        assert not snapshot.entry("broken").is_dir
+
+        disc = snapshot.subdir("disc1")
+        assert disc.names() == ["01-song.flac", "scans"]
+        assert disc.entry("01-song.flac") == ("01-song.flac", False)
+        assert disc.entry("scans").is_dir
+
+        # only one level of subdirectories is read
+        assert disc.subdir("scans") == None
+
+    def test_scan(self):
+        self.check(DirectorySnapshot.scan(self.source_dir))
+
+    def test_scan_without_scandir(self):
+        scandir = dirscan.scandir
+        dirscan.scandir = None
+        try:
+            self.check(DirectorySnapshot.scan(self.source_dir))
+        finally:
+            dirscan.scandir = scandir
+
+    def test_scan_does_not_stat(self):
+        stat_calls = []
+
+        class DirEntry(object):
+            def __init__(self, path, name):
+                self.name = name
+                self.path = os.path.join(path, name)
+
+            def is_dir(self):
+                return os.path.isdir(self.path)
+
+            def stat(self):
+                stat_calls.append(self.path)
+                return os.stat(self.path)
+
+        scandir = dirscan.scandir
+        dirscan.scandir = lambda path: [DirEntry(path, name) for name in os.listdir(path)]
+        try:
+            snapshot = DirectorySnapshot.scan(self.source_dir)
+            assert stat_calls == []
+
+            self.check(snapshot)
+        finally:
+            dirscan.scandir = scandir
+
+    def test_snapshot_does_not_change(self):
+        snapshot = DirectorySnapshot.scan(self.source_dir)
+
+        open(os.path.join(self.source_dir, "new.txt"), "w").close()
+        names = snapshot.names()
+        names.append("other")
+
+        assert snapshot.names() == ["broken", "disc1", "disc2", "id.txt"]
+
+    def test_missing_dir(self):
+        try:
+            DirectorySnapshot.scan(os.path.join(self.source_dir, "missing"))
+        except OSError:
+            return
+
+        assert False
+
+    def test_missing_files(self):
+        snapshot = DirectorySnapshot.scan(self.source_dir)
+        paths = [os.path.join(self.source_dir, "id.txt"), os.path.join(self.source_dir, "disc2", "01-song.flac"),
+                 os.path.join(self.source_dir, "disc2", "02-song.flac")]
+
+        assert missing_files(paths) == paths[2:]
+
+        # the snapshot is used instead of the directories
+        os.remove(os.path.join(self.source_dir, "id.txt"))
+        assert missing_files(paths, snapshot) == paths[2:]
+        assert missing_files(paths) == [paths[0], paths[2]]
+
+        assert missing_files([os.path.join(self.source_dir, "missing", "01-song.flac")]) != []
@@ -14,7 +14,9 @@ logger.debug("parentdir: %s" % parentdir)
 from _common_test import TestDummyResponse, DummyDiscogsAlbum
 
 from discogstagger.tagger_config import TaggerConfig
-from discogstagger.discogsalbum import DiscogsConnector, DiscogsAlbum
+from discogstagger.discogsalbum import DiscogsConnector, DiscogsAlbum, LocalDiscogsConnector, AlbumError
+from discogstagger.cache import ReleaseCache
+from discogstagger.releasestore import ReleaseStore, read_release_json
 
 class TestDiscogsAlbum(object):
 
@@ -29,6 +31,9 @@ class TestDiscogsAlbum(object):
         if not os.path.exists(self.dummy_dir):
             os.makedirs(self.dummy_dir)
 
+        # the persistent caches (and the rate limit state) are kept out of the home directory
+        self.tagger_config.set("cache", "dir", os.path.join(self.dummy_dir, "cache"))
+
     def tearDown(self):
         self.ogsrelid = None
         self.tagger_config = None
@@ -45,12 +50,16 @@ class TestDiscogsAlbum(object):
             This call will show, that almost certainly some WARN-messages are printed
             (except you haven an extremely fast pc).
         """
+        # the cache would avoid most of the calls
+        self.tagger_config.set("cache", "release_cache", "False")
+
         discogs_connection = DiscogsConnector(self.tagger_config)
 
         start = time.time()
 
         for x in range(1, 12):
-            discogs_connection.fetch_release(self.ogsrelid)
+            # the discogs_client fetches the release lazily
+            discogs_connection.fetch_release(self.ogsrelid).title
 
         stop = time.time()
 
@@ -89,6 +98,7 @@ class TestDiscogsAlbum(object):
             consumer_secret = os.environ.get("TRAVIS_DISCOGS_CONSUMER_SECRET")
 
         config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+        config.set("cache", "dir", os.path.join(self.dummy_dir, "cache"))
         config.set("discogs", "consumer_key", consumer_key)
         config.set("discogs", "consumer_secret", consumer_secret)
 
@@ -160,6 +170,72 @@ class TestDiscogsAlbum(object):
         assert access_token
         assert access_secret
 
+    def test_local_connector_release_store(self):
+        """the local connector prefers the release store over the json files
+        """
+        self.tagger_config.set("cache", "dir", self.dummy_dir)
+
+        release_store = ReleaseStore.from_config(self.tagger_config, create=True)
+        release_store.put(3083, read_release_json(os.path.join(parentdir, "test/release/3083.json")))
+
+        discogs_connection = DiscogsConnector(self.tagger_config)
+        local_connection = LocalDiscogsConnector(discogs_connection)
+
+        # there is no 3083.json in the dummy dir
+        release = local_connection.fetch_release("3083", self.dummy_dir)
+
+        assert release.id == 3083
+        assert release.title == "Shallow And Profound"
+
+    def test_offline(self):
+        """offline only the locally available releases are used
+        """
+        self.tagger_config.set("cache", "dir", self.dummy_dir)
+        self.tagger_config.set("discogs", "offline", "True")
+
+        data = read_release_json(os.path.join(parentdir, "test/release/3083.json"))
+
+        release_cache = ReleaseCache.from_config(self.tagger_config)
+        release_cache.put(3083, data)
+        release_cache.connection.execute("UPDATE releases SET fetched = 0")
+        release_cache.connection.commit()
+
+        release_store = ReleaseStore.from_config(self.tagger_config, create=True)
+        release_store.put(1448190, data)
+
+        discogs_connection = DiscogsConnector(self.tagger_config)
+
+        assert not discogs_connection.discogs_auth
+
+        # the expired cache entry is good enough
+        assert discogs_connection.is_available("3083")
+        assert discogs_connection.fetch_release("3083").title == "Shallow And Profound"
+
+        assert discogs_connection.is_available("1448190")
+        assert not discogs_connection.is_available("4711")
+
+        try:
+            discogs_connection.fetch_release("4711")
+            assert False
+        except AlbumError:
+            pass
+
+        local_connection = LocalDiscogsConnector(discogs_connection)
+        assert local_connection.is_available("1448190", self.dummy_dir)
+        assert not local_connection.is_available("3083", self.dummy_dir)
+
+        # both connectors are asked the same way
+        for connection in (discogs_connection, local_connection):
+            assert connection.is_available("1448190", source_dir=self.dummy_dir)
+        assert not local_connection.is_available("4711")
+
+        # images are deferred until the next online run
+        image_file = os.path.join(self.dummy_dir, "folder.jpg")
+        discogs_connection.fetch_images([(image_file, "http://api.discogs.com/image/R-3083-1167766285.jpeg")])
+
+        assert not os.path.exists(image_file)
+        assert discogs_connection.image_quota.deferred()[0][0] == image_file
+
     test_download_release.needs_network = True
     test_download_release.needs_authentication = True
     test_download_image_wo_tokens.needs_network = True
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os, sys
+import logging
+import gzip
+import shutil
+import tempfile
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+logger.debug("parentdir: %s" % parentdir)
+
+import discogs_client as discogs
+
+from discogstagger.dump import iter_releases, import_dump, read_library_ids
+from discogstagger.releasestore import ReleaseStore
+from discogstagger.discogsalbum import DiscogsAlbum
+
+DUMP_FILE = os.path.join(parentdir, "test/files/releases_dump.xml")
+
+def test_iter_releases():
+    with open(DUMP_FILE, "rb") as dump:
+        releases = list(iter_releases(dump))
+
+    assert len(releases) == 2
+
+    release = releases[0]
+    assert release["id"] == 3083
+    assert release["title"] == "Shallow And Profound"
+    assert release["year"] == 2000
+    assert release["master_id"] == 31587
+    assert release["labels"][0]["catno"] == "MOLECD023-2"
+    assert release["formats"][0]["qty"] == "1"
+    assert release["tracklist"][2]["artists"][0]["join"] == "Feat."
+
+    # the image of the dump has no url
+    assert release["images"] == []
+
+    assert releases[1]["title"] == u"Gr\xf6\xdfte Hits"
+    assert not "country" in releases[1]
+
+def test_iter_releases_only_ids():
+    with open(DUMP_FILE, "rb") as dump:
+        releases = list(iter_releases(dump, set([4711])))
+
+    assert [x["id"] for x in releases] == [4711]
+
+class TestImportDump(object):
+
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        self.store = ReleaseStore(os.path.join(self.store_dir, "release-store.db"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store_dir)
+
+    def test_import_gzip(self):
+        dump_file = os.path.join(self.store_dir, "releases.xml.gz")
+        with gzip.open(dump_file, "wb") as fh:
+            fh.write(open(DUMP_FILE, "rb").read())
+
+        assert import_dump(dump_file, self.store, batch_size=1) == 2
+        assert len(self.store) == 2
+        assert 3083 in self.store
+        assert self.store.get(4711)["formats"][0]["qty"] == "2"
+
+    def test_map_imported_release(self):
+        import_dump(DUMP_FILE, self.store)
+
+        client = discogs.Client("Dummy Client - just for unit testing")
+        album = DiscogsAlbum(discogs.Release(client, self.store.get(4711))).map()
+
+        assert album.title == u"Gr\xf6\xdfte Hits"
+        assert album.labels[0] == "Label, The"
+        assert album.year == "1999"
+        assert album.is_compilation
+        assert len(album.discs) == 2
+        assert album.discs[1].tracks[0].artists[0] == "The Band"
+
+    def test_images_without_url(self):
+        import_dump(DUMP_FILE, self.store)
+
+        # releases imported before the images without url were dropped
+        data = self.store.get(3083)
+        data["images"] = [{"uri": "", "type": "primary"}, {"uri": "http://x/image.jpg", "type": "secondary"}]
+
+        client = discogs.Client("Dummy Client - just for unit testing")
+        assert DiscogsAlbum(discogs.Release(client, data)).images == ["http://x/image.jpg"]
+
+    def test_store_stats(self):
+        import_dump(DUMP_FILE, self.store)
+
+        stats = self.store.stats()
+
+        assert stats["releases"] == 2
+        assert stats["stored_bytes"] > 0
+        assert stats["lookups"] == 2
+        assert self.store.ids() == [3083, 4711]
+
+    def test_read_library_ids(self):
+        library_dir = os.path.join(self.store_dir, "library")
+        os.makedirs(os.path.join(library_dir, "album1"))
+        os.makedirs(os.path.join(library_dir, "album2"))
+        shutil.copyfile(os.path.join(parentdir, "test/files/discogs_id.txt"),
+                        os.path.join(library_dir, "album1", "id.txt"))
+        shutil.copyfile(os.path.join(parentdir, "test/files/multiple_id.txt"),
+                        os.path.join(library_dir, "album2", "id.txt"))
+
+        assert read_library_ids(library_dir) == set([4712])
+
+        # the id tag is looked up in the source mapping
+        os.makedirs(os.path.join(library_dir, "album3"))
+        with open(os.path.join(library_dir, "album3", "id.txt"), "w") as fh:
+            fh.write("[source]\nname=local\nrelease_id=4714\n")
+
+        mapping = {"name": "discogs", "discogs": "discogs_id", "local": "release_id"}
+        assert read_library_ids(library_dir, source_mapping=mapping) == set([4712, 4714])
@@ -11,8 +11,23 @@ sys.path.append(parentdir)
 
 logger.debug("parentdir: %s" % parentdir)
 
+import glob
+import pickle
+import shutil
+import tempfile
+from nose.tools import *
+
+import discogs_client as discogs
+
 from _common_test import TestDummyResponse, DummyDiscogsAlbum
 from discogstagger.tagger_config import TaggerConfig
+from discogstagger.discogsalbum import DiscogsAlbum, AlbumError, decode_release, mapper_version
+from discogstagger.discogsalbum import DiscogsConnector, _mapping_sources
+from discogstagger.discogsalbum import NameCache, clean_name_cache
+from discogstagger.cache import AlbumCache
+from discogstagger import album as album_module
+from discogstagger.album import Album, Disc, Track, intern_string, clear_interned
+from discogstagger.releasestore import read_release_json
 
 
 def test_map_multidisc():
@@ -306,3 +321,209 @@ def test_map_singledisc():
     assert track.title == "Outro"
     assert track.artists[0] == "Yonderboi"
     assert track.non_existent_tag == None
+
+def album_values(album):
+    values = album.__getstate__()
+    values["discs"] = [dict(disc.__getstate__(), tracks=[track.__getstate__() for track in disc.tracks])
+                       for disc in album.discs]
+    return values
+
+def test_map_decoded_release():
+    """the decoded release has to be mapped exactly like the converted one
+    """
+    client = discogs.Client('Dummy Client - just for unit testing')
+
+    for json_file in sorted(glob.glob(os.path.join(parentdir, "test/release/*.json"))):
+        ogsrelid = os.path.basename(json_file).split(".")[0]
+
+        expected = DummyDiscogsAlbum(TestDummyResponse(ogsrelid)).map()
+
+        release = discogs.Release(client, decode_release(read_release_json(json_file)))
+        album = DiscogsAlbum(release).map()
+
+        assert album_values(album) == album_values(expected)
+
+def test_map_many():
+    """mapping many releases in a process pool gives the same albums
+    """
+    client = discogs.Client('Dummy Client - just for unit testing')
+
+    releases = [read_release_json(json_file) for json_file in
+                sorted(glob.glob(os.path.join(parentdir, "test/release/*.json")))]
+
+    expected = [DiscogsAlbum(discogs.Release(client, dict(data))).map() for data in releases]
+    albums = DiscogsAlbum.map_many(releases, processes=2)
+
+    assert len(albums) == len(releases)
+
+    for album, expected_album in zip(albums, expected):
+        assert album_values(album) == album_values(expected_album)
+
+    # unmappable releases do not stop the batch
+    broken = dict(releases[0], tracklist=[{"position": "X-Y", "title": "broken", "duration": ""}])
+    albums = DiscogsAlbum.map_many([broken, releases[1]], processes=1)
+
+    assert isinstance(albums[0], AlbumError)
+    assert albums[1].id == releases[1]["id"]
+
+    # neither do releases with incomplete data
+    incomplete = dict(releases[0])
+    del incomplete["formats"]
+    albums = DiscogsAlbum.map_many([incomplete, releases[1]], processes=2)
+
+    assert isinstance(albums[0], AlbumError)
+    assert str(releases[0]["id"]) in str(albums[0])
+    assert albums[1].id == releases[1]["id"]
+
+def test_compact_album():
+    """the mapped albums keep their attributes in slots and share repeated strings
+    """
+    client = discogs.Client('Dummy Client - just for unit testing')
+
+    json_file = os.path.join(parentdir, "test/release/1448190.json")
+    first = DiscogsAlbum(discogs.Release(client, decode_release(read_release_json(json_file)))).map()
+    second = DiscogsAlbum(discogs.Release(client, decode_release(read_release_json(json_file)))).map()
+
+    assert not hasattr(first, "__dict__")
+    assert not hasattr(first.discs[0], "__dict__")
+    assert not hasattr(first.discs[0].tracks[0], "__dict__")
+
+    # unset slots and unknown attributes are still None (not for discs)
+    assert first.target_dir == None
+    assert not hasattr(first.discs[0], "sourcedir")
+    assert first.discs[0].tracks[0].new_file == None
+    assert first.non_existent_tag == None
+
+    assert first.labels[0] is second.labels[0]
+    assert first.genres[0] is second.genres[0]
+    assert first.discs[0].tracks[0].artists[0] is second.discs[0].tracks[0].artists[0]
+
+    for protocol in (0, 2):
+        copy = pickle.loads(pickle.dumps(first, protocol))
+        assert album_values(copy) == album_values(first)
+
+def test_album_attributes():
+    """only the attributes in the slots can be set on albums, discs and tracks
+    """
+    assert set(Album.__slots__) == set(["id", "artists", "title", "discs", "fileformat", "genres", "styles",
+                                        "sort_artist", "url", "catnumbers", "labels", "images", "year",
+                                        "country", "notes", "disctotal", "is_compilation", "master_id",
+                                        "sourcedir", "target_dir", "copy_files", "snapshot"])
+    assert set(Disc.__slots__) == set(["discnumber", "tracks", "target_dir", "sourcedir", "copy_files"])
+    assert set(Track.__slots__) == set(["tracknumber", "title", "artists", "discsubtitle", "position",
+                                        "discnumber", "sort_artist", "new_file", "orig_file"])
+
+    for obj in (Album(1, "title", ["artist"]), Disc(1), Track(1, "title", ["artist"])):
+        for name in type(obj).__slots__:
+            setattr(obj, name, "value")
+
+        assert_raises(AttributeError, setattr, obj, "non_existent_tag", "value")
+
+def test_intern_string():
+    """the table of shared strings is bounded
+    """
+    max_interned = album_module.MAX_INTERNED
+    album_module.MAX_INTERNED = 2
+    try:
+        clear_interned()
+
+        first = intern_string(u"".join([u"Yonder", u"boi"]))
+        assert intern_string(u"".join([u"Yonder", u"boi"])) is first
+
+        intern_string(u"Polystar")
+        intern_string(u"Electronic")
+
+        assert len(album_module._interned) <= 2
+        assert intern_string(u"".join([u"Yonder", u"boi"])) == first
+    finally:
+        album_module.MAX_INTERNED = max_interned
+        clear_interned()
+
+def test_map_cached():
+    """the cached album is used as long as neither the release nor the mapping changes
+    """
+    client = discogs.Client('Dummy Client - just for unit testing')
+    data = read_release_json(os.path.join(parentdir, "test/release/3083.json"))
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        album_cache = AlbumCache(os.path.join(cache_dir, "albums.db"), mapper_version())
+
+        expected = DiscogsAlbum(discogs.Release(client, dict(data))).map()
+
+        album = DiscogsAlbum(discogs.Release(client, dict(data))).map_cached(album_cache)
+        assert album_values(album) == album_values(expected)
+        assert album_cache.stats["misses"] == 1
+
+        album = DiscogsAlbum(discogs.Release(client, dict(data))).map_cached(album_cache)
+        assert album_values(album) == album_values(expected)
+        assert album_cache.stats["hits"] == 1
+
+        album = DiscogsAlbum(discogs.Release(client, dict(data, title="Other"))).map_cached(album_cache)
+        assert album.title == "Other"
+        assert album_cache.stats["stale"] == 1
+    finally:
+        shutil.rmtree(cache_dir)
+
+def test_mapper_version():
+    """only the mapping code is part of the mapper version
+    """
+    assert mapper_version().startswith("1-")
+    assert mapper_version() == mapper_version()
+
+    assert DiscogsAlbum in _mapping_sources()
+    assert DiscogsConnector not in _mapping_sources()
+    assert sys.modules["discogstagger.discogsalbum"] not in _mapping_sources()
+
+def test_map_vinyl_sides():
+    """the tracks on the sides of a record are numbered per disc, the sides are on
+    the first disc unless the release has several discs
+    """
+    client = discogs.Client('Dummy Client - just for unit testing')
+    data = read_release_json(os.path.join(parentdir, "test/release/3083.json"))
+
+    tracklist = [dict(track, position=position) for track, position in
+                 zip(data["tracklist"], ("A1", "A2", "B1", "B2", "C", "D1", "D2"))]
+
+    formats = [dict(data["formats"][0], name="Vinyl", qty="1")]
+    album = DiscogsAlbum(discogs.Release(client, dict(data, tracklist=tracklist, formats=formats))).map()
+
+    assert len(album.discs) == 1
+    assert [track.tracknumber for track in album.discs[0].tracks] == [1, 2, 3, 4, 5, 6, 7]
+    assert album.discs[0].tracks[6].discnumber == 1
+
+    formats = [dict(data["formats"][0], name="Vinyl", qty="2")]
+    album = DiscogsAlbum(discogs.Release(client, dict(data, tracklist=tracklist, formats=formats))).map()
+
+    assert len(album.discs) == 2
+    assert [track.tracknumber for track in album.discs[0].tracks] == [1, 2, 3, 4]
+    assert [track.tracknumber for track in album.discs[1].tracks] == [1, 2, 3]
+    assert album.discs[1].tracks[0].discnumber == 2
+
+def test_name_cache():
+    """the normalized names are memoized (in a bounded cache) and interned
+    """
+    calls = []
+
+    def normalize(name):
+        calls.append(name)
+        return name.upper()
+
+    name_cache = NameCache(normalize, max_entries=2)
+
+    assert name_cache("a") == "A"
+    assert name_cache("a") == "A"
+    assert name_cache(u"b") == u"B"
+    assert calls == ["a", u"b"]
+    assert name_cache.stats["hit_rate"] == 1.0 / 3
+
+    # the oldest name is evicted
+    name_cache("c")
+    assert len(name_cache) == 2
+    assert name_cache.stats["evictions"] == 1
+    name_cache("a")
+    assert calls == ["a", u"b", "c", "a"]
+
+    assert name_cache(u"b" + u"") is name_cache(u"b")
+
+    assert clean_name_cache("Aphex Twin, The (2)") == "The Aphex Twin"
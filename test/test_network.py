@@ -0,0 +1,163 @@
+import os, sys
+import logging
+import shutil
+import tempfile
+import threading
+import time
+
+import requests
+
+from BaseHTTPServer import HTTPServer
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+logger.debug("parentdir: %s" % parentdir)
+
+from discogstagger.ratelimit import TokenBucket
+from discogstagger.network import NetworkPolicy, ImageDownloader
+
+class DummyResponse(object):
+
+    def __init__(self, status_code, headers={}):
+        self.status_code = status_code
+        self.headers = headers
+
+    def close(self):
+        pass
+
+class TestNetworkPolicy(object):
+
+    def setUp(self):
+        self.policy = NetworkPolicy(timeout=5, retries=3, backoff=0.01, max_backoff=0.05,
+                                    breaker_threshold=2, breaker_pause=0.1)
+
+    def responses(self, *status_codes):
+        status_codes = list(status_codes)
+        timeouts = []
+
+        def request(timeout):
+            timeouts.append(timeout)
+            status_code = status_codes.pop(0)
+            if status_code is None:
+                raise requests.ConnectionError("connection refused")
+            return DummyResponse(status_code)
+
+        return request, timeouts
+
+    def test_success(self):
+        request, timeouts = self.responses(200)
+
+        assert self.policy.call(request, "http://x/releases/1").status_code == 200
+        assert timeouts == [5]
+        assert self.policy.stats["retries"] == 0
+
+    def test_retry(self):
+        request, timeouts = self.responses(503, None, 429, 200)
+
+        assert self.policy.call(request, "http://x/releases/1").status_code == 200
+        assert self.policy.stats["retries"] == 3
+        assert self.policy.stats["wait_time"] > 0
+
+    def test_no_retry_on_client_errors(self):
+        request, timeouts = self.responses(404, 200)
+
+        assert self.policy.call(request, "http://x/releases/1").status_code == 404
+        assert self.policy.stats["retries"] == 0
+
+    def test_retries_exhausted(self):
+        request, timeouts = self.responses(200, 429, 429, 429, 429)
+
+        self.policy.call(request, "http://x/releases/1")
+        assert self.policy.call(request, "http://x/releases/1").status_code == 429
+
+        # throttling does not open the circuit
+        assert self.policy.stats["pauses"] == 0
+
+        request, timeouts = self.responses(None, None, None, None)
+
+        try:
+            self.policy.call(request, "http://x/releases/1")
+            assert False
+        except requests.ConnectionError:
+            pass
+
+    def test_circuit_breaker(self):
+        request, timeouts = self.responses(500, 500, 500, 200)
+
+        start = time.time()
+        assert self.policy.call(request, "http://x/releases/1").status_code == 200
+
+        # opened after the second failure, and again after the (half-open) third one
+        assert self.policy.stats["pauses"] == 2
+        assert time.time() - start >= 0.2
+
+class FilesRequestHandler(SimpleHTTPRequestHandler):
+    """ serves the files in test/files """
+
+    def translate_path(self, path):
+        return os.path.join(parentdir, "test", "files", os.path.basename(path))
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+class TestImageDownloader(object):
+
+    def setUp(self):
+        self.target_dir = tempfile.mkdtemp()
+
+        self.server = HTTPServer(("127.0.0.1", 0), FilesRequestHandler)
+        self.base_url = "http://127.0.0.1:%d" % self.server.server_port
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        rate_limit = TokenBucket(os.path.join(self.target_dir, "ratelimit-image.json"), 100, 100)
+        self.downloader = ImageDownloader(rate_limit, "discogstagger test", threads=2, timeout=5)
+
+    def tearDown(self):
+        self.downloader.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.target_dir)
+
+    def test_download(self):
+        image_file = os.path.join(self.target_dir, "folder.jpg")
+
+        self.downloader.download(image_file, self.base_url + "/cover.jpeg")
+
+        with open(os.path.join(parentdir, "test", "files", "cover.jpeg"), "rb") as fh:
+            assert open(image_file, "rb").read() == fh.read()
+
+    def test_download_all_empty(self):
+        assert self.downloader.download_all([]) == []
+
+        # no download threads are started for nothing
+        assert self.downloader._pool is None
+
+    def test_download_all(self):
+        images = [(os.path.join(self.target_dir, "folder.jpg"), self.base_url + "/cover.jpeg"),
+                  (os.path.join(self.target_dir, "image-01.jpg"), self.base_url + "/cover.jpeg"),
+                  (os.path.join(self.target_dir, "image-02.jpg"), self.base_url + "/missing.jpeg")]
+
+        errors = self.downloader.download_all(images)
+
+        assert errors[0] == None
+        assert errors[1] == None
+        assert errors[2] != None
+
+        # no temporary files are left behind
+        files = sorted(x for x in os.listdir(self.target_dir) if x.endswith(".jpg") or x.endswith(".part"))
+        assert files == ["folder.jpg", "image-01.jpg"]
+
+        # the download threads are stopped, but started again on the next download
+        self.downloader.close()
+        assert self.downloader._pool is None
+
+        errors = self.downloader.download_all(images[:2])
+        assert errors == [None, None]
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os, sys
+import shutil
+import tempfile
+from StringIO import StringIO
+from nose.tools import *
+
+from ext.mediafile import MediaFile
+
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+from _common_test import TestDummyResponse, DummyDiscogsAlbum
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.taggerutils import TaggerError
+from discogstagger.plan import plan_album, check_plan, write_plans, read_plans, PlanExecutor, PLAN_VERSION
+
+class DummyConnector(object):
+    """ records the images to fetch instead of downloading them """
+
+    def __init__(self):
+        self.images = []
+
+    def fetch_images(self, images):
+        self.images.extend(images)
+
+class TestPlan(object):
+
+    def setUp(self):
+        self.tagger_config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+
+        self.cache_dir = tempfile.mkdtemp()
+        self.tagger_config.set("cache", "dir", self.cache_dir)
+        self.tagger_config.set("details", "copy_other_files", "True")
+
+        self.source_dir = tempfile.mkdtemp()
+        self.target_dir = tempfile.mkdtemp()
+
+        self.album = DummyDiscogsAlbum(TestDummyResponse("3083")).map()
+
+        for i in range(1, 18):
+            shutil.copyfile("test/files/test.flac", os.path.join(self.source_dir, "%.2d-song.flac" % i))
+        shutil.copyfile("test/files/test.txt", os.path.join(self.source_dir, "album.cue"))
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.target_dir)
+
+    def test_plan_album(self):
+        plan = plan_album(self.source_dir, self.target_dir, self.tagger_config, self.album)
+
+        album_dir = os.path.join(self.target_dir, "yonderboi-shallow_and_profound-(molecd023-2)-2000")
+
+        assert plan["version"] == PLAN_VERSION
+        assert plan["target_dir"] == album_dir
+        assert len(plan["files"]) == 17
+
+        # nothing was written yet
+        assert os.listdir(self.target_dir) == []
+
+        entry = plan["files"][0]
+        assert entry["source"] == os.path.join(self.source_dir, "01-song.flac")
+        assert entry["target"] == os.path.join(album_dir, "01-yonderboi-intro.flac")
+
+        tags = dict(entry["tags"])
+        assert tags["title"] == "Intro"
+        assert tags["track"] == 1
+        assert tags["tracktotal"] == 17
+        assert tags["year"] == "2000"
+
+        assert plan["other_files"] == [(os.path.join(self.source_dir, "album.cue"),
+                                        os.path.join(album_dir, "album.cue"))]
+        assert plan["images"][0][0] == os.path.join(album_dir, "folder.jpg")
+        assert [os.path.basename(document["file"]) for document in plan["documents"]] == \
+            ["yonderboi-shallow_and_profound.m3u", "yonderboi-shallow_and_profound.nfo"]
+        assert "01-yonderboi-intro.flac" in plan["documents"][0]["content"]
+
+        assert check_plan(plan) == []
+
+    def test_plan_album_missing_files(self):
+        os.remove(os.path.join(self.source_dir, "17-song.flac"))
+
+        assert_raises(TaggerError, plan_album, self.source_dir, self.target_dir, self.tagger_config, self.album)
+
+    def test_write_and_read_plans(self):
+        plan = plan_album(self.source_dir, self.target_dir, self.tagger_config, self.album)
+
+        fh = StringIO()
+        write_plans([plan, plan], fh)
+
+        plans = read_plans(StringIO(fh.getvalue()))
+
+        assert len(plans) == 2
+        assert plans[0]["target_dir"] == plan["target_dir"]
+        assert dict(plans[0]["files"][0]["tags"])["title"] == "Intro"
+        assert check_plan(plans[1]) == []
+
+    def test_check_plan(self):
+        plan = plan_album(self.source_dir, self.target_dir, self.tagger_config, self.album)
+
+        os.remove(os.path.join(self.source_dir, "02-song.flac"))
+        plan["files"][1]["target"] = plan["files"][0]["target"]
+
+        problems = check_plan(plan)
+        assert len(problems) == 2
+        assert "02-song.flac" in problems[0]
+        assert "used more than once" in problems[1]
+
+        plan["version"] = PLAN_VERSION + 1
+        assert len(check_plan(plan)) == 1
+
+    def test_check_plan_with_snapshot(self):
+        plan = plan_album(self.source_dir, self.target_dir, self.tagger_config, self.album)
+
+        # the sources are looked up in the snapshot read while planning
+        os.remove(os.path.join(self.source_dir, "02-song.flac"))
+
+        assert check_plan(plan, self.album.snapshot) == []
+        assert len(check_plan(plan)) == 1
+
+    def test_apply(self):
+        plan = read_plans(StringIO(self._plan_file()))[0]
+
+        connector = DummyConnector()
+        failed = PlanExecutor(connector, workers=2).apply_many([plan])
+
+        assert failed == []
+
+        album_dir = plan["target_dir"]
+        assert len([name for name in os.listdir(album_dir) if name.endswith(".flac")]) == 17
+        assert os.path.exists(os.path.join(album_dir, "album.cue"))
+        assert os.path.exists(os.path.join(album_dir, "yonderboi-shallow_and_profound.m3u"))
+        assert os.path.exists(os.path.join(album_dir, "yonderboi-shallow_and_profound.nfo"))
+        assert os.path.exists(os.path.join(self.source_dir, "dt.done"))
+
+        assert connector.images[0] == (os.path.join(album_dir, "folder.jpg"), plan["images"][0][1])
+
+        metadata = MediaFile(os.path.join(album_dir, "17-yonderboi-outro.flac"))
+        assert metadata.title == "Outro"
+        assert metadata.artist == "Yonderboi"
+        assert metadata.track == 17
+        assert metadata.year == 2000
+
+    def test_apply_many_failures(self):
+        plan = plan_album(self.source_dir, self.target_dir, self.tagger_config, self.album)
+        shutil.rmtree(self.source_dir)
+        os.mkdir(self.source_dir)
+
+        failed = PlanExecutor(DummyConnector()).apply_many([plan])
+
+        assert len(failed) == 1
+        assert failed[0][0] is plan
+
+    def _plan_file(self):
+        fh = StringIO()
+        write_plans([plan_album(self.source_dir, self.target_dir, self.tagger_config, self.album)], fh)
+        return fh.getvalue()
@@ -0,0 +1,57 @@
+import os, sys
+import logging
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+logger.debug("parentdir: %s" % parentdir)
+
+from discogstagger.position import PositionParser, Position
+
+def test_parse():
+    parser = PositionParser()
+
+    assert parser.parse("12") == Position("track", 1, 12)
+    assert parser.parse(" 3 ") == Position("track", 1, 3)
+    assert parser.parse("2-05") == Position("disc", 2, 5)
+    assert parser.parse("CD01-12") == Position("cd", 1, 12)
+    assert parser.parse("CD2.03") == Position("cd", 2, 3)
+    assert parser.parse("15.1") == Position("subtrack", 15, 1)
+    assert parser.parse("A1") == Position("side", 1, 1, "A")
+    assert parser.parse("B") == Position("side", 1, 1, "B")
+    assert parser.parse("C2") == Position("side", 2, 2, "C")
+
+    assert parser.parse("X-Y") == None
+    assert parser.parse("") == None
+
+def test_memo():
+    parser = PositionParser()
+
+    assert parser.parse("1-02") is parser.parse("1-02")
+    assert parser.parse("X-Y") == None
+    assert parser.parse("X-Y") == None
+
+    assert parser.stats == {"hits": 2, "misses": 2, "evictions": 0, "positions": 2}
+
+def test_memo_bounded():
+    parser = PositionParser(max_entries=2)
+
+    for position in ("1", "2", "3", "1"):
+        parser.parse(position)
+
+    assert parser.stats == {"hits": 0, "misses": 4, "evictions": 2, "positions": 2}
+    assert parser.parse("1") == Position("track", 1, 1)
+
+def test_add_scheme():
+    parser = PositionParser()
+
+    assert parser.parse("1-A1") == None
+
+    parser.add_scheme("disc side", "^(?P<discnumber>\d+)-(?P<side>[A-Z])(?P<tracknumber>\d+)$")
+
+    # the memo is cleared, the position is parsed again
+    assert parser.parse("1-A1") == Position("disc side", 1, 1, "A")
+    assert parser.parse("2-A3") == Position("disc side", 2, 3, "A")
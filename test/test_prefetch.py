@@ -0,0 +1,90 @@
+import os, sys
+import logging
+import threading
+import time
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+logger.debug("parentdir: %s" % parentdir)
+
+from discogstagger.prefetch import ReleasePrefetcher
+
+class DummyRelease(object):
+
+    def __init__(self, release_id):
+        self.id = release_id
+
+    def fetch(self, key, default=None):
+        return []
+
+class DummyConnector(object):
+
+    def __init__(self):
+        self.fetched = []
+        self.lock = threading.Lock()
+
+    def fetch_release(self, release_id):
+        if release_id == "666":
+            raise IOError("release not found")
+
+        with self.lock:
+            self.fetched.append(release_id)
+
+        return DummyRelease(release_id)
+
+def wait_for(condition):
+    for x in range(100):
+        if condition():
+            return
+        time.sleep(0.01)
+
+def test_prefetch_dedupes():
+    connector = DummyConnector()
+    prefetcher = ReleasePrefetcher(connector, ["1", "2", "1", "3"], window=10).start()
+
+    assert prefetcher.fetch_release("1").id == "1"
+    assert prefetcher.fetch_release("2").id == "2"
+    assert prefetcher.fetch_release(1).id == "1"
+    assert prefetcher.fetch_release("3").id == "3"
+
+    assert sorted(connector.fetched) == ["1", "2", "3"]
+    assert prefetcher.results == {}
+
+    # unknown releases are fetched directly
+    assert prefetcher.fetch_release("4").id == "4"
+
+    prefetcher.stop()
+
+def test_prefetch_window():
+    connector = DummyConnector()
+    prefetcher = ReleasePrefetcher(connector, ["1", "2", "3", "4", "5"], window=2).start()
+
+    wait_for(lambda: len(connector.fetched) == 2)
+    time.sleep(0.05)
+    assert len(connector.fetched) == 2
+
+    prefetcher.fetch_release("1")
+
+    wait_for(lambda: len(connector.fetched) == 3)
+    time.sleep(0.05)
+    assert len(connector.fetched) == 3
+
+    prefetcher.stop()
+
+def test_prefetch_error():
+    connector = DummyConnector()
+    prefetcher = ReleasePrefetcher(connector, ["666", "1"], window=2).start()
+
+    try:
+        prefetcher.fetch_release("666")
+        assert False
+    except IOError:
+        pass
+
+    assert prefetcher.fetch_release("1").id == "1"
+
+    prefetcher.stop()
@@ -0,0 +1,107 @@
+import os, sys
+import logging
+import shutil
+import tempfile
+import time
+from nose.tools import *
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+logger.debug("parentdir: %s" % parentdir)
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.ratelimit import TokenBucket
+
+class TestTokenBucket(object):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.state_dir, "ratelimit-metadata.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+        self.state_dir = None
+
+    def test_acquire_burst(self):
+        bucket = TokenBucket(self.state_file, rate=1, capacity=5)
+
+        start = time.time()
+        for x in range(5):
+            bucket.acquire()
+
+        assert time.time() - start < 0.5
+        assert bucket.stats["waits"] == 0
+
+    def test_acquire_waits(self):
+        bucket = TokenBucket(self.state_file, rate=20, capacity=1)
+
+        start = time.time()
+        for x in range(3):
+            bucket.acquire()
+
+        # two refills at 20 tokens per second
+        assert time.time() - start >= 0.09
+        assert bucket.stats["waits"] >= 2
+
+    def test_shared_budget(self):
+        """ two limiters (e.g. in two processes) using the same state file share the tokens """
+        first = TokenBucket(self.state_file, rate=0.1, capacity=2)
+        second = TokenBucket(self.state_file, rate=0.1, capacity=2)
+
+        first.acquire()
+        second.acquire()
+
+        assert first._transaction(first._take) > 0
+
+    def test_update_from_headers(self):
+        bucket = TokenBucket(self.state_file, rate=1, capacity=1)
+
+        bucket.update(200, {"X-Discogs-Ratelimit": "60", "X-Discogs-Ratelimit-Remaining": "10"})
+
+        state = bucket._transaction(lambda state, now: dict(state))
+        assert state["capacity"] == 60
+        assert state["rate"] == 1
+        assert state["tokens"] <= 10
+
+        bucket.update(429, {})
+
+        state = bucket._transaction(lambda state, now: dict(state))
+        assert state["tokens"] < 1
+
+    def test_invalid_rate(self):
+        assert_raises(ValueError, TokenBucket, self.state_file, rate=0)
+        assert_raises(ValueError, TokenBucket, self.state_file, rate=1, capacity=0)
+
+        bucket = TokenBucket(self.state_file, rate=1, capacity=1)
+        bucket.update(200, {"X-Discogs-Ratelimit": "0"})
+
+        state = bucket._transaction(lambda state, now: dict(state))
+        assert state["rate"] == 1
+
+        # a broken state file does not stop the bucket
+        with open(self.state_file, "w") as fh:
+            fh.write('{"tokens": 0, "rate": 0, "capacity": 1, "updated": 0}')
+
+        bucket.acquire()
+
+    def test_from_config(self):
+        config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+        config.set("cache", "dir", self.state_dir)
+
+        bucket = TokenBucket.from_config(config, "image")
+        assert bucket.state_file == os.path.join(self.state_dir, "ratelimit-image.json")
+        assert bucket.rate == 1
+
+    def test_state_dir_created_lazily(self):
+        config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+        config.set("cache", "dir", os.path.join(self.state_dir, "cache"))
+
+        bucket = TokenBucket.from_config(config, "metadata")
+        assert not os.path.exists(os.path.join(self.state_dir, "cache"))
+
+        bucket.acquire()
+        assert os.path.exists(os.path.join(self.state_dir, "cache", "ratelimit-metadata.json"))
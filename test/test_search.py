@@ -0,0 +1,158 @@
+import os, sys
+import glob
+import logging
+import shutil
+import tempfile
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+logger.debug("parentdir: %s" % parentdir)
+
+from discogstagger.search import SearchIndex, CatalogIndex, tokenize, catno_key, folder_query, index_releases
+from discogstagger.search import untagged_dirs
+from discogstagger.releasestore import ReleaseStore, read_release_json
+
+def test_tokenize():
+    assert tokenize("Goldie (12)") == ["goldie"]
+    assert tokenize(u"Die \xc4rzte - Planet Punk") == [u"die", u"\xe4rzte", u"planet", u"punk"]
+    assert tokenize(None) == []
+
+    assert catno_key("MOLECD 023-2") == "molecd0232"
+    assert catno_key("molecd_023-2") == "molecd0232"
+
+def test_untagged_dirs():
+    library_dir = tempfile.mkdtemp()
+    try:
+        for album_dir, names in (("tagged", ["id.txt"]), ("tagged/disc1", ["01.flac"]),
+                                 ("artist/single", ["01.mp3", "cover.jpg"]),
+                                 ("artist/double/CD1", ["01.flac"]), ("artist/double/cd 2", ["01.flac"]),
+                                 ("artist/scans", ["front.jpg"])):
+            os.makedirs(os.path.join(library_dir, album_dir))
+            for name in names:
+                open(os.path.join(library_dir, album_dir, name), "w").close()
+
+        assert untagged_dirs(library_dir, "id.txt") == [os.path.join(library_dir, "artist/double"),
+                                                        os.path.join(library_dir, "artist/single")]
+    finally:
+        shutil.rmtree(library_dir)
+
+class TestSearchIndex(object):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+        self.search_index = SearchIndex(os.path.join(self.cache_dir, "search-index.db"))
+        self.search_index.add_many(read_release_json(json_file) for json_file in
+                                   glob.glob(os.path.join(parentdir, "test/release/*.json")))
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_search(self):
+        assert len(self.search_index) == 9
+
+        candidates = self.search_index.search(artist="Yonderboi", title="Shallow and Profound")
+        assert candidates == [(3083, 1.0)]
+
+        candidates = self.search_index.search(text="yonderboi shallow profound", catno="MOLECD023-2",
+                                              tracks=17)
+        assert candidates[0][0] == 3083
+        assert candidates[0][1] > 0.8
+        assert candidates[1][1] < 0.5
+
+        assert self.search_index.search(title="does not exist") == []
+        assert self.search_index.search() == []
+
+    def test_frequent_terms(self):
+        self.search_index.max_postings = 2
+        self.search_index.max_candidates = 1
+
+        # 'the' is in three releases, so only 'profound' selects the candidates
+        assert self.search_index._frequent("the")
+        assert not self.search_index._frequent("profound")
+        assert self.search_index._candidates(["the", "profound"]) == [3083]
+
+        # unless all terms are frequent
+        assert len(self.search_index._candidates(["the"])) == 1
+
+        assert self.search_index.search(text="the yonderboi")[0][0] == 3083
+
+    def test_reindex(self):
+        data = read_release_json(os.path.join(parentdir, "test/release/3083.json"))
+        data["title"] = "Something Else"
+
+        self.search_index.add(data)
+
+        assert len(self.search_index) == 9
+        assert self.search_index.search(title="Shallow and Profound") == []
+        assert self.search_index.search(title="Something Else")[0][0] == 3083
+
+    def test_propose_from_dir_name(self):
+        source_dir = os.path.join(self.cache_dir, "yonderboi-shallow_and_profound-(molecd023-2)-2000")
+        os.mkdir(source_dir)
+
+        query = folder_query(source_dir)
+        assert query["text"] == "yonderboi-shallow and profound"
+        assert query["catno"] == "molecd023-2"
+
+        release_id, candidates = self.search_index.propose(source_dir, 0.8)
+        assert release_id == 3083
+
+        release_id, candidates = self.search_index.propose(source_dir, 0.99)
+        assert release_id == None
+        assert candidates[0][0] == 3083
+
+    def test_index_releases(self):
+        release_store = ReleaseStore(os.path.join(self.cache_dir, "release-store.db"))
+        release_store.put(3083, read_release_json(os.path.join(parentdir, "test/release/3083.json")))
+
+        search_index = SearchIndex(os.path.join(self.cache_dir, "other-index.db"))
+
+        assert index_releases(search_index, release_store) == 1
+        assert search_index.search(artist="yonderboi")[0][0] == 3083
+
+class TestCatalogIndex(object):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+        self.catalog_index = CatalogIndex(os.path.join(self.cache_dir, "catalog-index.db"))
+        self.catalog_index.add_many(read_release_json(json_file) for json_file in
+                                    glob.glob(os.path.join(parentdir, "test/release/*.json")))
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_resolve(self):
+        assert self.catalog_index.resolve("MOLECD 023-2") == [3083]
+        assert self.catalog_index.resolve("molecd0232", "Mole Listening Pearls") == [3083]
+        # an unknown label does not hide the release
+        assert self.catalog_index.resolve("molecd0232", "Other Label") == [3083]
+        assert self.catalog_index.resolve("XYZ 1") == []
+
+    def test_same_catno_on_several_releases(self):
+        data = read_release_json(os.path.join(parentdir, "test/release/3083.json"))
+        data["id"] = 4711
+        data["labels"] = [{"name": "Other Label", "catno": "MOLECD023-2"}]
+        self.catalog_index.add(data)
+
+        assert self.catalog_index.resolve("MOLECD023-2") == [3083, 4711]
+        assert self.catalog_index.resolve("MOLECD023-2", "Other Label") == [4711]
+
+    def test_resolve_tree(self):
+        album_dir = os.path.join(self.cache_dir, "library", "yonderboi-shallow_and_profound-(molecd023-2)-2000")
+        unknown_dir = os.path.join(self.cache_dir, "library", "unknown-(abc_1)-1999")
+        done_dir = os.path.join(self.cache_dir, "library", "megahits-(560_938-2)-2001")
+
+        for source_dir in (album_dir, unknown_dir, done_dir):
+            os.makedirs(source_dir)
+
+        open(os.path.join(done_dir, "id.txt"), "w").close()
+
+        results = self.catalog_index.resolve_tree(os.path.join(self.cache_dir, "library"), "id.txt")
+
+        assert results == {album_dir: [3083], unknown_dir: []}
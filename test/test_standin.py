@@ -0,0 +1,201 @@
+import os, sys
+import json
+import logging
+import shutil
+import tempfile
+import time
+
+logging.basicConfig(level=10)
+logger = logging.getLogger(__name__)
+
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+
+logger.debug("parentdir: %s" % parentdir)
+
+import requests
+
+from discogs_client.exceptions import HTTPError
+
+from discogstagger.tagger_config import TaggerConfig
+from discogstagger.discogsalbum import DiscogsConnector, AsyncDiscogsConnector
+from discogstagger.standin import StandInServer
+
+class TestStandInServer(object):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.target_dir = tempfile.mkdtemp()
+
+        self.standin = StandInServer(os.path.join(parentdir, "test/release"),
+                                     default_image=os.path.join(parentdir, "test/files/cover.jpeg"),
+                                     rate_limit=5).start()
+
+        # construct config with only default values
+        self.tagger_config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+        self.tagger_config.set("cache", "dir", self.cache_dir)
+        self.tagger_config.set("discogs", "base_url", self.standin.base_url)
+        self.tagger_config.set("ratelimit", "metadata_burst", "5")
+        self.tagger_config.set("ratelimit", "image_burst", "5")
+        self.tagger_config.set("network", "backoff", "0.01")
+
+    def tearDown(self):
+        self.standin.stop()
+        shutil.rmtree(self.cache_dir)
+        shutil.rmtree(self.target_dir)
+
+    def test_fetch_release(self):
+        discogs_connection = DiscogsConnector(self.tagger_config)
+
+        assert discogs_connection.discogs_auth
+
+        release = discogs_connection.fetch_release("3083")
+        assert release.title == "Shallow And Profound"
+
+        # the second fetch is answered from the release cache
+        discogs_connection.fetch_release("3083")
+        assert self.standin.stats["requests"] == 1
+
+        # the rate limiter adapted itself to the headers of the stand-in server
+        with open(os.path.join(self.cache_dir, "ratelimit-metadata.json")) as fh:
+            state = json.load(fh)
+        assert state["capacity"] == 5
+        assert state["tokens"] <= 4
+
+    def test_missing_release(self):
+        discogs_connection = DiscogsConnector(self.tagger_config)
+
+        try:
+            discogs_connection.fetch_release("4711")
+            assert False
+        except HTTPError as e:
+            assert e.status_code == 404
+
+    def test_rate_limit_exceeded(self):
+        self.tagger_config.set("cache", "release_cache", "False")
+        self.standin.rate_limit = 1
+
+        discogs_connection = DiscogsConnector(self.tagger_config)
+        discogs_connection.fetch_release("3083").title
+
+        try:
+            discogs_connection.rate_limit_pool["metadata"].acquire = lambda: None
+            discogs_connection.fetch_release("3083").title
+            assert False
+        except HTTPError as e:
+            assert e.status_code == 429
+
+        # the first request and all retries are throttled
+        assert self.standin.stats["throttled"] == 4
+        assert discogs_connection.network_policy.stats["retries"] == 3
+
+    def test_injected_error(self):
+        self.standin.fail(1, 503)
+
+        discogs_connection = DiscogsConnector(self.tagger_config)
+
+        release = discogs_connection.fetch_release("3083")
+        assert release.title == "Shallow And Profound"
+
+        assert self.standin.stats["errors"] == 1
+        assert discogs_connection.network_policy.stats["retries"] == 1
+
+    def test_retries_exhausted(self):
+        self.standin.fail(4, 503)
+
+        discogs_connection = DiscogsConnector(self.tagger_config)
+
+        try:
+            discogs_connection.fetch_release("3083")
+            assert False
+        except HTTPError as e:
+            assert e.status_code == 503
+
+        assert self.standin.stats["errors"] == 4
+
+    def test_deadline(self):
+        self.tagger_config.set("network", "timeout", "0.2")
+        self.tagger_config.set("network", "retries", "1")
+        self.standin.latency = 1
+
+        discogs_connection = DiscogsConnector(self.tagger_config)
+
+        try:
+            discogs_connection.fetch_release("3083")
+            assert False
+        except requests.Timeout:
+            pass
+
+        assert discogs_connection.network_policy.stats["retries"] == 1
+
+    def test_fetch_images(self):
+        discogs_connection = DiscogsConnector(self.tagger_config)
+
+        release = discogs_connection.fetch_release("3083")
+        image_url = release.data["images"][0]["uri"]
+
+        assert image_url.startswith(self.standin.base_url)
+
+        image_file = os.path.join(self.target_dir, "folder.jpg")
+        discogs_connection.fetch_images([(image_file, image_url)])
+
+        with open(os.path.join(parentdir, "test/files/cover.jpeg"), "rb") as fh:
+            assert open(image_file, "rb").read() == fh.read()
+
+    def test_failed_images_deferred(self):
+        # the failing image requests count against the rate limit of the stand-in as well
+        self.standin.rate_limit = 100
+        self.tagger_config.set("ratelimit", "image_rate", "100")
+        self.tagger_config.set("ratelimit", "image_burst", "100")
+        self.tagger_config.set("network", "breaker_pause", "0.1")
+
+        discogs_connection = DiscogsConnector(self.tagger_config)
+
+        release = discogs_connection.fetch_release("3083")
+        image_url = release.data["images"][0]["uri"]
+        image_file = os.path.join(self.target_dir, "folder.jpg")
+
+        # the first request and all retries fail
+        self.standin.fail(4, 503)
+        discogs_connection.fetch_images([(image_file, image_url)])
+
+        assert not os.path.exists(image_file)
+
+        # the failed download did not use up the quota and is tried again later on
+        image_quota = discogs_connection.image_quota
+        assert image_quota.used == 0
+        assert image_quota.deferred() == [(image_file, image_url, True)]
+
+        assert discogs_connection.fetch_deferred_images() == 1
+        assert os.path.exists(image_file)
+        assert image_quota.used == 1
+        assert image_quota.deferred() == []
+
+    def test_async_fetch(self):
+        self.standin.latency = 0.3
+        self.tagger_config.set("ratelimit", "metadata_rate", "100")
+        self.tagger_config.set("ratelimit", "metadata_burst", "100")
+
+        discogs_connector = DiscogsConnector(self.tagger_config)
+        async_connector = AsyncDiscogsConnector(discogs_connector, workers=4)
+
+        # the releases of several albums are in flight at the same time
+        start = time.time()
+        futures = async_connector.fetch_releases(["3083", "1448190", "513904", "543030"])
+        releases = [future.get(5) for future in futures]
+
+        assert time.time() - start < 1.0
+        assert [release.id for release in releases] == [3083, 1448190, 513904, 543030]
+
+        image_file = os.path.join(self.target_dir, "folder.jpg")
+        future = async_connector.fetch_image(image_file, releases[0].data["images"][0]["uri"])
+        future.get(5)
+
+        assert future.successful()
+        assert os.path.exists(image_file)
+
+        # all requests went thru the shared session and rate limiter
+        assert self.standin.stats["requests"] >= 5
+
+        async_connector.close()
+        discogs_connector.close()
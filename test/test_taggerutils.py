@@ -1,7 +1,11 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import os, sys
+import errno
 import shutil
+import tempfile
+import re
+import glob
 from nose.tools import *
 
 # for debugging only
@@ -23,8 +27,15 @@ logger.debug("parentdir: %s" % parentdir)
 from _common_test import TestDummyResponse, DummyDiscogsAlbum
 
 from discogstagger.tagger_config import TaggerConfig
-from discogstagger.discogsalbum import DiscogsConnector
-from discogstagger.taggerutils import TaggerUtils, TagHandler, FileHandler, TaggerError
+import discogs_client as discogs
+
+from discogstagger.discogsalbum import DiscogsConnector, DiscogsAlbum
+from discogstagger.releasestore import read_release_json
+from discogstagger.taggerutils import TaggerUtils, TagHandler, FileHandler, TaggerError, compile_format
+from discogstagger.taggerutils import FilenameSanitizer
+from unicodedata import normalize
+from discogstagger.album import Album
+from discogstagger.dirscan import DirectorySnapshot
 
 class TaggerUtilsBase(object):
 
@@ -34,11 +45,16 @@ class TaggerUtilsBase(object):
         # construct config with only default values
         self.tagger_config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
 
+        # the compiled templates are stored in the cache directory
+        self.cache_dir = tempfile.mkdtemp()
+        self.tagger_config.set("cache", "dir", self.cache_dir)
+
         dummy_response = TestDummyResponse(self.ogsrelid)
         discogs_album = DummyDiscogsAlbum(dummy_response)
         self.album = discogs_album.map()
 
     def tearDown(self):
+        shutil.rmtree(self.cache_dir)
         self.ogsrelid = None
         self.tagger_config = None
         self.album = None
@@ -63,6 +79,21 @@ class TestTaggerUtils(TaggerUtilsBase):
         format = taggerutils._value_from_tag_format("%TRACKNO%-%ARTIST%-%TITLE%", 1, 1, ".flac")
         assert format == "01-Gigi D'Agostino-La Passion (Radio Cut)"
 
+    def test_compile_format(self):
+        program = compile_format("%TRACKNO%-%ARTIST%-%TITLE%%TYPE%")
+        assert compile_format("%TRACKNO%-%ARTIST%-%TITLE%%TYPE%") is program
+        assert len(program.program) == 6
+
+        assert program.render(self.album, 1, 2, ".flac") == "02-Jeanette Biedermann-Go Back (Radio Edit).flac"
+
+        # unknown variables are kept
+        program = compile_format("%GROUP%-%FOO%ALBTITLE%")
+        assert program.render(self.album) == "%GROUP%-%FOOMegahits 2001 Die Erste"
+
+        # only the used variables are evaluated (there are no tracks yet)
+        album = Album(1, "100%TITLE%", ["Artist"])
+        assert compile_format("%ALBARTIST%-%ALBTITLE%").render(album) == "Artist-100%TITLE%"
+
     def test_value_from_tag(self):
         taggerutils = TaggerUtils("dummy_source_dir", "dummy_dest_dir", self.tagger_config, self.album)
 
@@ -93,6 +124,106 @@ class TestTaggerUtils(TaggerUtilsBase):
         assert taggerutils.dest_dir_name == "dummy_dest_dir/electronic/various/megahits_2001_die_erste-(560_938-2)-2001"
 
 
+def legacy_clean_filename(f, char_exceptions, use_lower):
+    """ get_clean_filename as it was before the FilenameSanitizer """
+    filename, fileext = os.path.splitext(f)
+
+    if not fileext in TaggerUtils.FILE_TYPE and not fileext in [".m3u", ".nfo"]:
+        filename = f
+        fileext = ""
+
+    a = unicode(filename, "utf-8")
+
+    for k, v in char_exceptions.iteritems():
+        a = a.replace(k, v)
+
+    a = normalize("NFKD", a).encode("ascii", "ignore")
+
+    cf = re.compile(r"[^-\w.\(\)_]")
+    cf = cf.sub("", str(a))
+
+    cf = cf.replace(" ", "_")
+    cf = cf.replace("__", "_")
+    cf = cf.replace("_-_", "-")
+
+    cf = "".join([cf, fileext])
+
+    if use_lower:
+        cf = cf.lower()
+
+    return cf
+
+class TestFilenameSanitizer(object):
+    """ the sanitizer has to clean the names exactly like get_clean_filename did before
+    """
+
+    def names(self, tagger_config):
+        """ all names (cleaned once and twice) and values of the test releases """
+        for json_file in sorted(glob.glob(os.path.join(parentdir, "test/release/*.json"))):
+            ogsrelid = os.path.basename(json_file).split(".")[0]
+            album = DummyDiscogsAlbum(TestDummyResponse(ogsrelid)).map()
+            taggerutils = TaggerUtils("dummy_source_dir", "dummy_dest_dir", tagger_config, album)
+
+            for format in [taggerutils.m3u_format, taggerutils.nfo_format] + taggerutils.dir_format.split("/"):
+                yield taggerutils._value_from_tag_format(format)
+
+            # (not the disc and track numbers, those are not consecutive on all releases)
+            for discno, disc in enumerate(album.discs, 1):
+                yield taggerutils._value_from_tag_format(taggerutils.disc_folder_name, discno)
+
+                for trackno, track in enumerate(disc.tracks, 1):
+                    for format in (taggerutils.song_format, taggerutils.va_song_format):
+                        for filetype in (".flac", ".mp3", ".ogg"):
+                            yield taggerutils._value_from_tag_format(format, discno, trackno, filetype)
+
+                    yield str(track.title)
+                    yield " & ".join(str(x) for x in track.artists)
+
+        yield "AC+DC - Back In Black (Remastered) [2003] {space}.flac"
+        yield "__-__ a  b.c.nfo"
+
+    def check(self, char_exceptions, use_lower=True):
+        tagger_config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+        sanitizer = FilenameSanitizer(char_exceptions, use_lower)
+
+        count = 0
+        for name in self.names(tagger_config):
+            expected = legacy_clean_filename(name, char_exceptions, use_lower)
+            assert sanitizer.clean(name) == expected, name
+            assert sanitizer.clean(expected) == legacy_clean_filename(expected, char_exceptions, use_lower)
+            count = count + 1
+
+        assert count > 1000
+        return sanitizer
+
+    def test_default_exceptions(self):
+        tagger_config = TaggerConfig(os.path.join(parentdir, "test/empty.conf"))
+
+        sanitizer = self.check(tagger_config.get_character_exceptions)
+        assert sanitizer.sequential == None
+
+        self.check(tagger_config.get_character_exceptions, use_lower=False)
+
+    def test_longer_exceptions(self):
+        sanitizer = self.check({"&": "_and_", " ": "_", "ue": "U", "Ph": "F"})
+        assert sanitizer.sequential == None
+        assert sanitizer.pattern != None
+
+    def test_interfering_exceptions(self):
+        # the order of the replacements matters, they are replaced one after another
+        sanitizer = self.check({"a": "e", "e": "i", "ie": "y", "&": "and"})
+        assert sanitizer.sequential != None
+
+    def test_memo(self):
+        sanitizer = FilenameSanitizer({}, True, max_entries=2)
+
+        assert sanitizer.clean("A B.flac") == "ab.flac"
+        assert sanitizer.clean("A B.flac") == "ab.flac"
+        sanitizer.clean("C")
+        sanitizer.clean("D")
+
+        assert len(sanitizer._names) == 2
+
 class TestTaggerUtilFiles(TaggerUtilsBase):
 
     def setUp(self):
@@ -189,6 +320,10 @@ class TestTaggerUtilFiles(TaggerUtilsBase):
         assert self.album.discs[0].sourcedir == "disc1"
         assert self.album.discs[1].sourcedir == "disc2"
 
+        # the source directory was read once, the later stages use the snapshot
+        assert self.album.snapshot.dirs() == ["disc1", "disc2"]
+        assert "01-song.flac" in self.album.snapshot.subdir("disc1")
+
         assert self.album.target_dir == os.path.join(self.target_dir, "various-megahits_2001_die_erste-(560_938-2)-2001")
 
         assert self.album.discs[0].target_dir == "megahits_2001_die_erste-disc1"
@@ -212,6 +347,25 @@ class TestTaggerUtilFiles(TaggerUtilsBase):
         assert self.album.discs[1].tracks[19].orig_file == "20-song.flac"
         assert self.album.discs[1].tracks[19].new_file == "20-jay-z-i_just_wanna_love_u_(give_it_2_me)_(radio_edit).flac"
 
+    def test_get_target_list_unreadable_disc(self):
+        self.copy_files(self.album)
+
+        original_scan = DirectorySnapshot.__dict__["scan"]
+        scan = DirectorySnapshot.scan.im_func
+
+        def scan_readable(cls, path, depth=1):
+            if os.path.basename(path) == "disc2":
+                raise OSError(errno.EACCES, "Permission denied", path)
+            return scan(cls, path, depth)
+
+        DirectorySnapshot.scan = classmethod(scan_readable)
+        try:
+            taggerutils = TaggerUtils(self.source_dir, self.target_dir, self.tagger_config, self.album)
+
+            assert_raises(TaggerError, taggerutils._get_target_list)
+        finally:
+            DirectorySnapshot.scan = original_scan
+
     def test_get_target_list_single_disc(self):
         self.ogsrelid = "3083"
 
@@ -245,6 +399,36 @@ class TestTaggerUtilFiles(TaggerUtilsBase):
         assert self.album.discs[0].copy_files[1] == "album.m3u"
         assert self.album.discs[0].copy_files[2] == "id.txt"
 
+    def test_get_target_list_double_vinyl_in_single_folder(self):
+        """ the sides of a 2xLP ripped into a single folder are split between the discs """
+        data = read_release_json(os.path.join(parentdir, "test/release/3083.json"))
+
+        positions = ["A1", "A2", "A3", "A4", "B1", "B2", "B3", "B4", "C1", "C2", "C3", "C4",
+                     "D1", "D2", "D3", "D4", "D5"]
+        tracklist = [dict(track, position=position) for track, position in zip(data["tracklist"], positions)]
+        formats = [dict(data["formats"][0], name="Vinyl", qty="2")]
+
+        client = discogs.Client('Dummy Client - just for unit testing')
+        self.album = DiscogsAlbum(discogs.Release(client, dict(data, tracklist=tracklist, formats=formats))).map()
+
+        assert self.album.has_multi_disc
+
+        self.copy_files_single_album(17)
+
+        taggerutils = TaggerUtils(self.source_dir, self.target_dir, self.tagger_config, self.album)
+        taggerutils._get_target_list()
+
+        assert [track.orig_file for track in self.album.discs[0].tracks] == \
+            ["%.2d-song.flac" % i for i in range(1, 9)]
+        assert [track.orig_file for track in self.album.discs[1].tracks] == \
+            ["%.2d-song.flac" % i for i in range(9, 18)]
+        assert self.album.discs[1].tracks[0].tracknumber == 1
+
+        # the other files are copied once
+        assert self.album.copy_files == ["album.cue", "album.m3u", "id.txt"]
+        assert self.album.discs[0].copy_files == []
+        assert self.album.discs[1].copy_files == []
+
     def test_get_target_list_single_disc_with_subtracks(self):
         """
             Some releases do have "subtracks" (see 513904, track 15), which means that there
@@ -322,10 +506,15 @@ class TestTaggerUtilFiles(TaggerUtilsBase):
 
         assert taggerutils.create_nfo(self.target_dir)
 
+        # the templates are compiled once into the cache directory
+        assert os.listdir(os.path.join(self.cache_dir, "templates"))
+
         # copy file to source directory and rename it
         self.copy_files_single_album(17)
 
+        lookup = taggerutils.template_lookup
         taggerutils = TaggerUtils(self.source_dir, self.target_dir, self.tagger_config, self.album)
+        assert taggerutils.template_lookup is lookup
 
         taggerutils._get_target_list()
         assert self.album.discs[0].tracks[0].new_file == "01-yonderboi-intro.flac"
@@ -557,6 +746,7 @@ class TestFileHandler(TestTaggerUtilFiles):
         config = self.tagger_config
         config.set("discogs", "consumer_key", consumer_key)
         config.set("discogs", "consumer_secret", consumer_secret)
+        config.set("cache", "dir", self.cache_dir)
 
         discogs_connection = DiscogsConnector(config)
         testFileHandler = FileHandler(self.album, config)
@@ -592,6 +782,7 @@ class TestFileHandler(TestTaggerUtilFiles):
 
         config.set("discogs", "consumer_key", consumer_key)
         config.set("discogs", "consumer_secret", consumer_secret)
+        config.set("cache", "dir", self.cache_dir)
 
         discogs_connection = DiscogsConnector(config)
         testFileHandler = FileHandler(self.album, config)